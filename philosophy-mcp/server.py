@@ -9,11 +9,41 @@ Implementa 10 pasos obligatorios (q0-q9) con 8 herramientas.
 "Verificar ANTES de escribir, no DESPUÉS de fallar"
 """
 
+import io
+import os
 import re
+import sys
 import json
+import math
+import mmap
+import ast
+import asyncio
+import stat
+import time
+import array
+import errno
+import bisect
+import ctypes
+import ctypes.util
+import select
+import struct
+import sqlite3
 import difflib
+import hashlib
+import operator
+import functools
+import multiprocessing
+import itertools
+import threading
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
 
 from mcp.server import Server
 from mcp.types import Tool, TextContent
@@ -292,7 +322,8 @@ PHILOSOPHY = {
             # Color hardcodeado se detecta por línea en step8_validate (necesita contexto de línea)
         ],
         "python": [
-            (r"def\s+\w+\([^)]*\):\s*\n(?:\s+.+\n){50,}", "Función muy larga (>50 líneas). Divide en funciones más pequeñas."),
+            # Función muy larga (>50 líneas): se cuenta por líneas en aplicar_reglas_validacion
+            # (la regex multilínea retrocedía sin límite en archivos grandes)
         ],
         "web": [
             (r'style\s*=\s*["\']', "Evita estilos inline. Usa clases CSS reutilizables."),
@@ -675,6 +706,14 @@ Usa usuario_confirmo_warnings=true solo DESPUÉS de que el usuario confirme.""",
                         "type": "string",
                         "description": "Nombre del archivo. Opcional si se usa file_path (se extrae automáticamente)."
                     },
+                    "diff": {
+                        "type": "string",
+                        "description": "Diff unificado (git diff / diff -u) contra version_base, en lugar de code o file_path. Útil para escenas .tscn grandes."
+                    },
+                    "version_base": {
+                        "type": "string",
+                        "description": "VERSIÓN devuelta por una validación anterior de este archivo en esta sesión. Obligatoria con diff."
+                    },
                     "usuario_confirmo_warnings": {
                         "type": "boolean",
                         "description": "SOLO usar después de preguntar al usuario. True = usuario confirmó ignorar advertencias."
@@ -695,6 +734,42 @@ Usa usuario_confirmo_warnings=true solo DESPUÉS de que el usuario confirme.""",
                 "required": ["filename"]
             }
         ),
+        Tool(
+            name="philosophy_validate_batch",
+            description="""PASO 8 para varios archivos: valida todos en paralelo con las mismas reglas que philosophy_validate.
+Usar cuando un cambio o refactor toca muchos archivos.
+Requiere: Paso 6 completado + código escrito.
+
+Si hay advertencias, DEBES preguntar al usuario con AskUserQuestion.
+Usa usuario_confirmo_warnings=true solo DESPUÉS de que el usuario confirme.""",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "file_paths": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Rutas absolutas de los archivos a validar"
+                    },
+                    "usuario_confirmo_warnings": {
+                        "type": "boolean",
+                        "description": "SOLO usar después de preguntar al usuario. True = usuario confirmó ignorar advertencias."
+                    },
+                    "decision_usuario": {
+                        "type": "boolean",
+                        "description": "PASO 1 para saltar: True + justificacion_salto. El MCP registra y pide que PREGUNTES al usuario."
+                    },
+                    "justificacion_salto": {
+                        "type": "string",
+                        "description": "OBLIGATORIO con decision_usuario=true. Tu razón para saltar el paso."
+                    },
+                    "usuario_verifico": {
+                        "type": "boolean",
+                        "description": "PASO 2 para saltar: True DESPUÉS de que el usuario confirmó con AskUserQuestion."
+                    }
+                },
+                "required": ["file_paths"]
+            }
+        ),
         # Paso 9 (documentar)
         Tool(
             name="philosophy_q9_documentar",
@@ -892,6 +967,59 @@ Muestra:
                 },
                 "required": []
             }
+        ),
+        Tool(
+            name="philosophy_duplication_report",
+            description="""INFORME DE DUPLICACIÓN de todo el proyecto.
+
+Busca código repetido en TODOS los archivos fuente de una vez (no solo en
+los que encuentra q3) y agrupa los clones con sus rangos de líneas.
+
+Úsalo para:
+- Planificar extracción de clases base en un análisis arquitectónico
+- Encontrar copias de código antes de refactorizar
+
+Ignora comentarios y espacios. Las huellas de cada archivo se guardan en el
+índice del proyecto: solo se recalculan los archivos que cambian.""",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "project_path": {
+                        "type": "string",
+                        "description": "Ruta del proyecto a analizar"
+                    },
+                    "language": {
+                        "type": "string",
+                        "enum": ["godot", "python", "web", "other"],
+                        "description": "Limitar a archivos de este lenguaje (opcional, por defecto todos)"
+                    }
+                },
+                "required": ["project_path"]
+            }
+        ),
+        Tool(
+            name="philosophy_resource_duplication_report",
+            description="""RECURSOS REPETIDOS ENTRE ESCENAS GODOT.
+
+Revisa todos los .tscn/.tres del proyecto de una vez y agrupa los SubResources
+(StyleBoxFlat, fuentes, gradientes...) y bloques de theme_overrides copiados
+entre escenas, idénticos o casi idénticos (>80% de propiedades iguales).
+
+Para cada grupo estima el ahorro de extraerlo a un .tres compartido (o a un
+Theme) e indica si ya existe un .tres igual que se pueda reutilizar.
+
+Los recursos de cada escena se guardan en el índice del proyecto: solo se
+recalculan las escenas que cambian.""",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "project_path": {
+                        "type": "string",
+                        "description": "Ruta del proyecto Godot a analizar"
+                    }
+                },
+                "required": ["project_path"]
+            }
         )
     ]
 
@@ -974,6 +1102,17 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
             code=arguments.get("code"),
             filename=arguments.get("filename"),
             file_path=arguments.get("file_path"),
+            diff=arguments.get("diff"),
+            version_base=arguments.get("version_base"),
+            usuario_confirmo_warnings=arguments.get("usuario_confirmo_warnings", False),
+            decision_usuario=arguments.get("decision_usuario", False),
+            justificacion_salto=arguments.get("justificacion_salto"),
+            usuario_verifico=arguments.get("usuario_verifico", False)
+        )
+
+    elif name == "philosophy_validate_batch":
+        result = await step8_validate_batch(
+            file_paths=arguments["file_paths"],
             usuario_confirmo_warnings=arguments.get("usuario_confirmo_warnings", False),
             decision_usuario=arguments.get("decision_usuario", False),
             justificacion_salto=arguments.get("justificacion_salto"),
@@ -1025,12 +1164,160 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
             arguments.get("project_path")
         )
 
+    elif name == "philosophy_duplication_report":
+        result = await duplication_report(
+            arguments["project_path"],
+            arguments.get("language")
+        )
+
+    elif name == "philosophy_resource_duplication_report":
+        result = await resource_duplication_report(arguments["project_path"])
+
     else:
         result = f"Error: Herramienta '{name}' no encontrada"
 
     return [TextContent(type="text", text=result)]
 
 
+# ============================================================
+# EJECUCIÓN FUERA DEL BUCLE DE EVENTOS
+# ============================================================
+# El servidor atiende todas las herramientas en un único bucle asyncio sobre
+# stdio. El trabajo bloqueante (recorrer el proyecto, leer archivos, regex)
+# se ejecuta en un pool de hilos acotado para que el bucle siga respondiendo,
+# y cada proyecto admite un número limitado de análisis simultáneos.
+#
+# El cálculo intensivo (firmas y huellas de muchos archivos, comparaciones de
+# similitud) se reparte en trozos entre procesos para usar todos los núcleos.
+# PHILOSOPHY_CPU_WORKERS = número de procesos (defecto: núcleos; 1 = sin procesos)
+
+IO_MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+PROYECTO_MAX_CONCURRENCIA = 2  # Herramientas pesadas a la vez sobre un mismo proyecto
+
+CPU_MAX_WORKERS = int(os.environ.get("PHILOSOPHY_CPU_WORKERS") or 0) or (os.cpu_count() or 1)
+PROCESOS_MIN_ARCHIVOS = 32  # Por debajo, los datos se calculan en hilos al pedirlos
+PROCESOS_MIN_PARES = 20000  # Por debajo, las comparaciones no compensan el envío a procesos
+
+_EJECUTOR_IO = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="philosophy-io")
+_EJECUTOR_CPU = None
+_SEMAFOROS_PROYECTO = {}
+
+
+async def en_hilo(func, *args, **kwargs):
+    """Ejecuta una función bloqueante en el pool de E/S y espera su resultado"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EJECUTOR_IO, functools.partial(func, *args, **kwargs))
+
+
+def _ejecutor_cpu():
+    """Pool de procesos (se crea al primer uso), o None si no hay varios núcleos o no se puede crear"""
+    global _EJECUTOR_CPU
+    if _EJECUTOR_CPU is None and CPU_MAX_WORKERS > 1:
+        # forkserver evita heredar por fork los hilos y locks del servidor
+        metodos = multiprocessing.get_all_start_methods()
+        contexto = multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+        try:
+            _EJECUTOR_CPU = ProcessPoolExecutor(max_workers=CPU_MAX_WORKERS, mp_context=contexto)
+        except (OSError, NotImplementedError, ValueError):
+            _EJECUTOR_CPU = False
+    return _EJECUTOR_CPU or None
+
+
+def trocear(items: list, trozos: int) -> list:
+    """Reparte items en como mucho `trozos` listas consecutivas de tamaño parecido"""
+    tamano = max(1, -(-len(items) // max(1, trozos)))
+    return [items[i:i + tamano] for i in range(0, len(items), tamano)]
+
+
+def _entregar(al_terminar, futuro) -> None:
+    if not futuro.cancelled() and futuro.exception() is None:
+        al_terminar(futuro.result())
+
+
+async def _en_hilo_secuencial(func, trozos: list, al_terminar, limite: float = None) -> bool:
+    """Alternativa sin procesos: los trozos, uno tras otro, en un hilo del pool de E/S"""
+    def secuencial():
+        for trozo in trozos:
+            al_terminar(func(trozo))
+
+    try:
+        await asyncio.wait_for(asyncio.shield(en_hilo(secuencial)), limite)
+    except asyncio.TimeoutError:
+        return False  # El hilo sigue y guarda el resto al terminar
+    return True
+
+
+async def en_procesos(func, trozos: list, al_terminar, limite: float = None) -> bool:
+    """Ejecuta func(trozo) para cada trozo en el pool de procesos.
+
+    al_terminar(resultado) recibe cada resultado en cuanto acaba su trozo (desde
+    otro hilo), también después de volver por límite de tiempo: el trabajo en
+    curso se aprovecha. Devuelve False si venció el límite antes de terminar.
+    Si la tarea se cancela, se cancelan los trozos que no han empezado.
+    Sin pool de procesos, o si un trozo falla, se ejecuta en un hilo.
+    """
+    global _EJECUTOR_CPU
+    inicio = time.monotonic()
+    ejecutor = _ejecutor_cpu()
+    if ejecutor is None:
+        return await _en_hilo_secuencial(func, trozos, al_terminar, limite)
+
+    futuros = []
+    try:
+        for trozo in trozos:
+            futuro = ejecutor.submit(func, trozo)
+            futuro.add_done_callback(functools.partial(_entregar, al_terminar))
+            futuros.append(futuro)
+    except BrokenProcessPool:
+        _EJECUTOR_CPU = None  # Se vuelve a crear en el próximo uso
+    esperas = [asyncio.wrap_future(futuro) for futuro in futuros]
+
+    try:
+        _, pendientes = await asyncio.wait(esperas, timeout=limite) if esperas else (set(), set())
+    except asyncio.CancelledError:
+        for futuro in futuros:
+            futuro.cancel()
+        raise
+
+    # Trozos sin enviar o fallidos (p.ej. un proceso murió por memoria): en un hilo
+    fallidos = list(trozos[len(futuros):])
+    for trozo, futuro, espera in zip(trozos, futuros, esperas):
+        if espera.done() and espera.exception() is not None:
+            fallidos.append(trozo)
+            if isinstance(espera.exception(), BrokenProcessPool):
+                _EJECUTOR_CPU = None
+    if fallidos:
+        restante = None if limite is None else max(0.0, limite - (time.monotonic() - inicio))
+        return await _en_hilo_secuencial(func, fallidos, al_terminar, restante) and not pendientes
+    return not pendientes
+
+
+async def precalcular_datos(index: dict, rels: list, clave: str, limite: float = None) -> bool:
+    """Calcula en procesos un dato derivado de los archivos que aún no lo tienen.
+
+    Con pocos pendientes no hace nada: dato_indexado los calcula al pedirlos.
+    Devuelve False si venció el límite (el resto se sigue guardando al terminar).
+    """
+    pendientes = datos_pendientes(index, rels, clave)
+    if len(pendientes) < PROCESOS_MIN_ARCHIVOS:
+        return True
+    root = str(index["root"])
+    trozos = [(root, clave, parte) for parte in trocear(pendientes, CPU_MAX_WORKERS * 4)]
+    return await en_procesos(
+        calcular_datos_archivos, trozos,
+        functools.partial(guardar_datos_calculados, index, clave), limite
+    )
+
+
+def semaforo_proyecto(path: Path) -> asyncio.Semaphore:
+    """Semáforo que limita los análisis simultáneos sobre un proyecto"""
+    key = str(path)
+    semaforo = _SEMAFOROS_PROYECTO.get(key)
+    if semaforo is None:
+        semaforo = _SEMAFOROS_PROYECTO[key] = asyncio.Semaphore(PROYECTO_MAX_CONCURRENCIA)
+    return semaforo
+
+
 # ============================================================
 # IMPLEMENTACIÓN DE PASOS
 # ============================================================
@@ -1384,914 +1671,4504 @@ async def step2_reutilizacion(es_reutilizable: bool, donde: str, justificacion:
 
 
 # ============================================================
-# SISTEMA DE JERARQUIZACIÓN DE DOCUMENTACIÓN
+# RECORRIDO DEL PROYECTO (.gitignore)
 # ============================================================
+# Un único recorrido por os.scandir compartido por índice, vigilancia y
+# búsquedas: poda las carpetas ignoradas antes de entrar en ellas y respeta
+# .gitignore / .ignore (anidados, con negaciones) y .git/info/exclude.
+# Las carpetas .claude nunca se ignoran: ahí viven la documentación y los
+# análisis del propio MCP aunque el proyecto no los versione.
+
+# Carpetas que nunca se recorren, las ignore o no el proyecto
+IGNORE_DIRS = {".git", "__pycache__", "node_modules", ".godot", "addons", "venv", ".venv"}
+
+# Archivos de reglas por carpeta, de menor a mayor prioridad
+IGNORE_FILES = (".gitignore", ".ignore")
+
+# Reglas ya compiladas (ruta del archivo → (mtime_ns, tamaño, reglas))
+_CACHE_REGLAS_IGNORE = {}
+
+# Reglas activas por carpeta para ruta_ignorada ((raíz, carpeta) → (reglas del
+# padre, reglas propias, reglas activas)): la vigilancia consulta las mismas
+# carpetas en cada evento y así no se vuelven a fundir las regex
+_CACHE_REGLAS_CARPETA = {}
+
+
+def _patron_ignore_a_regex(pattern: str) -> str:
+    """Traduce un patrón de .gitignore (sin '!' ni '/' final) a regex sobre rutas posix"""
+    anclado = "/" in pattern
+    pattern = pattern.lstrip("/")
+    n = len(pattern)
+    out = []
+    i = 0
+
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+                if i + 2 == n:
+                    out.append(".*")  # 'dir/**' → todo lo que hay dentro
+                    i += 2
+                    continue
+                if pattern[i + 2] == "/":
+                    out.append("(?:.*/)?")  # '**/' → cero o más carpetas
+                    i += 3
+                    continue
+            while i + 1 < n and pattern[i + 1] == "*":
+                i += 1
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                clase = pattern[i + 1:end].replace("\\", "\\\\")
+                if clase[0] in "!^":
+                    clase = "^" + clase[1:]
+                out.append(f"[{clase}]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
 
-# Tipos de documentos y su peso base
-DOC_TYPE_WEIGHTS = {
-    "guia": 100,        # Guías para desarrolladores - máxima prioridad
-    "instrucciones": 95,
-    "arquitectura": 90,
-    "analisis": 85,
-    "plan": 70,         # Planes bajan si están completados
-    "solucion": 80,
-    "fix": 75,
-    "changelog": 40,    # Changelogs - prioridad baja (histórico)
-    "deuda": 60,
-    "indice": 20,       # Índices - muy baja prioridad
-    "readme": 30,
-    "otro": 50
-}
+    regex = "".join(out)
+    return regex if anclado else "(?:.*/)?" + regex
 
-# Tipos que permanecen vigentes aunque estén "completados/implementados"
-DOC_TYPES_ALWAYS_VALID = {"guia", "instrucciones", "arquitectura"}
 
-# Tipos que pierden relevancia cuando están "completados"
-DOC_TYPES_EXPIRE_ON_COMPLETE = {"plan", "analisis", "fix", "solucion"}
+def _compilar_reglas_ignore(text: str, base: str) -> list:
+    """Reglas de un archivo de ignore: [(regex sobre la ruta desde la raíz, negada, solo_carpetas)]"""
+    prefijo = re.escape(f"{base}/") if base else ""
+    reglas = []
+
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negada = line.startswith("!")
+        if negada:
+            line = line[1:]
+        elif line.startswith(("\\#", "\\!")):
+            line = line[1:]
+        solo_carpetas = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        try:
+            regex = re.compile(prefijo + _patron_ignore_a_regex(line) + r"\Z", re.DOTALL)
+        except re.error:
+            continue  # Patrón mal formado: git también lo ignora
+        reglas.append((regex, negada, solo_carpetas))
+    return reglas
 
 
-def extract_doc_topic(filename: str, title: str) -> str:
-    """Extrae el topic/tema principal de un documento para agrupar relacionados.
+def _leer_reglas_ignore(path: str, base: str) -> list:
+    """Reglas de un archivo de ignore, compiladas una vez por versión del archivo"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return []
+    cached = _CACHE_REGLAS_IGNORE.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    try:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            reglas = _compilar_reglas_ignore(f.read(), base)
+    except OSError:
+        reglas = []
+    _CACHE_REGLAS_IGNORE[path] = (st.st_mtime_ns, st.st_size, reglas)
+    return reglas
 
-    Ejemplo: 'GUIA_DESARROLLO_MASTER_OBSERVER.md' -> 'master_observer'
-             'architecture_analysis_master_observer_refactor_20260116.md' -> 'master_observer_refactor'
+
+def _nuevas_reglas(lista: tuple) -> dict:
+    """Conjunto de reglas activo en una carpeta.
+
+    Sin negaciones, todas las reglas se funden en una sola regex por tipo de entrada.
     """
-    # Limpiar nombre
-    name = filename.lower().replace('.md', '')
+    reglas = {"lista": lista, "fundida": False, "archivos": None, "carpetas": None}
+    if lista and not any(negada for _, negada, _ in lista):
+        reglas["fundida"] = True
+        archivos = [r.pattern for r, _, solo_carpetas in lista if not solo_carpetas]
+        carpetas = [r.pattern for r, _, _ in lista]
+        if archivos:
+            reglas["archivos"] = re.compile("|".join(f"(?:{p})" for p in archivos), re.DOTALL)
+        reglas["carpetas"] = re.compile("|".join(f"(?:{p})" for p in carpetas), re.DOTALL)
+    return reglas
+
+
+def _reglas_de_carpeta(root_str: str, rel_dir: str, reglas: dict, nombres) -> dict:
+    """Añade a las reglas heredadas las de los archivos de ignore de esta carpeta"""
+    nuevas = []
+    for nombre in IGNORE_FILES:
+        if nombre in nombres:
+            nuevas.extend(_leer_reglas_ignore(os.path.join(root_str, rel_dir, nombre), rel_dir))
+    if not nuevas:
+        return reglas
+    return _nuevas_reglas(reglas["lista"] + tuple(nuevas))
+
+
+def _esta_ignorada(reglas: dict, rel: str, es_carpeta: bool) -> bool:
+    """Aplica las reglas a una ruta: gana la última que coincide, como en git"""
+    if not reglas["lista"]:
+        return False
+    if reglas["fundida"]:
+        regex = reglas["carpetas"] if es_carpeta else reglas["archivos"]
+        return regex is not None and regex.match(rel) is not None
+    for regex, negada, solo_carpetas in reversed(reglas["lista"]):
+        if solo_carpetas and not es_carpeta:
+            continue
+        if regex.match(rel):
+            return not negada
+    return False
 
-    # Quitar prefijos comunes
-    prefixes_to_remove = [
-        'guia_desarrollo_', 'guia_', 'guide_',
-        'plan_refactorizacion_', 'plan_',
-        'architecture_analysis_', 'analisis_',
-        'solucion_', 'fix_', 'deuda_tecnica_'
-    ]
-    for prefix in prefixes_to_remove:
-        if name.startswith(prefix):
-            name = name[len(prefix):]
-            break
 
-    # Quitar sufijos de fecha (ej: _20260116)
-    name = re.sub(r'_\d{8}$', '', name)
+def _reglas_en_carpeta(root_str: str, rel_dir, padre):
+    """Reglas activas dentro de rel_dir: las de padre (las activas en la carpeta
+    de arriba) más las de sus archivos de ignore.
 
-    # Si el título es más específico, usarlo
-    title_lower = title.lower()
-    if 'master' in title_lower and 'observer' in title_lower:
-        return 'master_observer'
+    Con rel_dir None (y padre None), las de .git/info/exclude, que hereda la raíz.
+    Se guardan por carpeta y solo se recalculan si cambia algún archivo de
+    ignore de la carpeta o de sus ancestros.
+    """
+    if rel_dir is None:
+        propias = [_leer_reglas_ignore(os.path.join(root_str, ".git", "info", "exclude"), "")]
+    else:
+        propias = [
+            _leer_reglas_ignore(os.path.join(root_str, rel_dir, nombre), rel_dir) for nombre in IGNORE_FILES
+        ]
 
-    return name if name else 'general'
+    cached = _CACHE_REGLAS_CARPETA.get((root_str, rel_dir))
+    if cached is not None and cached[0] is padre and cached[1] == propias:
+        return cached[2]
 
+    nuevas = tuple(regla for reglas in propias for regla in reglas)
+    if padre is None:
+        reglas = _nuevas_reglas(nuevas)
+    else:
+        reglas = _nuevas_reglas(padre["lista"] + nuevas) if nuevas else padre
+    _CACHE_REGLAS_CARPETA[(root_str, rel_dir)] = (padre, propias, reglas)
+    return reglas
 
-def extract_doc_metadata(content: str, filename: str) -> dict:
-    """Extrae metadatos de un documento markdown."""
-    metadata = {
-        "date": None,
-        "status": None,  # None = no especificado (diferente de "desconocido")
-        "doc_type": "otro",
-    }
 
-    content_lower = content.lower()
-    filename_lower = filename.lower()
+def _reglas_hasta(root: Path, rel_dir: str):
+    """Reglas heredadas por rel_dir desde la raíz (sin las de la propia carpeta).
 
-    # 1. EXTRAER FECHA
-    date_patterns = [
-        r'última actualización[:\s]*(\d{4}-\d{2}-\d{2})',
-        r'actualizado[:\s]*(\d{4}-\d{2}-\d{2})',
-        r'fecha[:\s]*(\d{4}-\d{2}-\d{2})',
-        r'generado[:\s]*(\d{4}-\d{2}-\d{2})',
-        r'\*\*fecha:\*\*\s*(\d{4}-\d{2}-\d{2})',
-        r'\*\*última actualización:\*\*\s*(\d{4}-\d{2}-\d{2})',
-    ]
+    None si rel_dir está dentro de una carpeta .claude (ahí no se aplican).
+    """
+    root_str = str(root)
+    partes = rel_dir.split("/") if rel_dir else []
+    if ".claude" in partes:
+        return None
+
+    reglas = _reglas_en_carpeta(root_str, None, None)
+    for i in range(len(partes)):
+        reglas = _reglas_en_carpeta(root_str, "/".join(partes[:i]), reglas)
+    return reglas
+
+
+def ruta_ignorada(root: Path, rel: str, es_carpeta: bool = False) -> bool:
+    """True si el recorrido del proyecto no llegaría a esta ruta (relativa posix)"""
+    partes = rel.split("/")
+    if any(parte in IGNORE_DIRS for parte in (partes if es_carpeta else partes[:-1])):
+        return True
+
+    # Una ruta también queda fuera si alguna carpeta por encima está ignorada
+    root_str = str(root)
+    reglas = _reglas_en_carpeta(root_str, None, None)
+    for i in range(1, len(partes) + 1):
+        if partes[i - 1] == ".claude":
+            return False
+        reglas = _reglas_en_carpeta(root_str, "/".join(partes[:i - 1]), reglas)
+        if _esta_ignorada(reglas, "/".join(partes[:i]), es_carpeta or i < len(partes)):
+            return True
+    return False
+
+
+def _recorrer(root: Path, subdir: str = ""):
+    """Recorre el proyecto una sola vez podando lo ignorado antes de descender.
+
+    Genera (ruta relativa posix, os.DirEntry, es_carpeta). Con subdir (relativa
+    a root) solo se recorre esa rama, con las reglas heredadas de sus ancestros.
+    """
+    root_str = str(root)
+    pending = [(subdir, _reglas_hasta(root, subdir))]
 
-    for pattern in date_patterns:
-        match = re.search(pattern, content_lower)
-        if match:
-            try:
-                metadata["date"] = datetime.strptime(match.group(1), "%Y-%m-%d")
-                break
-            except:
-                pass
+    while pending:
+        rel_dir, reglas = pending.pop()
+        try:
+            with os.scandir(os.path.join(root_str, rel_dir) if rel_dir else root_str) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        if reglas is not None:
+            reglas = _reglas_de_carpeta(root_str, rel_dir, reglas, {e.name for e in entries})
 
-    # Fecha en nombre de archivo (ej: _20260116)
-    if not metadata["date"]:
-        date_in_name = re.search(r'_(\d{8})\.md$', filename)
-        if date_in_name:
+        for entry in entries:
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
             try:
-                metadata["date"] = datetime.strptime(date_in_name.group(1), "%Y%m%d")
-            except:
-                pass
+                es_carpeta = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if es_carpeta:
+                if entry.name in IGNORE_DIRS:
+                    continue
+                if entry.name == ".claude":
+                    pending.append((rel, None))
+                elif reglas is None or not _esta_ignorada(reglas, rel, True):
+                    pending.append((rel, reglas))
+                else:
+                    continue
+            elif reglas is not None and _esta_ignorada(reglas, rel, False):
+                continue
+            yield rel, entry, es_carpeta
 
-    # 2. EXTRAER ESTADO (solo si está explícito)
-    status_patterns = [
-        r'\*\*estado:\*\*\s*(\w+)',
-        r'estado:\s*(\w+)',
-    ]
 
-    for pattern in status_patterns:
-        match = re.search(pattern, content_lower)
-        if match:
-            status_raw = match.group(1).lower()
-            # Normalizar
-            if "activo" in status_raw or "vigente" in status_raw:
-                metadata["status"] = "activo"
-            elif "implementado" in status_raw:
-                metadata["status"] = "implementado"
-            elif "completado" in status_raw or "terminado" in status_raw:
-                metadata["status"] = "completado"
-            elif "progreso" in status_raw or "fase" in status_raw:
-                metadata["status"] = "en_progreso"
-            elif "pendiente" in status_raw:
-                metadata["status"] = "pendiente"
-            elif "obsoleto" in status_raw or "deprecated" in status_raw:
-                metadata["status"] = "obsoleto"
-            break
+def recorrer_proyecto(root: Path, extensions, subdir: str = ""):
+    """Archivos del proyecto con alguna de las extensiones, en un solo recorrido.
 
-    # 3. EXTRAER TIPO DE DOCUMENTO
-    if "guia" in filename_lower or "guide" in filename_lower:
-        metadata["doc_type"] = "guia"
-    elif "instrucciones" in filename_lower:
-        metadata["doc_type"] = "instrucciones"
-    elif "arquitectura" in filename_lower and "analisis" not in filename_lower:
-        metadata["doc_type"] = "arquitectura"
-    elif "architecture_analysis" in filename_lower or "analisis" in filename_lower:
-        metadata["doc_type"] = "analisis"
-    elif "plan" in filename_lower:
-        metadata["doc_type"] = "plan"
-    elif "solucion" in filename_lower:
-        metadata["doc_type"] = "solucion"
-    elif "fix" in filename_lower:
-        metadata["doc_type"] = "fix"
-    elif "changelog" in filename_lower:
-        metadata["doc_type"] = "changelog"
-    elif "deuda" in filename_lower:
-        metadata["doc_type"] = "deuda"
-    elif "indice" in filename_lower:
-        metadata["doc_type"] = "indice"
+    Devuelve (ruta relativa posix, os.stat_result) por cada archivo regular.
+    """
+    extensions = set(extensions)
+    for rel, entry, es_carpeta in _recorrer(root, subdir):
+        if es_carpeta or os.path.splitext(entry.name)[1].lower() not in extensions:
+            continue
+        try:
+            if entry.is_file():
+                yield rel, entry.stat()
+        except OSError:
+            continue
 
-    return metadata
 
+def carpetas_proyecto(root: Path, subdir: str = ""):
+    """Subcarpetas no ignoradas de subdir (recursivo), como rutas relativas posix"""
+    for rel, _entry, es_carpeta in _recorrer(root, subdir):
+        if es_carpeta:
+            yield rel
 
-def calculate_doc_relevance(doc: dict, search_term: str, content: str, topic_docs: dict) -> dict:
-    """Calcula relevancia combinando: tipo + fecha + topic duplicado + frecuencia.
 
-    Retorna dict con score y razones.
-    """
-    result = {
-        "score": 0.0,
-        "priority": "NORMAL",
-        "age_label": "⚪ Sin fecha",
-        "warnings": [],
-        "is_superseded": False
-    }
+# ============================================================
+# ÍNDICE PERSISTENTE DE PROYECTO
+# ============================================================
+# Un índice por proyecto en .claude/philosophy_index.sqlite con el estado de
+# cada archivo (tamaño, mtime, hash de contenido, lenguaje) y los datos que
+# las herramientas ya extrajeron de él (file_info, metadatos de docs...).
+# Un archivo solo se vuelve a leer cuando cambia su tamaño o su mtime.
+# Cada dato derivado es una fila (ruta, clave): al guardar solo se escriben las
+# entradas que cambiaron desde el último guardado, no el índice entero.
+
+INDEX_FILENAME = "philosophy_index.sqlite"
+INDEX_FILENAME_JSON = "philosophy_index.json"  # Formato anterior: se borra al guardar
+INDEX_VERSION = 6  # 2: firmas de varias líneas; 3: file_info como registro compacto; 4: partes CamelCase en doc_terminos; 5: retorno "void" por defecto en simbolos; 6: error en file_info
+
+# Extensión → lenguaje del archivo indexado
+INDEX_EXTENSIONS = {
+    ".gd": "godot",
+    ".tscn": "godot",
+    ".tres": "godot",
+    ".py": "python",
+    ".php": "other",
+    ".js": "web",
+    ".ts": "web",
+    ".jsx": "web",
+    ".tsx": "web",
+    ".vue": "web",
+    ".svelte": "web",
+    ".md": "doc",
+}
 
-    search_lower = search_term.lower()
-    doc_type = doc.get("doc_type", "otro")
-    status = doc.get("status")  # None si no especificado
-    doc_date = doc.get("date")
-    topic = doc.get("topic", "general")
+# Índices cargados en memoria (ruta del proyecto → índice)
+_INDICES_PROYECTO = {}
+# Protege la creación de índices: un índice solo se publica tras su primer recorrido
+_LOCK_INDICES = threading.Lock()
 
-    # 1. PESO BASE POR TIPO
-    base_score = DOC_TYPE_WEIGHTS.get(doc_type, 50)
 
-    # 2. AJUSTE POR ESTADO (solo si está especificado)
-    if status:
-        if status == "obsoleto":
-            base_score *= 0.1
-            result["warnings"].append("⚠️ Marcado como obsoleto")
-        elif status == "completado" and doc_type in DOC_TYPES_EXPIRE_ON_COMPLETE:
-            base_score *= 0.5
-            result["warnings"].append("Plan/análisis completado")
-        elif status == "en_progreso":
-            base_score *= 1.1  # Bonus por estar activo
-        elif status == "activo":
-            base_score *= 1.2
+def _hash_contenido(data: bytes) -> str:
+    """Hash corto y rápido del contenido de un archivo"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
 
-    # 3. AJUSTE POR ANTIGÜEDAD
-    if doc_date:
-        days_old = (datetime.now() - doc_date).days
 
-        if days_old <= 7:
-            base_score *= 1.4
-            result["age_label"] = "🟢 Esta semana"
-        elif days_old <= 30:
-            base_score *= 1.2
-            result["age_label"] = "🟢 Este mes"
-        elif days_old <= 90:
-            base_score *= 1.0
-            result["age_label"] = "🟡 Últimos 3 meses"
-        elif days_old <= 180:
-            base_score *= 0.7
-            result["age_label"] = "🟠 3-6 meses"
-            if doc_type not in DOC_TYPES_ALWAYS_VALID:
-                result["warnings"].append("Documento de hace 3-6 meses")
-        else:
-            base_score *= 0.4
-            result["age_label"] = "🔴 +6 meses"
-            if doc_type not in DOC_TYPES_ALWAYS_VALID:
-                result["warnings"].append("Documento antiguo (+6 meses)")
+def _nueva_entrada_indice(rel: str, st) -> dict:
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "hash": None,
+        "lang": INDEX_EXTENSIONS.get(os.path.splitext(rel)[1].lower(), "other"),
+        "meta": {},
+    }
 
-    # 4. DETECCIÓN DE TOPIC DUPLICADO (superseded)
-    if topic in topic_docs:
-        same_topic_docs = topic_docs[topic]
-        if len(same_topic_docs) > 1:
-            # Ordenar por fecha (más reciente primero)
-            sorted_by_date = sorted(
-                same_topic_docs,
-                key=lambda x: x.get("date") or datetime.min,
-                reverse=True
+
+def _abrir_indice_disco(root: Path) -> sqlite3.Connection:
+    """Conexión a la base del índice, con las tablas de INDEX_VERSION (otra versión se vacía)"""
+    conexion = sqlite3.connect(root / ".claude" / INDEX_FILENAME, timeout=30)
+    if conexion.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+        with conexion:
+            conexion.execute("DROP TABLE IF EXISTS archivos")
+            conexion.execute("DROP TABLE IF EXISTS datos")
+            conexion.execute(
+                "CREATE TABLE archivos (rel TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,"
+                " hash TEXT, lang TEXT, stale INTEGER)"
             )
+            conexion.execute(
+                "CREATE TABLE datos (rel TEXT, clave TEXT, valor TEXT, PRIMARY KEY (rel, clave))"
+            )
+            conexion.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    return conexion
 
-            # Si este doc NO es el más reciente del topic
-            if doc_date and sorted_by_date[0].get("date"):
-                newest_date = sorted_by_date[0].get("date")
-                if doc_date < newest_date and doc["path"] != sorted_by_date[0]["path"]:
-                    # Hay uno más nuevo
-                    days_diff = (newest_date - doc_date).days
-                    if days_diff > 7:  # Solo si hay diferencia significativa
-                        result["is_superseded"] = True
-                        base_score *= 0.3
-                        result["warnings"].append(f"Hay versión más reciente ({days_diff} días después)")
 
-    # 5. BONUS POR FRECUENCIA DEL TÉRMINO
-    term_count = content.lower().count(search_lower)
-    if term_count >= 10:
-        base_score += 15
-    elif term_count >= 5:
-        base_score += 8
+def _cargar_indice_disco(root: Path) -> dict:
+    """Carga las entradas persistidas. Devuelve {} si no existe o es de otra versión."""
+    if not (root / ".claude" / INDEX_FILENAME).exists():
+        return {}
+    files = {}
+    try:
+        conexion = _abrir_indice_disco(root)
+        try:
+            for rel, size, mtime, content_hash, lang, stale in conexion.execute("SELECT * FROM archivos"):
+                files[rel] = {"size": size, "mtime": mtime, "hash": content_hash, "lang": lang, "meta": {}}
+                if stale:
+                    files[rel]["stale"] = True
+            filas = conexion.execute("SELECT rel, clave, valor FROM datos").fetchall()
+            # Un solo json.loads para todos los valores es mucho más rápido que uno por fila
+            valores = json.loads("[" + ",".join(valor for _, _, valor in filas) + "]")
+            for (rel, clave, _), valor in zip(filas, valores):
+                entry = files.get(rel)
+                if entry is not None:
+                    entry["meta"][clave] = valor
+        finally:
+            conexion.close()
+    except (sqlite3.Error, ValueError):
+        return {}
+    return files
+
+
+def _marcar_entrada(index: dict, rel: str) -> None:
+    """Anota que la entrada rel cambió (o se borró) y hay que guardarla. Con el lock tomado."""
+    index["sucios"].add(rel)
+
+
+def _actualizar_entrada_indice(index: dict, rel: str, st) -> bool:
+    """Sincroniza una entrada con su stat. Si cambió, queda 'stale' hasta la próxima lectura.
+
+    No se borran hash ni meta: si al releer el hash coincide (p.ej. solo se tocó el
+    mtime) los datos derivados se siguen usando. Devuelve True si la entrada cambió.
+    """
+    entry = index["files"].get(rel)
+    if entry is None:
+        index["files"][rel] = _nueva_entrada_indice(rel, st)
+    elif entry["size"] != st.st_size or entry["mtime"] != st.st_mtime_ns:
+        entry["size"] = st.st_size
+        entry["mtime"] = st.st_mtime_ns
+        entry["stale"] = True
+    else:
+        return False
+    _marcar_entrada(index, rel)
+    return True
 
-    # 6. BONUS SI APARECE EN TÍTULO
-    if search_lower in doc.get("title", "").lower():
-        base_score += 25
 
-    # 7. BONUS POR SECCIONES CLAVE
-    key_sections = ["instrucciones", "guía", "cómo", "pasos", "checklist", "para desarrolladores"]
-    for section in doc.get("relevant_sections", []):
-        if any(key in section.lower() for key in key_sections):
-            base_score += 20
-            break
+def _refrescar_indice(index: dict, subdir: str = "") -> list:
+    """Recorre el proyecto (solo stat, sin leer contenido) y sincroniza el índice.
 
-    # Determinar prioridad
-    result["score"] = round(base_score, 1)
-    if result["score"] >= 100:
-        result["priority"] = "🔥 ALTA"
-    elif result["score"] >= 60:
-        result["priority"] = "📌 MEDIA"
+    Con subdir solo se sincroniza esa rama. Devuelve las rutas nuevas o modificadas.
+    """
+    seen = set()
+    changed = []
+    prefix = f"{subdir}/" if subdir else ""
+    with index["lock"]:
+        for rel, st in recorrer_proyecto(index["root"], INDEX_EXTENSIONS, subdir):
+            seen.add(rel)
+            if _actualizar_entrada_indice(index, rel, st):
+                changed.append(rel)
+
+        removed = [rel for rel in index["files"] if rel.startswith(prefix) and rel not in seen]
+        for rel in removed:
+            del index["files"][rel]
+            _marcar_entrada(index, rel)
+    return changed
+
+
+def obtener_indice_proyecto(project_path: Path) -> dict:
+    """Devuelve el índice del proyecto, cargado una vez y refrescado por stat.
+
+    La primera llamada de la sesión lo carga de .claude/philosophy_index.sqlite y
+    arranca la vigilancia del proyecto (ver VIGILANCIA DE ARCHIVOS). Con inotify
+    activo solo se aplican los cambios notificados, sin recorrer el árbol; si no,
+    se recorre por stat. En ambos casos solo se releen los archivos que cambiaron.
+    """
+    root = Path(project_path).expanduser().resolve()
+    key = str(root)
+
+    index = _INDICES_PROYECTO.get(key)
+    if index is None:
+        # Quien llegue mientras se crea espera aquí: nunca ve un índice a medio llenar
+        with _LOCK_INDICES:
+            index = _INDICES_PROYECTO.get(key)
+            if index is None:
+                index = {
+                    "root": root,
+                    "files": _cargar_indice_disco(root),
+                    "lock": threading.RLock(),
+                    "sucios": set(),  # rutas cambiadas o borradas desde el último guardado
+                    "lock_guardado": threading.Lock(),
+                    "vigilancia": None,
+                }
+                # Vigilar ANTES del primer recorrido para no perder cambios intermedios;
+                # los eventos esperan en el kernel hasta activar la vigilancia
+                iniciar_vigilancia(index)
+                _refrescar_indice(index)
+                activar_vigilancia(index)
+                _INDICES_PROYECTO[key] = index
+                return index
+
+    if vigilancia_inotify_activa(index):
+        aplicar_cambios_vigilados(index)
     else:
-        result["priority"] = "📎 BAJA"
+        _refrescar_indice(index)
 
-    return result
+    return index
 
 
-def search_project_documentation(project_path: Path, search_term: str) -> dict:
-    """Busca documentación relevante con jerarquización inteligente.
+def archivos_indexados(index: dict, extensions=None) -> list:
+    """Rutas relativas (posix, ordenadas) del índice, opcionalmente filtradas por extensión"""
+    with index["lock"]:
+        rels = list(index["files"])
+    if extensions is not None:
+        exts = tuple(extensions)
+        rels = [rel for rel in rels if rel.lower().endswith(exts)]
+    rels.sort()
+    return rels
 
-    Retorna dict con:
-    - primary: Lista de docs principales (más relevantes, no superseded)
-    - secondary: Lista de docs secundarios (superseded o antiguos)
-    - topics: Dict de topics encontrados
+
+def _leer_con_hash(index: dict, rel: str):
+    """Lee un archivo del índice y actualiza su hash. Devuelve (contenido, hash) o (None, None).
+
+    Si el contenido cambió respecto al hash guardado, se descartan los datos derivados.
     """
-    all_docs = []
-    search_lower = search_term.lower()
+    try:
+        data = (index["root"] / rel).read_bytes()
+    except OSError:
+        return None, None
+
+    content_hash = _hash_contenido(data)
+    with index["lock"]:
+        entry = index["files"].get(rel)
+        if entry is not None:
+            if entry["hash"] != content_hash:
+                entry["hash"] = content_hash
+                entry["meta"] = {}
+                _marcar_entrada(index, rel)
+            if entry.pop("stale", False):
+                _marcar_entrada(index, rel)
+
+    return data.decode('utf-8', errors='ignore'), content_hash
+
+
+def leer_archivo_indexado(index: dict, rel: str):
+    """Lee un archivo del índice manteniendo su hash al día. Devuelve None si no se puede leer."""
+    return _leer_con_hash(index, rel)[0]
+
+
+# Datos derivados que se guardan en el índice: prefijo de clave → fn(file_path, content, arg).
+# La clave completa es "prefijo:arg" (p.ej. "file_info:godot"). Al estar registrados,
+# la vigilancia puede recalcularlos en segundo plano cuando un archivo cambia.
+EXTRACTORES_INDICE = {
+    "file_info": lambda file_path, content, language: get_file_info(file_path, language, content),
+    "doc_info": lambda file_path, content, _: extraer_info_documento(content, file_path.name),
+    "doc_terminos": lambda file_path, content, _: extraer_terminos_documento(content),
+    "simbolos": lambda file_path, content, _: extraer_simbolos(content, _lenguaje_simbolos(file_path.name)),
+    "huellas": lambda file_path, content, _: huellas_winnowing(content, _comentario_de(file_path.name)),
+    "sospechoso": lambda file_path, content, language: patron_sospechoso(content, language),
+    "minhash": lambda file_path, content, _: firma_minhash(content, _comentario_de(file_path.name)),
+    "tipo2": lambda file_path, content, _: tokens_tipo2(content, _comentario_de(file_path.name)),
+    "ast_py": lambda file_path, content, _: huellas_ast(content),
+    "recursos": lambda file_path, content, _: recursos_de_escena(content, file_path.name),
+}
 
-    # Carpetas donde buscar
-    doc_locations = [
-        project_path / ".claude",
-        project_path / "docs",
-    ]
 
-    for claude_dir in project_path.rglob(".claude"):
-        if claude_dir.is_dir() and claude_dir not in doc_locations:
-            doc_locations.append(claude_dir)
+def dato_indexado(index: dict, rel: str, clave: str):
+    """Devuelve un dato derivado de un archivo, calculándolo solo si el archivo cambió.
 
-    # Primera pasada: recolectar todos los docs
-    for doc_dir in doc_locations:
-        if not doc_dir.exists():
+    El extractor de la clave (EXTRACTORES_INDICE) debe devolver un valor serializable
+    en JSON. Devuelve None si el archivo no está en el índice o no se puede leer.
+    """
+    with index["lock"]:
+        entry = index["files"].get(rel)
+        if entry is None:
+            return None
+        if not entry.get("stale") and clave in entry["meta"]:
+            return entry["meta"][clave]
+
+    content, content_hash = _leer_con_hash(index, rel)
+    if content is None:
+        return None
+
+    prefijo, _, arg = clave.partition(":")
+    value = EXTRACTORES_INDICE[prefijo](index["root"] / rel, content, arg)
+    with index["lock"]:
+        entry = index["files"].get(rel)
+        # Solo se guarda si nadie releyó una versión distinta mientras se calculaba
+        if entry is not None and entry["hash"] == content_hash:
+            entry["meta"][clave] = value
+            _marcar_entrada(index, rel)
+    return value
+
+
+def datos_pendientes(index: dict, rels: list, clave: str) -> list:
+    """Rutas del índice cuyo dato derivado falta o está desactualizado"""
+    with index["lock"]:
+        pendientes = []
+        for rel in rels:
+            entry = index["files"].get(rel)
+            if entry is not None and (entry.get("stale") or clave not in entry["meta"]):
+                pendientes.append(rel)
+    return pendientes
+
+
+def calcular_datos_archivos(trozo: tuple) -> list:
+    """Calcula un dato derivado sin tocar el índice (se ejecuta en otro proceso).
+
+    trozo = (raíz, clave, rutas). Devuelve [(ruta, hash del contenido, valor)].
+    """
+    root, clave, rels = trozo
+    prefijo, _, arg = clave.partition(":")
+    resultados = []
+    for rel in rels:
+        file_path = Path(root) / rel
+        try:
+            data = file_path.read_bytes()
+        except OSError:
             continue
+        content = data.decode('utf-8', errors='ignore')
+        resultados.append((rel, _hash_contenido(data), EXTRACTORES_INDICE[prefijo](file_path, content, arg)))
+    return resultados
+
+
+def guardar_datos_calculados(index: dict, clave: str, resultados: list) -> None:
+    """Guarda en el índice datos calculados fuera, igual que si los leyera dato_indexado"""
+    with index["lock"]:
+        for rel, content_hash, value in resultados:
+            entry = index["files"].get(rel)
+            if entry is None:
+                continue
+            if entry["hash"] != content_hash:
+                entry["hash"] = content_hash
+                entry["meta"] = {}
+            entry.pop("stale", None)
+            entry["meta"][clave] = value
+            _marcar_entrada(index, rel)
+
+
+def agregado_indexado(index: dict, nombre: str, rels: list, clave: str, anadir, quitar) -> dict:
+    """Agregado en memoria de todo el proyecto (tabla por nombre, índice invertido...)
+    construido a partir del dato `clave` de cada archivo.
+
+    Solo se aplican los archivos cuya versión cambió desde la última llamada:
+    quitar(estado, rel, dato_anterior) y anadir(estado, rel, dato) modifican el
+    estado con el lock del índice tomado. Devuelve el estado del agregado.
+    """
+    with index["lock"]:
+        estado = index.setdefault("agregados", {}).setdefault(nombre, {"versiones": {}})
+
+    # Fuera del lock: solo se leen los archivos cambiados
+    actuales = {}
+    for rel in rels:
+        dato = dato_indexado(index, rel, clave)
+        if dato is not None:
+            actuales[rel] = (index["files"].get(rel, {}).get("hash"), dato)
+
+    with index["lock"]:
+        versiones = estado["versiones"]
+
+        for rel in [rel for rel in versiones if rel not in actuales]:
+            quitar(estado, rel, versiones.pop(rel)[1])
+
+        for rel, (content_hash, dato) in actuales.items():
+            previo = versiones.get(rel)
+            if previo is not None and previo[0] == content_hash:
+                continue
+            if previo is not None:
+                quitar(estado, rel, previo[1])
+            versiones[rel] = (content_hash, dato)
+            anadir(estado, rel, dato)
+
+    return estado
+
 
-        for md_file in doc_dir.glob("*.md"):
+def guardar_indice_proyecto(index: dict) -> None:
+    """Persiste en .claude/ las entradas que cambiaron desde el último guardado.
+
+    Con el lock del índice solo se copian las entradas cambiadas; la serialización
+    y la escritura (una transacción de SQLite) van fuera, sin bloquear a los lectores.
+    """
+    with index["lock_guardado"]:
+        with index["lock"]:
+            if not index["sucios"]:
+                return
+            files = index["files"]
+            cambios = []
+            for rel in index["sucios"]:
+                entry = files.get(rel)
+                cambios.append((rel, entry and (dict(entry), dict(entry["meta"]))))
+            index["sucios"] = set()
+
+        claude_dir = index["root"] / ".claude"
+        try:
+            claude_dir.mkdir(exist_ok=True)
+            conexion = _abrir_indice_disco(index["root"])
             try:
-                content = md_file.read_text(encoding='utf-8', errors='ignore')
+                with conexion:
+                    for rel, copia in cambios:
+                        conexion.execute("DELETE FROM datos WHERE rel = ?", (rel,))
+                        if copia is None:
+                            conexion.execute("DELETE FROM archivos WHERE rel = ?", (rel,))
+                            continue
+                        entry, meta = copia
+                        conexion.execute(
+                            "INSERT OR REPLACE INTO archivos VALUES (?, ?, ?, ?, ?, ?)",
+                            (rel, entry["size"], entry["mtime"], entry["hash"], entry["lang"],
+                             int(entry.get("stale", False)))
+                        )
+                        conexion.executemany(
+                            "INSERT INTO datos VALUES (?, ?, ?)",
+                            [(rel, clave, json.dumps(valor, ensure_ascii=False, separators=(',', ':')))
+                             for clave, valor in meta.items()]
+                        )
+            finally:
+                conexion.close()
+            (claude_dir / INDEX_FILENAME_JSON).unlink(missing_ok=True)
+        except (OSError, sqlite3.Error):
+            # Proyecto de solo lectura: el índice sigue siendo válido en memoria
+            pass
 
-                if search_lower not in content.lower():
-                    continue
 
-                # Extraer info básica
-                title_match = re.search(r'^#\s+(.+)$', content, re.MULTILINE)
-                title = title_match.group(1) if title_match else md_file.stem
-
-                relevant_sections = []
-                current_section = None
-                for line in content.split('\n'):
-                    if line.startswith('#'):
-                        current_section = line.lstrip('#').strip()
-                    if search_lower in line.lower() and current_section:
-                        if current_section not in relevant_sections:
-                            relevant_sections.append(current_section)
-
-                metadata = extract_doc_metadata(content, md_file.name)
-                topic = extract_doc_topic(md_file.name, title)
-
-                doc_info = {
-                    "path": str(md_file),
-                    "relative_path": str(md_file.relative_to(project_path)) if md_file.is_relative_to(project_path) else md_file.name,
-                    "title": title,
-                    "relevant_sections": relevant_sections[:5],
-                    "doc_type": metadata["doc_type"],
-                    "status": metadata["status"],
-                    "date": metadata["date"],
-                    "topic": topic,
-                    "content": content  # Guardar para calcular score
-                }
+# ============================================================
+# VIGILANCIA DE ARCHIVOS (índice en caliente)
+# ============================================================
+# El servidor es un proceso stdio de larga duración: al ver un project_path por
+# primera vez se vigila el árbol y el índice se mantiene al día en memoria,
+# incluidos los datos derivados (file_info, metadatos de docs) de los archivos
+# que cambian. Linux usa inotify (vía ctypes, sin dependencias); el resto de
+# sistemas, o si inotify no está disponible, un sondeo periódico por stat.
+#
+# PHILOSOPHY_WATCHER = auto (defecto) | inotify | poll | off
+
+WATCHER_MODE = os.environ.get("PHILOSOPHY_WATCHER", "auto").lower()
+WATCHER_POLL_INTERVAL = 2.0  # segundos entre sondeos
+WATCHER_DEBOUNCE = 0.2  # agrupa ráfagas de eventos (guardar en el editor, git checkout...)
+
+# Constantes de <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+_libc = None
+
+
+def _cargar_libc():
+    """libc con inotify, o None si el sistema no lo soporta"""
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith("linux"):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+                _libc = libc
+            except (OSError, AttributeError):
+                pass
+    return _libc or None
+
+
+def _nuevo_estado_vigilancia(modo: str) -> dict:
+    return {
+        "modo": modo,  # "inotify" | "poll"
+        "activa": False,  # hasta que termina el primer recorrido (activar_vigilancia)
+        "fd": None,
+        "dirs": {},  # wd → carpeta relativa ("" = raíz)
+        "archivos": set(),  # archivos con eventos pendientes de aplicar
+        "carpetas": set(),  # carpetas creadas/movidas/borradas a re-sincronizar
+        "desbordado": False,  # la cola del kernel se desbordó → recorrido completo
+    }
+
+
+def iniciar_vigilancia(index: dict) -> None:
+    """Prepara la vigilancia del proyecto según PHILOSOPHY_WATCHER (no falla nunca).
+
+    Con inotify los watches quedan puestos, pero los eventos no se aplican hasta
+    activar_vigilancia.
+    """
+    if WATCHER_MODE == "off":
+        return
+
+    if WATCHER_MODE in ("auto", "inotify") and _cargar_libc():
+        vigilancia = _nuevo_estado_vigilancia("inotify")
+        fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd >= 0:
+            vigilancia["fd"] = fd
+            index["vigilancia"] = vigilancia
+            if _vigilar_carpeta(index, ""):
+                return
+            # Sin watches suficientes (fs.inotify.max_user_watches): pasar a sondeo
+            _cerrar_inotify(index)
+
+    index["vigilancia"] = _nuevo_estado_vigilancia("poll")
+
+
+def activar_vigilancia(index: dict) -> None:
+    """Arranca el hilo de la vigilancia preparada (tras el primer recorrido del índice)"""
+    vigilancia = index["vigilancia"]
+    if vigilancia is None:
+        return
+    vigilancia["activa"] = True
+    bucle = _bucle_inotify if vigilancia["modo"] == "inotify" else _bucle_sondeo
+    threading.Thread(
+        target=bucle, args=(index,), daemon=True, name=f"philosophy-{vigilancia['modo']}"
+    ).start()
+
+
+def vigilancia_inotify_activa(index: dict) -> bool:
+    vigilancia = index.get("vigilancia")
+    return bool(vigilancia and vigilancia["modo"] == "inotify" and vigilancia["activa"])
+
+
+def _vigilar_carpeta(index: dict, rel_dir: str) -> bool:
+    """Añade watches a una carpeta y sus subcarpetas no ignoradas. False si se agotan."""
+    vigilancia = index["vigilancia"]
+    root_str = str(index["root"])
+
+    # El watch de cada carpeta se pone antes de listarla: nada creado después se pierde
+    for current in itertools.chain([rel_dir], carpetas_proyecto(index["root"], rel_dir)):
+        full = os.path.join(root_str, current) if current else root_str
+        wd = _libc.inotify_add_watch(vigilancia["fd"], os.fsencode(full), INOTIFY_MASK)
+        if wd < 0:
+            if ctypes.get_errno() == errno.ENOSPC:
+                return False
+            continue  # Carpeta borrada mientras tanto o sin permisos
+        vigilancia["dirs"][wd] = current
+    return True
+
+
+def _dejar_de_vigilar(index: dict, rel_dir: str) -> None:
+    """Quita los watches de una carpeta movida/borrada y de sus subcarpetas"""
+    vigilancia = index["vigilancia"]
+    prefix = f"{rel_dir}/"
+    for wd, current in list(vigilancia["dirs"].items()):
+        if current == rel_dir or current.startswith(prefix):
+            _libc.inotify_rm_watch(vigilancia["fd"], wd)
+            vigilancia["dirs"].pop(wd, None)
+
+
+def _cerrar_inotify(index: dict) -> None:
+    vigilancia = index["vigilancia"]
+    vigilancia["activa"] = False
+    if vigilancia["fd"] is not None:
+        try:
+            os.close(vigilancia["fd"])
+        except OSError:
+            pass
+        vigilancia["fd"] = None
+
 
-                all_docs.append(doc_info)
+def _registrar_eventos_inotify(index: dict, data: bytes) -> None:
+    """Traduce eventos inotify a archivos/carpetas pendientes de sincronizar"""
+    vigilancia = index["vigilancia"]
+    offset = 0
 
+    while offset + INOTIFY_EVENT.size <= len(data):
+        wd, mask, _cookie, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+        offset += name_len
+
+        if mask & IN_Q_OVERFLOW:
+            vigilancia["desbordado"] = True
+            continue
+        if mask & IN_IGNORED:
+            vigilancia["dirs"].pop(wd, None)
+            continue
+
+        parent = vigilancia["dirs"].get(wd)
+        if parent is None:
+            continue
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if parent == "":
+                vigilancia["desbordado"] = True  # Se movió/borró la raíz del proyecto
+            continue
+
+        rel = f"{parent}/{name}" if parent else name
+        if mask & IN_ISDIR:
+            if ruta_ignorada(index["root"], rel, True):
+                continue
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                _dejar_de_vigilar(index, rel)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                if not _vigilar_carpeta(index, rel):
+                    vigilancia["desbordado"] = True
+            vigilancia["carpetas"].add(rel)
+        elif name in IGNORE_FILES:
+            # Cambian las reglas: se re-sincroniza la rama completa
+            vigilancia["carpetas"].add(parent)
+        elif os.path.splitext(name)[1].lower() in INDEX_EXTENSIONS:
+            if not ruta_ignorada(index["root"], rel):
+                vigilancia["archivos"].add(rel)
+
+
+def aplicar_cambios_vigilados(index: dict) -> list:
+    """Aplica al índice los cambios notificados por la vigilancia. Devuelve las rutas cambiadas."""
+    vigilancia = index["vigilancia"]
+    with index["lock"]:
+        archivos = vigilancia["archivos"]
+        carpetas = vigilancia["carpetas"]
+        desbordado = vigilancia["desbordado"]
+        vigilancia["archivos"] = set()
+        vigilancia["carpetas"] = set()
+        vigilancia["desbordado"] = False
+
+        if desbordado:
+            return _refrescar_indice(index)
+
+        changed = []
+        for rel_dir in carpetas:
+            changed.extend(_refrescar_indice(index, rel_dir))
+
+        for rel in archivos:
+            try:
+                st = os.stat(index["root"] / rel)
+            except OSError:
+                st = None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                if _actualizar_entrada_indice(index, rel, st):
+                    changed.append(rel)
+            elif index["files"].pop(rel, None) is not None:
+                _marcar_entrada(index, rel)
+    return changed
+
+
+def _recalentar(index: dict, rels: list) -> None:
+    """Recalcula en segundo plano los datos derivados que ya existían para estas rutas"""
+    for rel in rels:
+        with index["lock"]:
+            entry = index["files"].get(rel)
+            claves = list(entry["meta"]) if entry else []
+        for clave in claves:
+            try:
+                dato_indexado(index, rel, clave)
             except Exception:
+                # Un extractor que falla no debe tumbar la vigilancia
                 pass
 
-    # Agrupar por topic
-    topic_docs = {}
-    for doc in all_docs:
-        topic = doc["topic"]
-        if topic not in topic_docs:
-            topic_docs[topic] = []
-        topic_docs[topic].append(doc)
 
-    # Segunda pasada: calcular relevancia con contexto de topics
-    for doc in all_docs:
-        relevance = calculate_doc_relevance(doc, search_term, doc["content"], topic_docs)
-        doc["score"] = relevance["score"]
-        doc["priority"] = relevance["priority"]
-        doc["age_label"] = relevance["age_label"]
-        doc["warnings"] = relevance["warnings"]
-        doc["is_superseded"] = relevance["is_superseded"]
-        del doc["content"]  # Limpiar
+def _bucle_inotify(index: dict) -> None:
+    vigilancia = index["vigilancia"]
+    fd = vigilancia["fd"]
 
-    # Separar primary y secondary
-    primary = [d for d in all_docs if not d["is_superseded"] and d["score"] >= 30]
-    secondary = [d for d in all_docs if d["is_superseded"] or d["score"] < 30]
+    while vigilancia["activa"]:
+        try:
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready:
+                continue
+            # Agrupar la ráfaga completa antes de sincronizar
+            while ready:
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    data = b""
+                with index["lock"]:
+                    _registrar_eventos_inotify(index, data)
+                ready, _, _ = select.select([fd], [], [], WATCHER_DEBOUNCE)
+
+            _recalentar(index, aplicar_cambios_vigilados(index))
+            guardar_indice_proyecto(index)
+        except OSError:
+            # fd cerrado o error del kernel: las consultas vuelven a recorrer por stat
+            _cerrar_inotify(index)
+
+
+def _bucle_sondeo(index: dict) -> None:
+    vigilancia = index["vigilancia"]
+    while vigilancia["activa"]:
+        time.sleep(WATCHER_POLL_INTERVAL)
+        try:
+            changed = _refrescar_indice(index)
+            if changed:
+                _recalentar(index, changed)
+                guardar_indice_proyecto(index)
+        except Exception:
+            pass
+
+
+# ============================================================
+# SEGMENTOS DE POSTINGS (mmap)
+# ============================================================
+# Formato binario compartido por los índices invertidos del proyecto
+# (trigramas, identificadores...). Un segmento se escribe de una vez y se lee
+# con mmap: las consultas hacen búsqueda binaria sobre las claves sin cargar
+# el archivo en memoria.
+#
+#   cabecera | claves uint64 ordenadas | offsets uint32 (n+1) | postings uint32 | archivos (JSON)
+#
+# Los postings son ids de archivo: posiciones en la lista [[rel, hash], ...] del final.
+
+POSTINGS_MAGIC = b"PHPS"
+POSTINGS_VERSION = 1
+POSTINGS_HEADER = struct.Struct("=4sIIII4x")  # magic, versión, n_claves, n_postings, bytes de archivos
+
+
+def escribir_segmento_postings(destino: Path, archivos: list, postings: dict) -> None:
+    """Escribe un segmento. archivos: [[rel, hash], ...]; postings: clave → array('I') de ids."""
+    claves = array.array('Q', sorted(postings))
+    offsets = array.array('I', [0])
+    ids = array.array('I')
+    for clave in claves:
+        ids.extend(postings[clave])
+        offsets.append(len(ids))
+
+    archivos_blob = json.dumps(archivos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header = POSTINGS_HEADER.pack(POSTINGS_MAGIC, POSTINGS_VERSION, len(claves), len(ids), len(archivos_blob))
+
+    tmp_file = destino.with_suffix(destino.suffix + ".tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(header)
+        f.write(claves.tobytes())
+        f.write(offsets.tobytes())
+        f.write(ids.tobytes())
+        f.write(archivos_blob)
+    os.replace(tmp_file, destino)
+
+
+def abrir_segmento_postings(origen: Path):
+    """Abre un segmento con mmap. Devuelve None si no existe o no es válido."""
+    try:
+        with open(origen, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    vistas = []
+    try:
+        magic, version, n_claves, n_postings, archivos_len = POSTINGS_HEADER.unpack_from(mm, 0)
+        if magic != POSTINGS_MAGIC or version != POSTINGS_VERSION:
+            raise ValueError("segmento de otra versión")
+
+        base = memoryview(mm)
+        vistas.append(base)
+        pos = POSTINGS_HEADER.size
+
+        def vista(n_bytes, formato):
+            nonlocal pos
+            raw = base[pos:pos + n_bytes]
+            pos += n_bytes
+            vistas.append(raw)
+            casted = raw.cast(formato)
+            vistas.append(casted)
+            return casted
+
+        claves = vista(8 * n_claves, 'Q')
+        offsets = vista(4 * (n_claves + 1), 'I')
+        postings = vista(4 * n_postings, 'I')
+        archivos = json.loads(bytes(base[pos:pos + archivos_len]).decode('utf-8'))
+    except (ValueError, TypeError, struct.error):
+        for v in reversed(vistas):
+            v.release()
+        mm.close()
+        return None
+
+    return {
+        "mmap": mm,
+        "vistas": vistas,
+        "claves": claves,
+        "offsets": offsets,
+        "postings": postings,
+        "archivos": {rel: (file_id, content_hash) for file_id, (rel, content_hash) in enumerate(archivos)},
+        "rels": [rel for rel, _ in archivos],
+    }
+
+
+def cerrar_segmento_postings(segmento) -> None:
+    """Libera el mmap (necesario antes de reemplazar el archivo en Windows)"""
+    if not segmento:
+        return
+    for v in reversed(segmento["vistas"]):
+        v.release()
+    segmento["mmap"].close()
+
+
+def postings_de(segmento: dict, clave: int):
+    """Ids de archivo de una clave (memoryview, vacío si la clave no existe)"""
+    claves = segmento["claves"]
+    i = bisect.bisect_left(claves, clave)
+    if i < len(claves) and claves[i] == clave:
+        offsets = segmento["offsets"]
+        return segmento["postings"][offsets[i]:offsets[i + 1]]
+    return segmento["postings"][0:0]
+
+
+# Índices invertidos incrementales: un segmento base (todo el proyecto) y uno
+# delta con los archivos cambiados desde entonces. El delta se reescribe por
+# cada cambio; cuando crece demasiado se reconstruye el base.
+
+POSTINGS_MAX_FILE_SIZE = 8 * 1024 * 1024  # Archivos mayores: siempre candidatos, sin indexar
+POSTINGS_DELTA_MAX = 256  # Archivos en el delta a partir de los cuales se reconstruye el base
+
+
+def estado_segmentos(index: dict, nombre: str, base_filename: str, delta_filename: str, claves_de) -> dict:
+    """Segmentos base + delta de un índice invertido del proyecto (abiertos una vez por sesión).
+
+    claves_de(content) devuelve las claves uint64 de un archivo.
+    """
+    with index["lock"]:
+        segmentos = index.setdefault("segmentos", {})
+        estado = segmentos.get(nombre)
+        if estado is None:
+            claude_dir = index["root"] / ".claude"
+            estado = {
+                "lock": threading.Lock(),
+                "claves_de": claves_de,
+                "archivo_base": claude_dir / base_filename,
+                "archivo_delta": claude_dir / delta_filename,
+                "base": abrir_segmento_postings(claude_dir / base_filename),
+                "delta": abrir_segmento_postings(claude_dir / delta_filename),
+            }
+            segmentos[nombre] = estado
+    return estado
+
+
+def _hash_actual(index: dict, rel: str):
+    """Hash del contenido actual de un archivo indexado (lo lee solo si cambió)"""
+    with index["lock"]:
+        entry = index["files"].get(rel)
+        if entry is not None and entry["hash"] and not entry.get("stale"):
+            return entry["hash"]
+    return _leer_con_hash(index, rel)[1]
+
+
+def _reemplazar_segmento(index: dict, estado: dict, nombre: str, rels: list) -> None:
+    """Lee los archivos y reescribe un segmento ("base" o "delta") con sus claves"""
+    # Cerrar antes de reescribir: en Windows no se puede reemplazar un archivo mapeado
+    cerrar_segmento_postings(estado[nombre])
+    estado[nombre] = None
+
+    archivos = []
+    postings = {}
+    for rel in rels:
+        content, content_hash = _leer_con_hash(index, rel)
+        if content is None:
+            continue
+        file_id = len(archivos)
+        archivos.append([rel, content_hash])
+        for clave in estado["claves_de"](content):
+            ids = postings.get(clave)
+            if ids is None:
+                postings[clave] = ids = array.array('I')
+            ids.append(file_id)
+
+    destino = estado[f"archivo_{nombre}"]
+    destino.parent.mkdir(exist_ok=True)
+    escribir_segmento_postings(destino, archivos, postings)
+    estado[nombre] = abrir_segmento_postings(destino)
+
+
+def sincronizar_segmentos(index: dict, estado: dict, rels: list) -> dict:
+    """Pone los segmentos al día con el índice. Llamar con estado["lock"] tomado.
+
+    Un archivo está vigente en un segmento si el hash con el que se indexó coincide
+    con el actual; si no, se añade al delta (o se reconstruye el base).
+    Devuelve {"base": ids, "delta": ids, "grandes": rels sin indexar}.
+    """
+    with index["lock"]:
+        grandes = {
+            rel for rel in rels
+            if rel in index["files"] and index["files"][rel]["size"] > POSTINGS_MAX_FILE_SIZE
+        }
+
+    def clasificar():
+        base = estado["base"]["archivos"] if estado["base"] else {}
+        delta = estado["delta"]["archivos"] if estado["delta"] else {}
+        vigentes_base, vigentes_delta, pendientes = set(), set(), []
+        for rel in rels:
+            if rel in grandes:
+                continue
+            current = _hash_actual(index, rel)
+            if current is None:
+                continue
+            if rel in delta and delta[rel][1] == current:
+                vigentes_delta.add(delta[rel][0])
+            elif rel in base and base[rel][1] == current:
+                vigentes_base.add(base[rel][0])
+            else:
+                pendientes.append(rel)
+        return vigentes_base, vigentes_delta, pendientes
+
+    vigentes_base, vigentes_delta, pendientes = clasificar()
+
+    if pendientes:
+        delta_rels = [rel for rel, (file_id, _) in (estado["delta"]["archivos"].items() if estado["delta"] else [])
+                      if file_id in vigentes_delta]
+        n_base = len(estado["base"]["archivos"]) if estado["base"] else 0
+        reconstruir_base = not estado["base"] or len(delta_rels) + len(pendientes) > max(POSTINGS_DELTA_MAX, n_base // 10)
+
+        try:
+            if reconstruir_base:
+                cerrar_segmento_postings(estado["delta"])
+                estado["delta"] = None
+                try:
+                    os.remove(estado["archivo_delta"])
+                except OSError:
+                    pass
+                _reemplazar_segmento(index, estado, "base", [rel for rel in rels if rel not in grandes])
+            else:
+                _reemplazar_segmento(index, estado, "delta", sorted(set(delta_rels) | set(pendientes)))
+        except OSError:
+            # Sin escritura en .claude/: no se puede acotar, todos son candidatos
+            return {"base": set(), "delta": set(), "grandes": set(rels)}
+
+        vigentes_base, vigentes_delta, pendientes = clasificar()
+        # Lo que cambió mientras se construía se trata como no indexado
+        grandes |= set(pendientes)
+
+    return {"base": vigentes_base, "delta": vigentes_delta, "grandes": grandes}
+
+
+def archivos_en_segmentos(estado: dict, vigentes: dict, evaluar) -> set:
+    """Rutas vigentes que cumplen una consulta, más las no indexadas (siempre candidatas).
+
+    evaluar(segmento) devuelve un set de ids de archivo, o None si vale cualquiera.
+    """
+    encontrados = set(vigentes["grandes"])
+    for nombre in ("base", "delta"):
+        segmento = estado[nombre]
+        if not segmento or not vigentes[nombre]:
+            continue
+        ids = evaluar(segmento)
+        ids = vigentes[nombre] if ids is None else ids & vigentes[nombre]
+        encontrados.update(segmento["rels"][file_id] for file_id in ids)
+    return encontrados
+
+
+# ============================================================
+# ÍNDICE DE TRIGRAMAS (búsqueda por contenido)
+# ============================================================
+# Para content_pattern en q3: cada archivo fuente se indexa por los trigramas
+# de su contenido (casefold, en bytes UTF-8). Una regex se traduce a una
+# condición AND/OR sobre trigramas que reduce los archivos candidatos antes de
+# leer ninguno; solo los candidatos se verifican con re.search.
+#
+# Se persiste en .claude/ como segmentos base + delta (ver SEGMENTOS DE POSTINGS).
+
+TRIGRAM_FILENAME = "philosophy_trigramas.bin"
+TRIGRAM_DELTA_FILENAME = "philosophy_trigramas.delta.bin"
+TRIGRAM_EXTENSIONS = tuple(ext for ext, lang in INDEX_EXTENSIONS.items() if lang != "doc")
+
+# Nodos de la consulta: ("all",) | ("tri", clave) | ("and", [nodos]) | ("or", [nodos])
+CONSULTA_TODOS = ("all",)
+
+# Operadores de sre_parse que repiten un subpatrón (los posesivos existen desde 3.11)
+_SRE_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    _SRE_REPEATS.add(sre_parse.POSSESSIVE_REPEAT)
+_SRE_ATOMIC_GROUP = getattr(sre_parse, "ATOMIC_GROUP", object())
+
+
+def trigramas_de(data: bytes) -> set:
+    """Trigramas de bytes como enteros de 24 bits (little-endian).
+
+    Cada palabra de 4 bytes leída en los 4 desfases posibles contiene el trigrama
+    de su posición inicial; así el bucle por posición lo hace array en C.
+    """
+    n = len(data)
+    palabras = set()
+    for k in range(4):
+        m = (n - k) // 4
+        if m > 0:
+            a = array.array('I')
+            a.frombytes(data[k:k + 4 * m])
+            if sys.byteorder == "big":
+                a.byteswap()
+            palabras.update(a)
+    trigramas = {v & 0xFFFFFF for v in palabras}
+    if n >= 3:
+        trigramas.add(int.from_bytes(data[n - 3:], 'little'))
+    return trigramas
+
+
+def _claves_trigramas(content: str) -> set:
+    return trigramas_de(content.casefold().encode('utf-8'))
+
+
+def _consulta_y(partes: list) -> tuple:
+    partes = [p for p in partes if p != CONSULTA_TODOS]
+    if not partes:
+        return CONSULTA_TODOS
+    return partes[0] if len(partes) == 1 else ("and", partes)
+
+
+def _consulta_literal(texto: str) -> tuple:
+    data = texto.casefold().encode('utf-8')
+    if len(data) < 3:
+        return CONSULTA_TODOS
+    return _consulta_y([("tri", t) for t in sorted(trigramas_de(data))])
+
+
+def _consulta_desde_regex(parsed) -> tuple:
+    """Condición necesaria sobre trigramas para que la regex pueda coincidir.
+
+    Conservadora: cualquier construcción no reconocida corta el literal en curso,
+    lo que solo amplía los candidatos, nunca pierde coincidencias.
+    """
+    partes = []
+    literal = []
+
+    def cerrar_literal():
+        if literal:
+            partes.append(_consulta_literal("".join(literal)))
+            literal.clear()
+
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            literal.append(chr(av))
+            continue
+        cerrar_literal()
+        if op == sre_parse.SUBPATTERN:
+            partes.append(_consulta_desde_regex(av[-1]))
+        elif op == _SRE_ATOMIC_GROUP:
+            partes.append(_consulta_desde_regex(av))
+        elif op in _SRE_REPEATS:
+            minimo, _maximo, sub = av
+            if minimo >= 1:
+                partes.append(_consulta_desde_regex(sub))
+        elif op == sre_parse.BRANCH:
+            alternativas = [_consulta_desde_regex(alt) for alt in av[1]]
+            if CONSULTA_TODOS not in alternativas:
+                partes.append(("or", alternativas))
+
+    cerrar_literal()
+    return _consulta_y(partes)
+
+
+def consulta_trigramas(pattern: str) -> tuple:
+    """Traduce una regex a su consulta de trigramas (CONSULTA_TODOS si no se puede acotar)"""
+    try:
+        return _consulta_desde_regex(sre_parse.parse(pattern))
+    except (re.error, RecursionError, OverflowError, ValueError):
+        return CONSULTA_TODOS
+
+
+def _evaluar_consulta(consulta: tuple, segmento: dict):
+    """Ids de archivo del segmento que cumplen la consulta (None = todos)"""
+    tipo = consulta[0]
+    if tipo == "all":
+        return None
+    if tipo == "tri":
+        return set(postings_de(segmento, consulta[1]))
+    if tipo == "and":
+        resultado = None
+        for sub in consulta[1]:
+            ids = _evaluar_consulta(sub, segmento)
+            if ids is None:
+                continue
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return set()
+        return resultado
+    # "or"
+    resultado = set()
+    for sub in consulta[1]:
+        ids = _evaluar_consulta(sub, segmento)
+        if ids is None:
+            return None
+        resultado |= ids
+    return resultado
+
+
+def candidatos_por_contenido(index: dict, pattern: str, rels: list) -> list:
+    """Archivos de rels que pueden contener la regex (case-insensitive), sin leer ninguno.
+
+    Garantiza no perder coincidencias: el resultado es un superconjunto que hay
+    que verificar con re.search.
+    """
+    consulta = consulta_trigramas(pattern)
+    if consulta == CONSULTA_TODOS:
+        return list(rels)
+
+    estado = estado_segmentos(index, "trigramas", TRIGRAM_FILENAME, TRIGRAM_DELTA_FILENAME, _claves_trigramas)
+    with estado["lock"]:
+        vigentes = sincronizar_segmentos(index, estado, archivos_indexados(index, TRIGRAM_EXTENSIONS))
+        encontrados = archivos_en_segmentos(
+            estado, vigentes, lambda segmento: _evaluar_consulta(consulta, segmento)
+        )
+
+    return [rel for rel in rels if rel in encontrados]
+
+
+# ============================================================
+# TABLA DE SÍMBOLOS DEL PROYECTO
+# ============================================================
+# Definiciones de funciones de GDScript, Python y JS/TS de todo el proyecto:
+# nombre → archivo, parámetros, retorno, línea, static/async. Se extraen por
+# archivo (dato "simbolos" del índice, persistido y recalculado solo si el
+# archivo cambia) y se agregan en memoria en una tabla por nombre
+# (agregado_indexado) que se actualiza solo con los archivos cuya versión cambió.
+
+SIMBOLOS_EXTENSIONS = (".gd", ".py", ".php", ".js", ".ts", ".jsx", ".tsx", ".vue", ".svelte")
+
+# Lenguaje de extracción según la extensión del archivo (no según la sesión)
+_SIMBOLOS_PATRONES = {
+    "godot": [re.compile(
+        r'^[ \t]*(?P<static>static\s+)?func\s+(?P<name>\w+)\s*\((?P<params>[^)]*)\)(?:\s*->\s*(?P<ret>\w+))?',
+        re.MULTILINE
+    )],
+    "python": [re.compile(
+        r'^[ \t]*(?P<async>async\s+)?def\s+(?P<name>\w+)\s*\((?P<params>[^)]*)\)(?:\s*->\s*(?P<ret>\w+))?',
+        re.MULTILINE
+    )],
+    "web": [
+        # [export] [default] [async] function nombre(params)
+        re.compile(r'(?P<async>\basync\s+)?\bfunction\s*\*?\s*(?P<name>[A-Za-z_$][\w$]*)\s*\((?P<params>[^)]*)\)'),
+        # const nombre = [async] (params) =>
+        re.compile(
+            r'\b(?:const|let|var)\s+(?P<name>[A-Za-z_$][\w$]*)\s*=\s*(?P<async>async\s*)?\((?P<params>[^)]*)\)\s*=>'
+        ),
+    ],
+}
+
+
+def _lenguaje_simbolos(rel: str) -> str:
+    ext = os.path.splitext(rel)[1].lower()
+    if ext == ".gd":
+        return "godot"
+    if ext == ".py":
+        return "python"
+    return "web"  # JS/TS/PHP: `function nombre(...)`
+
+
+def extraer_simbolos(content: str, language: str) -> list:
+    """Funciones definidas en un archivo, ordenadas por línea.
+
+    Cada símbolo: {"name", "params", "return", "line", "static", "async"}.
+    """
+    patrones = _SIMBOLOS_PATRONES.get(language, [])
+    found = []
+    for patron in patrones:
+        for match in patron.finditer(content):
+            groups = match.groupdict()
+            found.append((match.start("name"), groups))
+    found.sort(key=lambda item: item[0])
+
+    simbolos = []
+    line = 1
+    last_pos = 0
+    for pos, groups in found:
+        line += content.count("\n", last_pos, pos)
+        last_pos = pos
+        simbolos.append({
+            "name": groups["name"],
+            "params": re.sub(r'\s+', ' ', groups["params"]).strip(),
+            "return": groups.get("ret") or "void",
+            "line": line,
+            "static": bool(groups.get("static")),
+            "async": bool(groups.get("async")),
+        })
+    return simbolos
+
+
+def simbolos_de_archivo(index: dict, rel: str) -> list:
+    """Símbolos de un archivo, vía índice o leyéndolo si está fuera de él.
+
+    Lanza la excepción de lectura si el archivo no se puede leer.
+    """
+    with index["lock"]:
+        indexado = rel in index["files"]
+    if indexado:
+        simbolos = dato_indexado(index, rel, "simbolos")
+        if simbolos is not None:
+            return simbolos
+    # Fuera del índice, o no se pudo leer al indexarlo: se lee aquí para tener el error
+    content = (index["root"] / rel).read_text(encoding='utf-8', errors='ignore')
+    return extraer_simbolos(content, _lenguaje_simbolos(rel))
+
+
+def _anadir_simbolos(estado: dict, rel: str, simbolos: list) -> None:
+    # Las listas no se modifican en su sitio: las copias de tabla_simbolos siguen válidas
+    por_nombre = estado.setdefault("por_nombre", {})
+    for simbolo in simbolos:
+        por_nombre[simbolo["name"]] = por_nombre.get(simbolo["name"], []) + [dict(simbolo, file=rel)]
+
+
+def _quitar_simbolos(estado: dict, rel: str, simbolos: list) -> None:
+    por_nombre = estado["por_nombre"]
+    for name in {s["name"] for s in simbolos}:
+        restantes = [s for s in por_nombre.get(name, []) if s["file"] != rel]
+        if restantes:
+            por_nombre[name] = restantes
+        else:
+            por_nombre.pop(name, None)
+
+
+def tabla_simbolos(index: dict) -> dict:
+    """Tabla nombre → [símbolo + "file"] de todo el proyecto, al día con el índice.
+
+    Devuelve una copia tomada con el lock del índice: la vigilancia puede seguir
+    actualizando la tabla compartida mientras se recorre. Las listas de símbolos
+    son las compartidas: no modificarlas.
+    """
+    estado = agregado_indexado(
+        index, "simbolos", archivos_indexados(index, SIMBOLOS_EXTENSIONS), "simbolos",
+        _anadir_simbolos, _quitar_simbolos
+    )
+    with index["lock"]:
+        return dict(estado.get("por_nombre", {}))
+
+
+def sugerir_simbolos(tabla: dict, name: str, limit: int = 3) -> list:
+    """Nombres parecidos (renombrados) de la tabla de símbolos, sin el propio nombre"""
+    return difflib.get_close_matches(name, [n for n in tabla if n != name], n=limit, cutoff=0.75)
+
+
+# ============================================================
+# ÍNDICE DE IDENTIFICADORES (¿quién me llama?)
+# ============================================================
+# Para removed_functions en q6: cada archivo fuente se indexa por los
+# identificadores que contiene (hash de 64 bits por token completo). Buscar
+# varias funciones es una consulta al índice; solo los archivos candidatos se
+# recorren por líneas, con límites de palabra (`init` no coincide con `_init_ui`).
+
+IDENT_FILENAME = "philosophy_identificadores.bin"
+IDENT_DELTA_FILENAME = "philosophy_identificadores.delta.bin"
+
+_IDENTIFICADOR_RE = re.compile(r'[^\W\d]\w*')
+
+
+def clave_identificador(token: str) -> int:
+    """Clave uint64 de un identificador (sensible a mayúsculas)"""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _claves_identificadores(content: str) -> list:
+    return [clave_identificador(token) for token in set(_IDENTIFICADOR_RE.findall(content))]
+
+
+def ocurrencias_identificadores(index: dict, names: list, rels: list) -> dict:
+    """Líneas de rels donde aparece cada nombre como palabra completa.
+
+    Devuelve {nombre: [(rel, número de línea, línea), ...]} en orden de archivo y línea.
+    Cada archivo candidato se lee una sola vez para todos los nombres.
+    """
+    ocurrencias = {name: [] for name in names}
+    names = [name for name in ocurrencias if name]
+    if not names:
+        return ocurrencias
+
+    estado = estado_segmentos(index, "identificadores", IDENT_FILENAME, IDENT_DELTA_FILENAME,
+                              _claves_identificadores)
+    with estado["lock"]:
+        vigentes = sincronizar_segmentos(index, estado, archivos_indexados(index, TRIGRAM_EXTENSIONS))
+
+        candidatos = {}  # nombre → rutas que contienen todos sus tokens
+        for name in names:
+            claves = [clave_identificador(token) for token in _IDENTIFICADOR_RE.findall(name)]
+
+            def evaluar(segmento, claves=claves):
+                if not claves:
+                    return None
+                ids = set(postings_de(segmento, claves[0]))
+                for clave in claves[1:]:
+                    if not ids:
+                        break
+                    ids &= set(postings_de(segmento, clave))
+                return ids
+
+            candidatos[name] = archivos_en_segmentos(estado, vigentes, evaluar)
+
+    patrones = {name: re.compile(rf'(?<!\w){re.escape(name)}(?!\w)') for name in names}
+    for rel in rels:
+        buscados = [name for name in names if rel in candidatos[name]]
+        if not buscados:
+            continue
+        content = leer_archivo_indexado(index, rel)
+        if content is None:
+            continue
+        for i, line in enumerate(content.split('\n'), 1):
+            for name in buscados:
+                if name in line and patrones[name].search(line):
+                    ocurrencias[name].append((rel, i, line.strip()))
+    return ocurrencias
+
+
+# ============================================================
+# SISTEMA DE JERARQUIZACIÓN DE DOCUMENTACIÓN
+# ============================================================
+
+# Tipos de documentos y su peso base
+DOC_TYPE_WEIGHTS = {
+    "guia": 100,        # Guías para desarrolladores - máxima prioridad
+    "instrucciones": 95,
+    "arquitectura": 90,
+    "analisis": 85,
+    "plan": 70,         # Planes bajan si están completados
+    "solucion": 80,
+    "fix": 75,
+    "changelog": 40,    # Changelogs - prioridad baja (histórico)
+    "deuda": 60,
+    "indice": 20,       # Índices - muy baja prioridad
+    "readme": 30,
+    "otro": 50
+}
+
+# Tipos que permanecen vigentes aunque estén "completados/implementados"
+DOC_TYPES_ALWAYS_VALID = {"guia", "instrucciones", "arquitectura"}
+
+# Tipos que pierden relevancia cuando están "completados"
+DOC_TYPES_EXPIRE_ON_COMPLETE = {"plan", "analisis", "fix", "solucion"}
+
+
+def extract_doc_topic(filename: str, title: str) -> str:
+    """Extrae el topic/tema principal de un documento para agrupar relacionados.
+
+    Ejemplo: 'GUIA_DESARROLLO_MASTER_OBSERVER.md' -> 'master_observer'
+             'architecture_analysis_master_observer_refactor_20260116.md' -> 'master_observer_refactor'
+    """
+    # Limpiar nombre
+    name = filename.lower().replace('.md', '')
+
+    # Quitar prefijos comunes
+    prefixes_to_remove = [
+        'guia_desarrollo_', 'guia_', 'guide_',
+        'plan_refactorizacion_', 'plan_',
+        'architecture_analysis_', 'analisis_',
+        'solucion_', 'fix_', 'deuda_tecnica_'
+    ]
+    for prefix in prefixes_to_remove:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+
+    # Quitar sufijos de fecha (ej: _20260116)
+    name = re.sub(r'_\d{8}$', '', name)
+
+    # Si el título es más específico, usarlo
+    title_lower = title.lower()
+    if 'master' in title_lower and 'observer' in title_lower:
+        return 'master_observer'
+
+    return name if name else 'general'
+
+
+def extract_doc_metadata(content: str, filename: str) -> dict:
+    """Extrae metadatos de un documento markdown."""
+    metadata = {
+        "date": None,
+        "status": None,  # None = no especificado (diferente de "desconocido")
+        "doc_type": "otro",
+    }
+
+    content_lower = content.lower()
+    filename_lower = filename.lower()
+
+    # 1. EXTRAER FECHA
+    date_patterns = [
+        r'última actualización[:\s]*(\d{4}-\d{2}-\d{2})',
+        r'actualizado[:\s]*(\d{4}-\d{2}-\d{2})',
+        r'fecha[:\s]*(\d{4}-\d{2}-\d{2})',
+        r'generado[:\s]*(\d{4}-\d{2}-\d{2})',
+        r'\*\*fecha:\*\*\s*(\d{4}-\d{2}-\d{2})',
+        r'\*\*última actualización:\*\*\s*(\d{4}-\d{2}-\d{2})',
+    ]
+
+    for pattern in date_patterns:
+        match = re.search(pattern, content_lower)
+        if match:
+            try:
+                metadata["date"] = datetime.strptime(match.group(1), "%Y-%m-%d")
+                break
+            except:
+                pass
+
+    # Fecha en nombre de archivo (ej: _20260116)
+    if not metadata["date"]:
+        date_in_name = re.search(r'_(\d{8})\.md$', filename)
+        if date_in_name:
+            try:
+                metadata["date"] = datetime.strptime(date_in_name.group(1), "%Y%m%d")
+            except:
+                pass
+
+    # 2. EXTRAER ESTADO (solo si está explícito)
+    status_patterns = [
+        r'\*\*estado:\*\*\s*(\w+)',
+        r'estado:\s*(\w+)',
+    ]
+
+    for pattern in status_patterns:
+        match = re.search(pattern, content_lower)
+        if match:
+            status_raw = match.group(1).lower()
+            # Normalizar
+            if "activo" in status_raw or "vigente" in status_raw:
+                metadata["status"] = "activo"
+            elif "implementado" in status_raw:
+                metadata["status"] = "implementado"
+            elif "completado" in status_raw or "terminado" in status_raw:
+                metadata["status"] = "completado"
+            elif "progreso" in status_raw or "fase" in status_raw:
+                metadata["status"] = "en_progreso"
+            elif "pendiente" in status_raw:
+                metadata["status"] = "pendiente"
+            elif "obsoleto" in status_raw or "deprecated" in status_raw:
+                metadata["status"] = "obsoleto"
+            break
+
+    # 3. EXTRAER TIPO DE DOCUMENTO
+    if "guia" in filename_lower or "guide" in filename_lower:
+        metadata["doc_type"] = "guia"
+    elif "instrucciones" in filename_lower:
+        metadata["doc_type"] = "instrucciones"
+    elif "arquitectura" in filename_lower and "analisis" not in filename_lower:
+        metadata["doc_type"] = "arquitectura"
+    elif "architecture_analysis" in filename_lower or "analisis" in filename_lower:
+        metadata["doc_type"] = "analisis"
+    elif "plan" in filename_lower:
+        metadata["doc_type"] = "plan"
+    elif "solucion" in filename_lower:
+        metadata["doc_type"] = "solucion"
+    elif "fix" in filename_lower:
+        metadata["doc_type"] = "fix"
+    elif "changelog" in filename_lower:
+        metadata["doc_type"] = "changelog"
+    elif "deuda" in filename_lower:
+        metadata["doc_type"] = "deuda"
+    elif "indice" in filename_lower:
+        metadata["doc_type"] = "indice"
+
+    return metadata
+
+
+def extraer_info_documento(content: str, filename: str) -> dict:
+    """Título, metadatos y topic de un documento, serializables para el índice del proyecto"""
+    title_match = re.search(r'^#\s+(.+)$', content, re.MULTILINE)
+    title = title_match.group(1) if title_match else Path(filename).stem
+
+    metadata = extract_doc_metadata(content, filename)
+    return {
+        "title": title,
+        "doc_type": metadata["doc_type"],
+        "status": metadata["status"],
+        "date": metadata["date"].strftime("%Y-%m-%d") if metadata["date"] else None,
+        "topic": extract_doc_topic(filename, title),
+    }
+
+
+def es_documento_proyecto(rel: str) -> bool:
+    """True para los .md de cualquier carpeta .claude/ y de docs/ en la raíz"""
+    parts = rel.split("/")
+    if len(parts) < 2 or not rel.lower().endswith(".md"):
+        return False
+    return parts[-2] == ".claude" or (len(parts) == 2 and parts[0] == "docs")
+
+
+# Índice invertido BM25 de la documentación: frecuencias de términos y secciones
+# de cada doc (dato "doc_terminos" del índice, una vez por versión del archivo)
+# agregadas en memoria en postings término → {doc: frecuencia}.
+DOC_BM25_K1 = 1.2
+DOC_BM25_B = 0.75
+DOC_BONUS_TERMINO = 15  # Bonus máximo por relevancia del término (el doc con mejor BM25)
+
+_TERMINO_DOC_RE = re.compile(r'[^\W_]+')
+
+
+def terminos_de(texto: str, partes: bool = False) -> list:
+    """Términos en minúsculas (letras y dígitos; '_' separa, como en los nombres de archivo).
+
+    Con partes, cada palabra CamelCase añade también sus partes (PlayerController →
+    playercontroller, player, controller): así 'controller' encuentra el nombre.
+    """
+    if not partes:
+        return _TERMINO_DOC_RE.findall(texto.lower())
+    terminos = []
+    for palabra in _TERMINO_DOC_RE.findall(texto):
+        minusculas = palabra.lower()
+        terminos.append(minusculas)
+        if palabra[1:] != minusculas[1:]:
+            terminos.extend(parte.lower() for parte in _partes_camel(palabra))
+    return terminos
+
+
+def _partes_camel(palabra: str) -> list:
+    """Partes de una palabra CamelCase (HTTPServer → HTTP, Server)"""
+    partes = []
+    inicio = 0
+    for i in range(1, len(palabra)):
+        if palabra[i].isupper() and (palabra[i - 1].islower() or palabra[i + 1:i + 2].islower()):
+            partes.append(palabra[inicio:i])
+            inicio = i
+    partes.append(palabra[inicio:])
+    return partes
+
+
+def extraer_terminos_documento(content: str) -> dict:
+    """Frecuencias de términos y términos por sección de un doc, serializables para el índice"""
+    tf = {}
+    secciones = []  # [[título, [términos]], ...] en orden de aparición
+    current_terms = None
+
+    for line in content.split('\n'):
+        if line.startswith('#'):
+            current_terms = set()
+            secciones.append([line.lstrip('#').strip(), current_terms])
+        words = terminos_de(line, partes=True)
+        for word in words:
+            tf[word] = tf.get(word, 0) + 1
+        if current_terms is not None:
+            current_terms.update(words)
+
+    return {
+        "len": sum(tf.values()),
+        "tf": tf,
+        "secciones": [[titulo, sorted(terms)] for titulo, terms in secciones],
+    }
+
+
+def _anadir_documento(estado: dict, rel: str, terminos: dict) -> None:
+    postings = estado.setdefault("postings", {})
+    for term, freq in terminos["tf"].items():
+        postings.setdefault(term, {})[rel] = freq
+    estado.setdefault("documentos", {})[rel] = terminos
+    estado["vocabulario"] = None
+
+
+def _quitar_documento(estado: dict, rel: str, terminos: dict) -> None:
+    postings = estado["postings"]
+    for term in terminos["tf"]:
+        docs = postings.get(term)
+        if docs is not None:
+            docs.pop(rel, None)
+            if not docs:
+                del postings[term]
+    estado["documentos"].pop(rel, None)
+    estado["vocabulario"] = None
+
+
+def indice_documentacion(index: dict) -> dict:
+    """Índice BM25 de los docs del proyecto (.claude/ y docs/), al día con el índice"""
+    rels = [rel for rel in archivos_indexados(index, [".md"]) if es_documento_proyecto(rel)]
+    estado = agregado_indexado(index, "documentacion", rels, "doc_terminos",
+                               _anadir_documento, _quitar_documento)
+    with index["lock"]:
+        estado.setdefault("postings", {})
+        estado.setdefault("documentos", {})
+        if estado.get("vocabulario") is None:
+            estado["vocabulario"] = sorted(estado["postings"])
+    return estado
+
+
+def _tiene_prefijo(terms: list, token: str) -> bool:
+    """True si algún término de la lista ordenada empieza por token"""
+    i = bisect.bisect_left(terms, token)
+    return i < len(terms) and terms[i].startswith(token)
+
+
+def _expandir_termino(vocabulario: list, token: str) -> list:
+    """Términos del vocabulario que empiezan por token ('tab' → tab, tabs, tabcontainer...)"""
+    start = bisect.bisect_left(vocabulario, token)
+    end = bisect.bisect_left(vocabulario, token + "\U0010ffff")
+    return vocabulario[start:end]
+
+
+def _expandir_infijo(vocabulario: list, token: str) -> list:
+    """Términos del vocabulario que contienen token en cualquier posición"""
+    return [term for term in vocabulario if token in term]
+
+
+def _docs_con_todos(postings: dict, expandidos: list) -> set:
+    """Docs que contienen algún término de cada lista de expandidos"""
+    candidatos = None
+    for terms in expandidos:
+        docs = set()
+        for term in terms:
+            docs.update(postings[term])
+        candidatos = docs if candidatos is None else candidatos & docs
+        if not candidatos:
+            return set()
+    return candidatos
+
+
+def _puntuar_documentos(estado: dict, search_term: str) -> dict:
+    """BM25 y secciones de los docs que contienen todos los términos de la búsqueda.
+
+    Llamar con el lock del índice tomado.
+    """
+    documentos = estado["documentos"]
+    postings = estado["postings"]
+    tokens = list(dict.fromkeys(terminos_de(search_term)))
+
+    if not tokens:
+        return {rel: {"bm25": 0.0, "secciones": []} for rel in documentos}
+
+    expandidos = [_expandir_termino(estado["vocabulario"], token) for token in tokens]
+    candidatos = _docs_con_todos(postings, expandidos)
+    infijo = not candidatos
+    if infijo:
+        # Sin coincidencias por palabra: subcadena de cualquier término, como la búsqueda original
+        expandidos = [_expandir_infijo(estado["vocabulario"], token) for token in tokens]
+        candidatos = _docs_con_todos(postings, expandidos)
+        if not candidatos:
+            return {}
+
+    n_docs = len(documentos)
+    avgdl = (sum(d["len"] for d in documentos.values()) / n_docs) or 1.0
+    scores = dict.fromkeys(candidatos, 0.0)
+    for terms in expandidos:
+        for term in terms:
+            docs = postings[term]
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for rel in candidatos:
+                freq = docs.get(rel)
+                if freq:
+                    norm = DOC_BM25_K1 * (1 - DOC_BM25_B + DOC_BM25_B * documentos[rel]["len"] / avgdl)
+                    scores[rel] += idf * freq * (DOC_BM25_K1 + 1) / (freq + norm)
+
+    resultado = {}
+    for rel, score in scores.items():
+        secciones = []
+        for titulo, terms in documentos[rel]["secciones"]:
+            if titulo and titulo not in secciones and all(
+                any(token in term for term in terms) if infijo else _tiene_prefijo(terms, token)
+                for token in tokens
+            ):
+                secciones.append(titulo)
+        resultado[rel] = {"bm25": score, "secciones": secciones}
+    return resultado
+
+
+def consultar_documentacion(index: dict, search_terms: list) -> dict:
+    """Docs que contienen todos los términos de cada búsqueda (como prefijo de una palabra
+    o de una parte CamelCase; si ninguno, como subcadena de una palabra).
+
+    El índice se sincroniza una sola vez para todas las búsquedas.
+    Devuelve {búsqueda: {rel: {"bm25": puntuación, "secciones": [títulos con todos los términos]}}}.
+    """
+    estado = indice_documentacion(index)
+    with index["lock"]:
+        return {term: _puntuar_documentos(estado, term) for term in dict.fromkeys(search_terms)}
+
+
+def calculate_doc_relevance(doc: dict, search_term: str, topic_docs: dict, bm25_max: float = 0.0) -> dict:
+    """Calcula relevancia combinando: tipo + fecha + topic duplicado + BM25 del término.
+
+    bm25_max es la mejor puntuación BM25 de la búsqueda (el bonus es relativo a ella).
+
+    Retorna dict con score y razones.
+    """
+    result = {
+        "score": 0.0,
+        "priority": "NORMAL",
+        "age_label": "⚪ Sin fecha",
+        "warnings": [],
+        "is_superseded": False
+    }
+
+    search_lower = search_term.lower()
+    doc_type = doc.get("doc_type", "otro")
+    status = doc.get("status")  # None si no especificado
+    doc_date = doc.get("date")
+    topic = doc.get("topic", "general")
+
+    # 1. PESO BASE POR TIPO
+    base_score = DOC_TYPE_WEIGHTS.get(doc_type, 50)
+
+    # 2. AJUSTE POR ESTADO (solo si está especificado)
+    if status:
+        if status == "obsoleto":
+            base_score *= 0.1
+            result["warnings"].append("⚠️ Marcado como obsoleto")
+        elif status == "completado" and doc_type in DOC_TYPES_EXPIRE_ON_COMPLETE:
+            base_score *= 0.5
+            result["warnings"].append("Plan/análisis completado")
+        elif status == "en_progreso":
+            base_score *= 1.1  # Bonus por estar activo
+        elif status == "activo":
+            base_score *= 1.2
+
+    # 3. AJUSTE POR ANTIGÜEDAD
+    if doc_date:
+        days_old = (datetime.now() - doc_date).days
+
+        if days_old <= 7:
+            base_score *= 1.4
+            result["age_label"] = "🟢 Esta semana"
+        elif days_old <= 30:
+            base_score *= 1.2
+            result["age_label"] = "🟢 Este mes"
+        elif days_old <= 90:
+            base_score *= 1.0
+            result["age_label"] = "🟡 Últimos 3 meses"
+        elif days_old <= 180:
+            base_score *= 0.7
+            result["age_label"] = "🟠 3-6 meses"
+            if doc_type not in DOC_TYPES_ALWAYS_VALID:
+                result["warnings"].append("Documento de hace 3-6 meses")
+        else:
+            base_score *= 0.4
+            result["age_label"] = "🔴 +6 meses"
+            if doc_type not in DOC_TYPES_ALWAYS_VALID:
+                result["warnings"].append("Documento antiguo (+6 meses)")
+
+    # 4. DETECCIÓN DE TOPIC DUPLICADO (superseded)
+    if topic in topic_docs:
+        same_topic_docs = topic_docs[topic]
+        if len(same_topic_docs) > 1:
+            # Ordenar por fecha (más reciente primero)
+            sorted_by_date = sorted(
+                same_topic_docs,
+                key=lambda x: x.get("date") or datetime.min,
+                reverse=True
+            )
+
+            # Si este doc NO es el más reciente del topic
+            if doc_date and sorted_by_date[0].get("date"):
+                newest_date = sorted_by_date[0].get("date")
+                if doc_date < newest_date and doc["path"] != sorted_by_date[0]["path"]:
+                    # Hay uno más nuevo
+                    days_diff = (newest_date - doc_date).days
+                    if days_diff > 7:  # Solo si hay diferencia significativa
+                        result["is_superseded"] = True
+                        base_score *= 0.3
+                        result["warnings"].append(f"Hay versión más reciente ({days_diff} días después)")
+
+    # 5. BONUS POR RELEVANCIA DEL TÉRMINO (BM25, relativo al mejor doc de la búsqueda)
+    if bm25_max > 0:
+        base_score += DOC_BONUS_TERMINO * doc.get("bm25", 0.0) / bm25_max
+
+    # 6. BONUS SI APARECE EN TÍTULO
+    if search_lower in doc.get("title", "").lower():
+        base_score += 25
+
+    # 7. BONUS POR SECCIONES CLAVE
+    key_sections = ["instrucciones", "guía", "cómo", "pasos", "checklist", "para desarrolladores"]
+    for section in doc.get("relevant_sections", []):
+        if any(key in section.lower() for key in key_sections):
+            base_score += 20
+            break
+
+    # Determinar prioridad
+    result["score"] = round(base_score, 1)
+    if result["score"] >= 100:
+        result["priority"] = "🔥 ALTA"
+    elif result["score"] >= 60:
+        result["priority"] = "📌 MEDIA"
+    else:
+        result["priority"] = "📎 BAJA"
+
+    return result
+
+
+def _jerarquizar_documentos(index: dict, project_path: Path, search_term: str, coincidencias: dict,
+                            infos: dict) -> dict:
+    """Relevancia, prioridad y separación primary/secondary de los docs de una búsqueda.
+
+    infos guarda el doc_info de cada doc ya consultado (compartido entre búsquedas).
+    """
+    all_docs = []
+
+    # Primera pasada: recolectar todos los docs
+    for rel in sorted(coincidencias):
+        if rel not in infos:
+            info = dato_indexado(index, rel, "doc_info")
+            if info is not None and info["date"]:
+                info = dict(info, date=datetime.strptime(info["date"], "%Y-%m-%d"))
+            infos[rel] = info
+        info = infos[rel]
+        if info is None:
+            continue
+
+        doc_info = {
+            "path": str(project_path / rel),
+            "relative_path": str(Path(rel)),
+            "title": info["title"],
+            "relevant_sections": coincidencias[rel]["secciones"][:5],
+            "doc_type": info["doc_type"],
+            "status": info["status"],
+            "date": info["date"],
+            "topic": info["topic"],
+            "bm25": coincidencias[rel]["bm25"],
+        }
+
+        all_docs.append(doc_info)
+
+    # Agrupar por topic
+    topic_docs = {}
+    for doc in all_docs:
+        topic = doc["topic"]
+        if topic not in topic_docs:
+            topic_docs[topic] = []
+        topic_docs[topic].append(doc)
+
+    # Segunda pasada: calcular relevancia con contexto de topics
+    bm25_max = max((doc["bm25"] for doc in all_docs), default=0.0)
+    for doc in all_docs:
+        relevance = calculate_doc_relevance(doc, search_term, topic_docs, bm25_max)
+        doc["score"] = relevance["score"]
+        doc["priority"] = relevance["priority"]
+        doc["age_label"] = relevance["age_label"]
+        doc["warnings"] = relevance["warnings"]
+        doc["is_superseded"] = relevance["is_superseded"]
+
+    # Separar primary y secondary
+    primary = [d for d in all_docs if not d["is_superseded"] and d["score"] >= 30]
+    secondary = [d for d in all_docs if d["is_superseded"] or d["score"] < 30]
+
+    # Ordenar por score
+    primary.sort(key=lambda x: x["score"], reverse=True)
+    secondary.sort(key=lambda x: x["score"], reverse=True)
+
+    return {
+        "primary": primary,
+        "secondary": secondary,
+        "topics": list(topic_docs.keys()),
+        "total": len(all_docs)
+    }
+
+
+def search_project_documentation(project_path: Path, search_term: str) -> dict:
+    """Busca documentación relevante con jerarquización inteligente.
+
+    Retorna dict con:
+    - primary: Lista de docs principales (más relevantes, no superseded)
+    - secondary: Lista de docs secundarios (superseded o antiguos)
+    - topics: Dict de topics encontrados
+    """
+    return search_project_documentation_multi(project_path, [search_term])["por_termino"][search_term]
+
+
+def search_project_documentation_multi(project_path: Path, search_terms: list, top_por_termino: int = 3) -> dict:
+    """Busca varios términos a la vez con una sola consulta al índice de documentación.
+
+    Retorna dict con:
+    - por_termino: {término: resultado de search_project_documentation}
+    - afectados: docs principales (top_por_termino de cada término) sin repetir
+    """
+    # Docs de .claude/ (a cualquier profundidad) y docs/, desde el índice BM25 del
+    # proyecto: no se lee ningún doc que no haya cambiado
+    index = obtener_indice_proyecto(project_path)
+    coincidencias = consultar_documentacion(index, search_terms)
+
+    por_termino = {}
+    afectados = []
+    vistos = set()
+    infos = {}
+    for term, docs in coincidencias.items():
+        por_termino[term] = _jerarquizar_documentos(index, project_path, term, docs, infos)
+        for doc in por_termino[term]["primary"][:top_por_termino]:
+            if doc["path"] not in vistos:
+                vistos.add(doc["path"])
+                afectados.append(doc)
+
+    guardar_indice_proyecto(index)
+
+    return {"por_termino": por_termino, "afectados": afectados}
+
+
+# ============================================================
+# DETECCIÓN DE DUPLICACIÓN (ENFOQUE HÍBRIDO)
+# ============================================================
+
+# Extensiones de código en las que busca q3
+BUSQUEDA_EXTENSIONS = [".gd", ".tscn", ".py", ".php", ".js", ".ts", ".jsx", ".tsx", ".vue"]
+
+# Similitud por MinHash: cada archivo se resume en una firma de tamaño fijo
+# (one-permutation hashing sobre shingles de tokens) y LSH por bandas propone
+# solo los pares que comparten alguna banda. Coste casi lineal en archivos.
+MINHASH_SHINGLE = 5  # Tokens por shingle
+MINHASH_CUBETAS = 128  # Valores por firma
+# Filas por banda: 32 bandas de 4, curva S centrada en Jaccard ≈ (1/32)^(1/4) ≈ 0.42,
+# que es el umbral del 60% (2J/(1+J) = 0.6 → J ≈ 0.43). Probabilidad de ser candidato:
+# 0.67 en el umbral, 0.92 con similitud 0.7, > 0.99 desde 0.8 y < 0.01 con Jaccard 0.13
+LSH_FILAS = 4
+UMBRAL_SIMILITUD = 0.6  # 60% de similitud = duplicación
+
+
+# Tokens de código: cadenas, comentarios (se descartan), palabras y símbolos
+_TOKENS_CLON = {
+    "#": re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|#[^\n]*|\w+|[^\w\s]'),
+    "//": re.compile(
+        r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|//[^\n]*|/\*.*?\*/|\w+|[^\w\s]',
+        re.DOTALL
+    ),
+}
+
+
+def _comentario_de(rel: str) -> str:
+    """Marca de comentario de línea según la extensión"""
+    return "#" if rel.lower().endswith((".gd", ".py")) else "//"
+
+
+def tokens_con_lineas(content: str, comentario: str):
+    """Tokens del código sin comentarios ni espacios, y la línea (1-based) de cada uno"""
+    tokens, lineas = [], []
+    linea, ultimo = 1, 0
+    for match in _TOKENS_CLON[comentario].finditer(content):
+        texto = match.group()
+        if texto.startswith(comentario) or texto.startswith("/*"):
+            continue
+        linea += content.count("\n", ultimo, match.start())
+        ultimo = match.start()
+        tokens.append(texto)
+        lineas.append(linea)
+    return tokens, lineas
+
+
+def firma_minhash(content: str, comentario: str) -> list:
+    """Firma MinHash del código normalizado (MINHASH_CUBETAS enteros, [] si no hay tokens).
+
+    Se calcula sobre los tokens, sin comentarios ni espacios. Cada shingle cae en una cubeta según su hash y la cubeta guarda el mínimo.
+    Las cubetas vacías copian la siguiente no vacía desplazada (densificación),
+    así dos archivos iguales siempre tienen la misma firma.
+    """
+    tokens = tokens_con_lineas(content, comentario)[0]
+    if not tokens:
+        return []
+    k = min(MINHASH_SHINGLE, len(tokens))
+    return minhash_de_conjunto({" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}, MINHASH_CUBETAS)
+
+
+def minhash_de_conjunto(elementos, cubetas: int) -> list:
+    """Firma MinHash de `cubetas` enteros de un conjunto no vacío de cadenas (one-permutation hashing)"""
+    desplazamiento = (1 << 64) // cubetas  # Rango de cada cubeta
+    firma = [None] * cubetas
+    for elemento in elementos:
+        h = int.from_bytes(hashlib.blake2b(elemento.encode('utf-8'), digest_size=8).digest(), "little")
+        cubeta, valor = h % cubetas, h // cubetas
+        if firma[cubeta] is None or valor < firma[cubeta]:
+            firma[cubeta] = valor
+
+    densa = list(firma)
+    for i, valor in enumerate(firma):
+        salto = 1
+        while valor is None:
+            valor = firma[(i + salto) % cubetas]
+            if valor is not None:
+                valor += salto * desplazamiento
+            salto += 1
+        densa[i] = valor
+    return densa
+
+
+def similitud_firmas(firma1: list, firma2: list) -> float:
+    """Similitud entre 0.0 y 1.0 estimada con dos firmas MinHash.
+
+    La fracción de cubetas iguales estima el Jaccard J de los shingles; se
+    devuelve 2J/(1+J) (Dice), que solo aproxima SequenceMatcher.ratio(): este
+    compara secuencias ordenadas y aquel conjuntos de shingles.
+    """
+    if not firma1 or not firma2:
+        return 0.0
+    jaccard = sum(map(operator.eq, firma1, firma2)) / MINHASH_CUBETAS
+    return 2 * jaccard / (1 + jaccard)
+
+
+def pares_candidatos(firmas: list, filas: int = LSH_FILAS) -> list:
+    """Pares (i, j), i < j, de firmas que coinciden en alguna banda LSH de `filas` valores"""
+    cubos = {}
+    for i, firma in enumerate(firmas):
+        if not firma:
+            continue
+        for inicio in range(0, len(firma), filas):
+            cubos.setdefault((inicio, *firma[inicio:inicio + filas]), []).append(i)
+
+    pares = set()
+    for indices in cubos.values():
+        if len(indices) > 1:
+            pares.update(itertools.combinations(indices, 2))
+    return sorted(pares)
+
+
+def similares_de_pares(trozo: tuple) -> list:
+    """Pares que superan UMBRAL_SIMILITUD (se puede ejecutar en otro proceso).
+
+    trozo = ({i: firma}, [(i, j)]). Devuelve [(i, j, similitud)].
+    """
+    firmas, pares = trozo
+    similares = []
+    for i, j in pares:
+        similitud = similitud_firmas(firmas[i], firmas[j])
+        if similitud >= UMBRAL_SIMILITUD:
+            similares.append((i, j, similitud))
+    return similares
+
+
+# Clones de tipo 2 (identificadores renombrados) en GDScript y JS: el código se
+# reduce a tokens en los que identificadores y literales son marcadores, así
+# `var vida = 10` y `var salud = 25` quedan iguales. Un arreglo de sufijos con
+# su LCP sobre los tokens de todos los sospechosos encuentra de una vez los
+# tramos comunes de al menos CLONES_TIPO2_MIN_TOKENS tokens.
+CLONES_TIPO2_EXTENSIONS = (".gd", ".js", ".jsx", ".ts", ".tsx")
+CLONES_TIPO2_MIN_TOKENS = 40  # Más corto coincide por pura sintaxis (~5 líneas)
+CLONES_TIPO2_MAX_SUFIJOS = 10  # Sufijos consecutivos que se emparejan dentro de un mismo grupo del LCP
+CLONES_MAX_FRAGMENTOS = 5  # Tramos clonados que se muestran (por detector)
+
+# Palabras que se conservan al normalizar (el resto de palabras son identificadores)
+_PALABRAS_CLAVE_TIPO2 = {
+    "#": frozenset((
+        "if", "elif", "else", "for", "while", "match", "break", "continue", "pass", "return",
+        "class", "class_name", "extends", "is", "in", "as", "self", "super", "signal", "func",
+        "static", "const", "enum", "var", "onready", "export", "setget", "get", "set", "tool",
+        "preload", "await", "yield", "assert", "breakpoint", "and", "or", "not", "true", "false",
+        "null", "void", "int", "float", "bool", "String", "Array", "Dictionary", "Vector2",
+        "Vector3", "Color", "PI", "TAU", "INF", "NAN",
+    )),
+    "//": frozenset((
+        "if", "else", "for", "while", "do", "switch", "case", "default", "break", "continue",
+        "return", "function", "class", "extends", "new", "delete", "typeof", "instanceof", "in",
+        "of", "var", "let", "const", "this", "super", "null", "undefined", "true", "false",
+        "try", "catch", "finally", "throw", "async", "await", "yield", "import", "export",
+        "from", "static", "get", "set", "void",
+    )),
+}
+
+
+def tokens_tipo2(content: str, comentario: str) -> list:
+    """Tokens normalizados para clones de tipo 2: [tokens separados por espacios, saltos].
+
+    Identificadores → "$id"; cadenas y números → "$lit"; palabras clave y
+    símbolos se conservan. saltos = [[posición del token, línea]] cada vez
+    que cambia la línea.
+    """
+    palabras = _PALABRAS_CLAVE_TIPO2[comentario]
+    tokens, lineas = tokens_con_lineas(content, comentario)
+    normalizados = []
+    saltos = []
+    for pos, (token, linea) in enumerate(zip(tokens, lineas)):
+        if token[0] in "\"'`" or token[0].isdigit():
+            token = "$lit"
+        elif token not in palabras and (token[0].isalpha() or token[0] == "_"):
+            token = "$id"
+        normalizados.append(token)
+        if not saltos or saltos[-1][1] != linea:
+            saltos.append([pos, linea])
+    return [" ".join(normalizados), saltos]
+
+
+def arreglo_de_sufijos(secuencia: list) -> list:
+    """Arreglo de sufijos de una secuencia de enteros, por duplicación de prefijos.
+
+    Cada ronda ordena por (rango de los k primeros, rango de los k siguientes) y
+    dobla k; termina en cuanto todos los rangos son distintos (como mucho log n rondas).
+    """
+    n = len(secuencia)
+    valores = {valor: r for r, valor in enumerate(sorted(set(secuencia)), 1)}
+    rango = [valores[valor] for valor in secuencia]  # 0 = más allá del final
+    sufijos = list(range(n))
+    k = 1
+    while n:
+        clave = [a * (n + 1) + b for a, b in zip(rango, itertools.chain(rango[k:], itertools.repeat(0, k)))]
+        sufijos.sort(key=clave.__getitem__)
+        ordenadas = [clave[i] for i in sufijos]
+        rangos = itertools.accumulate(map(operator.ne, ordenadas, itertools.chain([None], ordenadas)))
+        nuevo = [0] * n
+        for i, r in zip(sufijos, rangos):
+            nuevo[i] = r
+        rango = nuevo
+        if r == n:
+            break
+        k *= 2
+    return sufijos
+
+
+def lcp_de_sufijos(secuencia: list, sufijos: list) -> list:
+    """lcp[r] = prefijo común de los sufijos sufijos[r - 1] y sufijos[r] (Kasai, O(n))"""
+    n = len(sufijos)
+    posicion = [0] * n
+    for r, i in enumerate(sufijos):
+        posicion[i] = r
+    lcp = [0] * n
+    h = 0
+    for i in range(n):
+        r = posicion[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sufijos[r - 1]
+        while i + h < n and j + h < n and secuencia[i + h] == secuencia[j + h]:
+            h += 1
+        lcp[r] = h
+        if h:
+            h -= 1
+    return lcp
+
+
+def clones_tipo2(cadenas: list) -> list:
+    """Tramos comunes de al menos CLONES_TIPO2_MIN_TOKENS tokens entre archivos distintos.
+
+    cadenas = tokens normalizados de cada archivo (tokens_tipo2). Devuelve
+    [(i, inicio en i, j, inicio en j, longitud)] con i < j, en tokens.
+    """
+    vocabulario = {}
+    secuencia = []
+    archivo_de = []
+    inicios = []
+    for i, cadena in enumerate(cadenas):
+        inicios.append(len(secuencia))
+        tokens = cadena.split()
+        secuencia.extend(vocabulario.setdefault(token, len(vocabulario)) for token in tokens)
+        secuencia.append(-1 - i)  # Separador único: ningún tramo cruza de un archivo a otro
+        archivo_de.extend([i] * (len(tokens) + 1))
+
+    sufijos = arreglo_de_sufijos(secuencia)
+    lcp = lcp_de_sufijos(secuencia, sufijos)
+
+    clones = []
+    grupo = []  # Sufijos consecutivos con prefijo común >= mínimo: (posición, lcp con el anterior)
+    for r in range(1, len(sufijos) + 1):
+        if r == len(sufijos) or lcp[r] < CLONES_TIPO2_MIN_TOKENS:
+            grupo = []
+            continue
+        if not grupo:
+            grupo.append((sufijos[r - 1], 0))
+        q = sufijos[r]
+        archivo_q = archivo_de[q]
+        previo = secuencia[q - 1]  # En la posición 0 es el separador del último archivo
+        longitud = lcp[r]
+        for p, lcp_p in reversed(grupo):
+            # Solo tramos maximales por la izquierda: si el token anterior también
+            # coincide, el tramo ya sale más largo desde una posición antes
+            if secuencia[p - 1] != previo and archivo_de[p] != archivo_q:
+                (a, pa), (b, pb) = sorted(((archivo_de[p], p), (archivo_q, q)))
+                clones.append((a, pa - inicios[a], b, pb - inicios[b], longitud))
+            if lcp_p < longitud:
+                longitud = lcp_p
+        grupo.append((q, lcp[r]))
+        if len(grupo) > CLONES_TIPO2_MAX_SUFIJOS:
+            del grupo[0]
+    return clones
+
+
+def _cubiertos(tramos: list) -> int:
+    """Tokens cubiertos por la unión de tramos (inicio, longitud)"""
+    total = fin = 0
+    for inicio, longitud in sorted(tramos):
+        total += max(0, inicio + longitud - max(inicio, fin))
+        fin = max(fin, inicio + longitud)
+    return total
+
+
+def _linea_de(saltos: list, pos: int) -> int:
+    return saltos[bisect.bisect_right(saltos, [pos, float("inf")]) - 1][1]
+
+
+def duplicacion_tipo2(tipo2: list) -> tuple:
+    """Clones de tipo 2 entre sospechosos (se puede ejecutar en otro proceso).
+
+    tipo2 = [tokens_tipo2 | None] por sospechoso. Devuelve (similares, fragmentos):
+    similares = [(i, j, similitud)] con la fracción de tokens de ambos cubierta
+    por tramos comunes; fragmentos = [(i, línea inicial, línea final, j, línea
+    inicial, línea final, tokens)] de los tramos más largos.
+    """
+    indices = [k for k, dato in enumerate(tipo2) if dato and dato[0]]
+    if len(indices) < 2:
+        return [], []
+    cadenas = [tipo2[k][0] for k in indices]
+    clones = clones_tipo2(cadenas)
+
+    longitudes = [cadena.count(" ") + 1 for cadena in cadenas]
+    tramos = {}
+    for a, inicio_a, b, inicio_b, longitud in clones:
+        par = tramos.setdefault((a, b), ([], []))
+        par[0].append((inicio_a, longitud))
+        par[1].append((inicio_b, longitud))
+
+    similares = []
+    for (a, b), (tramos_a, tramos_b) in tramos.items():
+        similitud = (_cubiertos(tramos_a) + _cubiertos(tramos_b)) / (longitudes[a] + longitudes[b])
+        if similitud >= UMBRAL_SIMILITUD:
+            similares.append((indices[a], indices[b], similitud))
+
+    fragmentos = []
+    for a, inicio_a, b, inicio_b, longitud in sorted(clones, key=lambda c: (-c[4], c))[:CLONES_MAX_FRAGMENTOS]:
+        saltos_a, saltos_b = tipo2[indices[a]][1], tipo2[indices[b]][1]
+        fragmentos.append((
+            indices[a], _linea_de(saltos_a, inicio_a), _linea_de(saltos_a, inicio_a + longitud - 1),
+            indices[b], _linea_de(saltos_b, inicio_b), _linea_de(saltos_b, inicio_b + longitud - 1),
+            longitud
+        ))
+    return sorted(similares), fragmentos
+
+
+# Clones de Python por subárboles del AST: cada función, método y clase se
+# resume en el hash de su árbol normalizado (sin nombres locales ni valores
+# literales) y en los hashes de sus sentencias. Las unidades con el mismo hash
+# son clones salvo renombrados; las que comparten casi todas sus sentencias,
+# casi idénticas. Todo se agrupa por hash, sin comparar unidad con unidad.
+CLONES_AST_MIN_NODOS = 25  # Unidades más pequeñas (getters, envoltorios) no cuentan
+CLONES_AST_MIN_SENTENCIA = 4  # Sentencias más pequeñas (return x, pass) no distinguen nada
+CLONES_AST_UMBRAL = 0.8  # Sentencias compartidas (Dice) para que dos unidades sean casi idénticas
+CLONES_AST_MAX_APARICIONES = 20  # Con más apariciones un hash se empareja en estrella (ver pares_de_apariciones)
+
+# Nodos cuyos nombres forman parte de la API y se conservan al normalizar
+# (los atributos de self/cls no: son campos propios que un clon renombra)
+_AST_NOMBRES_CONSERVADOS = (ast.Attribute, ast.keyword, ast.alias, ast.ImportFrom)
+_AST_UNIDADES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def _hash_ast(node, unidades: list, sentencias: list) -> tuple:
+    """(hash hexadecimal, nodos) del subárbol normalizado, en una pasada de abajo arriba.
+
+    De paso anota en unidades las funciones y clases [hash, inicio, fin, nodos]
+    y en sentencias las sentencias (inicio, fin, hash) de cada subárbol.
+    """
+    partes = [type(node).__name__]
+    nodos = 1
+    conservar = isinstance(node, _AST_NOMBRES_CONSERVADOS) and not (
+        isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in ("self", "cls")
+    )
+    for campo, valor in ast.iter_fields(node):
+        if campo == "ctx":
+            continue
+        if campo == "value" and isinstance(node, ast.Constant):
+            partes.append(type(valor).__name__)
+            continue
+        if campo == "body" and isinstance(node, _AST_UNIDADES) and ast.get_docstring(node, clean=False) is not None:
+            valor = valor[1:]
+        for elemento in valor if isinstance(valor, list) else (valor,):
+            if isinstance(elemento, ast.AST):
+                h, n = _hash_ast(elemento, unidades, sentencias)
+                partes.append(h)
+                nodos += n
+            elif isinstance(elemento, str) and not conservar:
+                partes.append("$id")
+            else:
+                partes.append(repr(elemento))
+        partes.append("|")
+
+    h = hashlib.blake2b("\x1f".join(partes).encode('utf-8'), digest_size=8).hexdigest()
+    if isinstance(node, ast.stmt):
+        fin = getattr(node, "end_lineno", None) or node.lineno
+        if isinstance(node, _AST_UNIDADES):
+            if nodos >= CLONES_AST_MIN_NODOS:
+                unidades.append([int(h, 16), node.lineno, fin, nodos])
+        elif nodos >= CLONES_AST_MIN_SENTENCIA:
+            sentencias.append((node.lineno, fin, int(h, 16)))
+    return h, nodos
+
+
+def huellas_ast(content: str) -> list:
+    """Resumen del AST de un archivo Python: [nodos totales, unidades].
+
+    unidades = [[hash, línea inicial, línea final, nodos, [hashes de sus sentencias]]].
+    Sin unidades si el archivo no se puede analizar.
+    """
+    try:
+        arbol = ast.parse(content)
+        unidades, sentencias = [], []
+        _, total = _hash_ast(arbol, unidades, sentencias)
+    except (SyntaxError, ValueError, RecursionError):
+        return [0, []]
+
+    sentencias.sort()
+    inicios = [inicio for inicio, _, _ in sentencias]
+    for unidad in unidades:
+        _, inicio, fin, _ = unidad
+        desde = bisect.bisect_left(inicios, inicio)
+        hasta = bisect.bisect_right(inicios, fin)
+        unidad.append(sorted({h for _, fin_s, h in sentencias[desde:hasta] if fin_s <= fin}))
+    unidades.sort(key=lambda u: (u[1], -u[2]))
+    return [total, unidades]
+
+
+def _nodos_cubiertos(rangos: list) -> int:
+    """Nodos de las unidades (inicio, fin, nodos) que no están dentro de otra de la lista"""
+    total = 0
+    fin_actual = 0
+    for inicio, fin, nodos in sorted(set(rangos), key=lambda r: (r[0], -r[1])):
+        if fin <= fin_actual:
+            continue
+        total += nodos
+        fin_actual = fin
+    return total
+
+
+def _grupo_ast_comparable(grupo: list, unidades: list, archivos: int) -> bool:
+    """True si las unidades con un mismo hash se comparan: hay más de una y no es plantilla"""
+    if len(grupo) < 2:
+        return False
+    return len(grupo) <= CLONES_AST_MAX_APARICIONES or not es_plantilla(
+        len({unidades[u][0] for u in grupo}), archivos
+    )
+
+
+def duplicacion_ast(datos: list) -> tuple:
+    """Clones de Python entre sospechosos (se puede ejecutar en otro proceso).
+
+    datos = [huellas_ast | None] por sospechoso. Devuelve (similares, fragmentos)
+    como duplicacion_tipo2: la similitud de un par de archivos es la fracción de
+    sus nodos dentro de funciones o clases clonadas.
+    """
+    unidades = []  # (archivo, inicio, fin, nodos, hash, sentencias)
+    for k, dato in enumerate(datos):
+        if dato:
+            for h, inicio, fin, nodos, sentencias in dato[1]:
+                unidades.append((k, inicio, fin, nodos, h, set(sentencias)))
+
+    # Mismo hash: clon exacto salvo nombres y valores
+    parecidas = {}
+    por_hash = {}
+    for u, unidad in enumerate(unidades):
+        por_hash.setdefault(unidad[4], []).append(u)
+    for grupo in por_hash.values():
+        if _grupo_ast_comparable(grupo, unidades, len(datos)):
+            for par in pares_de_apariciones(grupo, CLONES_AST_MAX_APARICIONES):
+                parecidas[par] = 1.0
+
+    # Sentencias en común, contadas por cubetas de hash
+    compartidas = {}
+    por_sentencia = {}
+    for u, unidad in enumerate(unidades):
+        for h in unidad[5]:
+            por_sentencia.setdefault(h, []).append(u)
+    for grupo in por_sentencia.values():
+        if _grupo_ast_comparable(grupo, unidades, len(datos)):
+            for par in pares_de_apariciones(grupo, CLONES_AST_MAX_APARICIONES):
+                compartidas[par] = compartidas.get(par, 0) + 1
+    for (u, v), n in compartidas.items():
+        dice = 2 * n / (len(unidades[u][5]) + len(unidades[v][5]))
+        if dice >= CLONES_AST_UMBRAL and (u, v) not in parecidas:
+            parecidas[(u, v)] = dice
+
+    cubiertas = {}
+    candidatos = []
+    for u, v in parecidas:
+        (a, ini_a, fin_a, nodos_a, _, _), (b, ini_b, fin_b, nodos_b, _, _) = sorted((unidades[u], unidades[v]))
+        if a == b:
+            continue  # Clones dentro de un mismo archivo: no afectan a la similitud entre archivos
+        par = cubiertas.setdefault((a, b), ([], []))
+        par[0].append((ini_a, fin_a, nodos_a))
+        par[1].append((ini_b, fin_b, nodos_b))
+        candidatos.append((min(nodos_a, nodos_b), a, ini_a, fin_a, b, ini_b, fin_b))
+
+    similares = []
+    for (a, b), (rangos_a, rangos_b) in cubiertas.items():
+        similitud = (_nodos_cubiertos(rangos_a) + _nodos_cubiertos(rangos_b)) / (datos[a][0] + datos[b][0])
+        if similitud >= UMBRAL_SIMILITUD:
+            similares.append((a, b, similitud))
+
+    # Fragmentos más grandes, sin repetir los métodos de una clase ya mostrada
+    fragmentos = []
+    for nodos, a, ini_a, fin_a, b, ini_b, fin_b in sorted(candidatos, key=lambda c: (-c[0], c[1:])):
+        if any(a == f[0] and b == f[3] and f[1] <= ini_a and fin_a <= f[2] and f[4] <= ini_b and fin_b <= f[5]
+               for f in fragmentos):
+            continue
+        fragmentos.append((a, ini_a, fin_a, b, ini_b, fin_b, nodos))
+        if len(fragmentos) == CLONES_MAX_FRAGMENTOS:
+            break
+    return sorted(similares), fragmentos
+
+
+def combinar_similares(*listas) -> list:
+    """Une listas [(i, j, similitud)] quedándose con la mayor similitud de cada par"""
+    mejores = {}
+    for similares in listas:
+        for i, j, similitud in similares:
+            if similitud > mejores.get((i, j), 0.0):
+                mejores[(i, j)] = similitud
+    return [(i, j, similitud) for (i, j), similitud in sorted(mejores.items())]
+
+
+# Detectores de clones por lenguaje: clave del dato en el índice → (extensiones, detector).
+# El detector recibe [dato | None] por sospechoso y devuelve (similares, fragmentos).
+DETECTORES_CLONES = {
+    "tipo2": (CLONES_TIPO2_EXTENSIONS, duplicacion_tipo2),
+    "ast_py": ((".py",), duplicacion_ast),
+}
+
+
+DUPLICACION_PRESUPUESTO = 8.0  # Segundos de q3 para firmas y comparaciones; después, resultado parcial
+
+SIN_DUPLICACION = {
+    "es_duplicacion": False,
+    "nivel": None,
+    "archivos_duplicados": [],
+    "patrones_comunes": [],
+    "fragmentos_clonados": [],
+    "recomendacion": None
+}
+
+
+def patrones_sospechosos_de(language: str) -> list:
+    """Patrones que SÍ indican código sospechoso de duplicación (NO incluye _ready/_process que son normales)"""
+    if language == "godot":
+        return [
+            (r'StyleBoxFlat\.new\(\)', "StyleBox creado manualmente"),
+            (r'Color\(\s*[\d.]+\s*,\s*[\d.]+\s*,\s*[\d.]+', "Colores hardcodeados"),
+            (r'add_theme_\w+_override\s*\([^)]+\)', "Overrides de tema"),
+            (r'(HBoxContainer|VBoxContainer|TabContainer)\.new\(\)', "Containers en código"),
+            (r'var\s+\w+\s*=\s*\d+\s*#', "Constantes mágicas"),
+            (r'func\s+_crear_\w+|func\s+_setup_\w+|func\s+_init_\w+', "Funciones de setup custom"),
+        ]
+    elif language == "python":
+        return [
+            (r'def\s+__init__\s*\(self[^)]*\):\s*\n\s+self\.\w+\s*=', "Init con atributos"),
+            (r'def\s+(handle_|process_|create_)\w+', "Funciones handler/process/create"),
+            (r'@(app|router)\.(get|post|put|delete)\s*\([^)]+\)', "Endpoints con ruta"),
+            (r'class\s+\w+(Service|Manager|Handler|Controller)', "Clases Service/Manager"),
+        ]
+    else:
+        return [
+            (r'function\s+(handle|create|process|init)\w+', "Funciones con prefijo común"),
+            (r'class\s+\w+(Service|Manager|Handler|Controller)', "Clases Service/Manager"),
+        ]
+
+
+def patron_sospechoso(content: str, language: str):
+    """Descripción del primer patrón sospechoso del contenido, o None"""
+    for patron, descripcion in patrones_sospechosos_de(language):
+        if re.search(patron, content, re.MULTILINE):
+            # Un archivo solo cuenta una vez
+            return descripcion
+    return None
+
+
+def clasificar_sospechoso(index: dict, rel: str, language: str):
+    """Devuelve {"archivo", "rel", "patron"} si el archivo tiene un patrón sospechoso, o None.
+
+    Un archivo Python sin patrón pero con funciones o clases se devuelve con
+    "patron": None, para compararlo por su AST.
+
+    El patrón y la firma MinHash (firmas_de) salen del índice: el archivo solo se
+    lee cuando cambia su contenido, así que repetir q3 no vuelve a leer ni calcular nada.
+    """
+    descripcion = dato_indexado(index, rel, f"sospechoso:{language}")
+    if descripcion is None:
+        # En Python los clones se buscan en el AST: toda función o clase es candidata
+        huellas = dato_indexado(index, rel, "ast_py") if rel.lower().endswith(".py") else None
+        if not huellas or not huellas[1]:
+            return None
+    return {"archivo": index["root"] / rel, "rel": rel, "patron": descripcion}
+
+
+def firmas_de(index: dict, sospechosos: list) -> list:
+    """Firmas MinHash de los sospechosos, en el mismo orden"""
+    return [dato_indexado(index, sospechoso["rel"], "minhash") or [] for sospechoso in sospechosos]
+
+
+def datos_de_clones(index: dict, sospechosos: list, clave: str) -> list:
+    """Dato de un detector de clones para cada sospechoso, en el mismo orden (None si no aplica)"""
+    extensiones = DETECTORES_CLONES[clave][0]
+    return [
+        dato_indexado(index, sospechoso["rel"], clave)
+        if sospechoso["rel"].lower().endswith(extensiones) else None
+        for sospechoso in sospechosos
+    ]
+
+
+def evaluar_duplicacion(archivos_sospechosos: list, similares: list, fragmentos: list = ()) -> dict:
+    """Evalúa el nivel de duplicación a partir de los pares similares [(i, j, similitud)].
+
+    fragmentos son los tramos clonados de los DETECTORES_CLONES. Un sospechoso
+    sin patrón (p.ej. un archivo Python con funciones) solo cuenta si es similar a otro.
+    """
+    patrones_encontrados = {}
+    for sospechoso in archivos_sospechosos:
+        descripcion = sospechoso["patron"]
+        if descripcion:
+            patrones_encontrados[descripcion] = patrones_encontrados.get(descripcion, 0) + 1
+
+    # Si menos de 2 archivos sospechosos, no hay duplicación posible
+    if len(archivos_sospechosos) < 2:
+        return dict(SIN_DUPLICACION)
+
+    # PASO 3: Pares similares (ya comparados solo entre los que propone LSH)
+    duplicados = []
+    for i, j, similitud in sorted(similares):
+        arch1, arch2 = archivos_sospechosos[i], archivos_sospechosos[j]
+        duplicados.append({
+            "archivo1": arch1["archivo"].name,
+            "archivo2": arch2["archivo"].name,
+            "similitud": round(similitud * 100, 1),
+            "patron": arch1["patron"] or arch2["patron"] or "Funciones o clases clonadas"
+        })
+
+    # Los pares más parecidos primero (la salida solo muestra los primeros)
+    duplicados.sort(key=lambda d: -d["similitud"])
+
+    # PASO 4: Evaluar nivel de duplicación
+    if not duplicados:
+        # Hay archivos sospechosos pero no son similares entre sí
+        return dict(SIN_DUPLICACION, patrones_comunes=list(patrones_encontrados.keys()))
+
+    # Calcular nivel basado en similitud y cantidad
+    max_similitud = max(d["similitud"] for d in duplicados)
+    patrones_repetidos = [p for p, count in patrones_encontrados.items() if count > 1]
+    fragmentos_clonados = [
+        (f"{archivos_sospechosos[i]['archivo'].name}:{ini_i}-{fin_i}",
+         f"{archivos_sospechosos[j]['archivo'].name}:{ini_j}-{fin_j}")
+        for i, ini_i, fin_i, j, ini_j, fin_j, _ in sorted(fragmentos, key=lambda f: -(f[2] - f[1]))
+    ][:CLONES_MAX_FRAGMENTOS]
+
+    if max_similitud >= 80 or len(duplicados) >= 3:
+        nivel = "alto"
+        recomendacion = "CREAR CLASE BASE que ambos hereden"
+    elif max_similitud >= 60 or len(duplicados) >= 2:
+        nivel = "medio"
+        recomendacion = "Evaluar si HEREDAR del existente o EXTRAER base común"
+    else:
+        nivel = "bajo"
+        recomendacion = "Revisar si hay oportunidad de REUTILIZAR"
+
+    return {
+        "es_duplicacion": True,
+        "nivel": nivel,
+        "archivos_duplicados": [(d["archivo1"], d["archivo2"], f"{d['similitud']}%") for d in duplicados],
+        "patrones_comunes": patrones_repetidos if patrones_repetidos else [duplicados[0]["patron"]],
+        "fragmentos_clonados": fragmentos_clonados,
+        "recomendacion": recomendacion
+    }
+
+
+def _guardar_clones(index: dict, clave: str, version: list, resultado) -> None:
+    with index["lock"]:
+        index.setdefault("clones", {})[clave] = (version, resultado)
+
+
+async def evaluar_duplicacion_en_procesos(index: dict, sospechosos: list, limite: float = None) -> dict:
+    """evaluar_duplicacion para muchos sospechosos, con firmas y comparaciones en procesos.
+
+    Si vence el límite se evalúan los archivos que ya tienen firma y el resultado
+    lleva "parcial": True; las firmas restantes se guardan al terminar y la
+    siguiente búsqueda las encuentra hechas. Si el cálculo falla (también al
+    repetirlo en un hilo) no se evalúa la duplicación: SIN_DUPLICACION con
+    "error" y la búsqueda sigue.
+    """
+    try:
+        return await _evaluar_duplicacion_en_procesos(index, sospechosos, limite)
+    except Exception as e:
+        return dict(SIN_DUPLICACION, error=f"{type(e).__name__}: {e}")
+
+
+async def _evaluar_duplicacion_en_procesos(index: dict, sospechosos: list, limite: float) -> dict:
+    inicio = time.monotonic()
+    rels = [sospechoso["rel"] for sospechoso in sospechosos]
+    completo = await precalcular_datos(index, rels, "minhash", limite)
+    if not completo:
+        pendientes = set(datos_pendientes(index, rels, "minhash"))
+        evaluados = [s for s in sospechosos if s["rel"] not in pendientes]
+    else:
+        evaluados = sospechosos
+
+    firmas = await en_hilo(firmas_de, index, evaluados)
+    pares = await en_hilo(pares_candidatos, firmas)
+
+    if len(pares) >= PROCESOS_MIN_PARES and _ejecutor_cpu() is not None:
+        restante = None if limite is None else max(0.0, limite - (time.monotonic() - inicio))
+        similares = []
+        trozos = []
+        for parte in trocear(pares, CPU_MAX_WORKERS * 4):
+            ids = {i for par in parte for i in par}
+            trozos.append(({i: firmas[i] for i in ids}, parte))
+        completo = await en_procesos(similares_de_pares, trozos, similares.extend, restante) and completo
+        similares = list(similares)
+    else:
+        similares = await en_hilo(similares_de_pares, (dict(enumerate(firmas)), pares))
+
+    # Detectores de clones: solo si sus datos llegan a tiempo. Cada resultado se
+    # guarda en memoria aunque venza el límite y sirve mientras no cambien los
+    # datos de los sospechosos; un cálculo en curso no se repite.
+    fragmentos = []
+    for clave, (extensiones, detector) in DETECTORES_CLONES.items():
+        restante = None if limite is None else max(0.0, limite - (time.monotonic() - inicio))
+        rels_detector = [rel for rel in rels if rel.lower().endswith(extensiones)]
+        if not rels_detector:
+            continue
+        if not await precalcular_datos(index, rels_detector, clave, restante):
+            completo = False
+            continue
+        datos = await en_hilo(datos_de_clones, index, evaluados, clave)
+        guardado = index.get("clones", {}).get(clave)
+        if guardado is None or guardado[0] != datos:
+            restante = None if limite is None else max(0.0, limite - (time.monotonic() - inicio))
+            al_terminar = functools.partial(_guardar_clones, index, clave, datos)
+            al_terminar(None)
+            if len(evaluados) >= PROCESOS_MIN_ARCHIVOS:
+                await en_procesos(detector, [datos], al_terminar, restante)
+            else:
+                al_terminar(await en_hilo(detector, datos))
+            guardado = index["clones"][clave]
+        if guardado[0] == datos and guardado[1] is not None:
+            similares = combinar_similares(similares, guardado[1][0])
+            fragmentos.extend(guardado[1][1])
+        else:
+            completo = False
+
+    resultado = evaluar_duplicacion(evaluados, similares, fragmentos)
+    resultado.update(parcial=not completo, evaluados=len(evaluados), sospechosos=len(sospechosos))
+    return resultado
+
+
+async def clasificar_candidatos(candidatos: asyncio.Queue, language: str):
+    """Consume un flujo de candidatos (índice, ruta relativa) hasta recibir None.
+
+    Cada archivo se clasifica en cuanto llega, mientras la búsqueda sigue.
+    Devuelve (índice | None, {archivo: sospechoso | None}).
+    """
+    clasificados = {}
+    index = None
+    while True:
+        item = await candidatos.get()
+        if item is None:
+            return index, clasificados
+        index, rel = item
+        archivo = index["root"] / rel
+        if archivo not in clasificados:
+            clasificados[archivo] = await en_hilo(clasificar_sospechoso, index, rel, language)
+
+
+def buscar_por_nombre(path: Path, search_term: str, publicar=None) -> list:
+    """Archivos de código cuyo nombre contiene el término (bloqueante).
+
+    publicar(index, rel) recibe cada resultado en cuanto se encuentra.
+    """
+    # Índice persistente del proyecto (sin recorrer el árbol si nada cambió)
+    search_lower = search_term.lower()
+    index = obtener_indice_proyecto(path)
+
+    found_by_name = []
+    for rel in archivos_indexados(index, BUSQUEDA_EXTENSIONS):
+        if search_lower in rel.rsplit("/", 1)[-1].lower():
+            found_by_name.append(path / rel)
+            if publicar:
+                publicar(index, rel)
+    return found_by_name
+
+
+def buscar_por_contenido(path: Path, content_pattern: str, publicar=None) -> list:
+    """Archivos de código cuyo contenido cumple la regex, sin distinguir mayúsculas (bloqueante).
+
+    publicar(index, rel) recibe cada resultado en cuanto se verifica.
+    """
+    # El índice de trigramas acota los candidatos; solo esos se leen
+    try:
+        content_regex = re.compile(content_pattern, re.IGNORECASE)
+    except re.error:
+        return []  # Patrón inválido: sin resultados por contenido
+
+    index = obtener_indice_proyecto(path)
+    source_files = archivos_indexados(index, BUSQUEDA_EXTENSIONS)
+
+    found_by_content = []
+    for rel in candidatos_por_contenido(index, content_pattern, source_files):
+        content = leer_archivo_indexado(index, rel)
+        if content is not None and content_regex.search(content):
+            found_by_content.append(path / rel)
+            if publicar:
+                publicar(index, rel)
+
+    guardar_indice_proyecto(index)
+    return found_by_content
+
+
+async def step3_buscar(search_term: str, project_path: str, content_pattern: str = None,
+                        decision_usuario: bool = False, justificacion_salto: str = None,
+                        usuario_verifico: bool = False) -> str:
+    """PASO 3: ¿Existe algo similar?
+
+    Busca en:
+    1. Código fuente (por nombre y contenido)
+    2. Documentación del proyecto (.claude/, docs/)
+    """
+
+    # Verificar paso anterior
+    if not SESSION_STATE["step_2"]:
+        resultado = manejar_decision_usuario(
+            "philosophy_q2_reutilizacion", "philosophy_q3_buscar",
+            decision_usuario, justificacion_salto, usuario_verifico
+        )
+        if resultado is not None:
+            return resultado
+        SESSION_STATE["step_2"] = True
+
+    path = Path(project_path).expanduser().resolve()
+
+    if not path.exists():
+        return f"Error: El directorio {project_path} no existe"
+
+    # Las fases son independientes y se ejecutan a la vez: la latencia de q3 es la
+    # de la más lenta. La detección de duplicación clasifica cada archivo
+    # candidato en cuanto la búsqueda lo encuentra.
+    language = SESSION_STATE.get("current_language", "godot")
+    loop = asyncio.get_running_loop()
+    candidatos = asyncio.Queue()
+
+    def publicar(index, rel):
+        # Llamado desde los hilos de búsqueda
+        loop.call_soon_threadsafe(candidatos.put_nowait, (index, rel))
+
+    async def buscar_codigo():
+        # 1. BUSCAR EN CÓDIGO FUENTE (por nombre y por contenido)
+        try:
+            return await asyncio.gather(
+                en_hilo(buscar_por_nombre, path, search_term, publicar),
+                en_hilo(buscar_por_contenido, path, content_pattern, publicar) if content_pattern
+                else asyncio.sleep(0, result=[]),
+            )
+        finally:
+            candidatos.put_nowait(None)  # Fin del flujo de candidatos
+
+    async with semaforo_proyecto(path):
+        (found_by_name, found_by_content), doc_results, (index, clasificados) = await asyncio.gather(
+            buscar_codigo(),
+            # 2. BUSCAR EN DOCUMENTACIÓN DEL PROYECTO
+            en_hilo(search_project_documentation, path, search_term),
+            # 3. DETECTAR DUPLICACIÓN
+            clasificar_candidatos(candidatos, language),
+        )
+
+    nombres = set(found_by_name)
+    found_by_content = [f for f in found_by_content if f not in nombres]
+    primary_docs = doc_results["primary"]
+    secondary_docs = doc_results["secondary"]
+
+    # Guardar resultados
+    SESSION_STATE["search_results"] = found_by_name + found_by_content
+    SESSION_STATE["step_3"] = True
+
+    # Mismo orden que la búsqueda, independiente del orden de llegada
+    sospechosos = [clasificados.get(f) for f in found_by_name + found_by_content]
+    if index is not None:
+        duplicacion = await evaluar_duplicacion_en_procesos(
+            index, [s for s in sospechosos if s], DUPLICACION_PRESUPUESTO
+        )
+        await en_hilo(guardar_indice_proyecto, index)
+    else:
+        duplicacion = dict(SIN_DUPLICACION)
+    SESSION_STATE["duplication_detected"] = duplicacion
+
+    response = f"""
+╔══════════════════════════════════════════════════════════════════╗
+║  PASO 3/9: BUSCAR SIMILAR                                        ║
+║  Pregunta: ¿Existe algo similar que pueda extender/heredar?      ║
+╚══════════════════════════════════════════════════════════════════╝
+
+🔍 TÉRMINO: "{search_term}"
+📁 PROYECTO: {project_path}
+{"🔎 PATRÓN CONTENIDO: " + content_pattern if content_pattern else ""}
+
+"""
+
+    # Mostrar documentación encontrada PRIMERO (prioridad alta)
+    if primary_docs:
+        response += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📚 DOCUMENTACIÓN RELEVANTE ({len(primary_docs)} principales, {len(secondary_docs)} secundarios)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+⚠️ IMPORTANTE: Lee esta documentación ANTES de crear código nuevo.
+   Ordenada por: tipo + fecha + relevancia (duplicados detectados)
+
+"""
+        for i, doc in enumerate(primary_docs[:5], 1):
+            doc_type = doc.get('doc_type', 'otro').upper()
+            priority = doc.get('priority', '📎 BAJA')
+            age_label = doc.get('age_label', '⚪')
+
+            response += f"{i}. {priority} {doc['title']}\n"
+            response += f"   📁 {doc['relative_path']}\n"
+            response += f"   {doc_type} | {age_label}\n"
+
+            if doc.get('warnings'):
+                for warning in doc['warnings'][:2]:
+                    response += f"   ⚠️ {warning}\n"
+
+            if doc['relevant_sections']:
+                response += f"   Secciones:\n"
+                for section in doc['relevant_sections'][:3]:
+                    response += f"      → {section}\n"
+            response += "\n"
+
+        if secondary_docs:
+            response += f"   📎 {len(secondary_docs)} docs secundarios (versiones anteriores o baja relevancia)\n\n"
+
+    if found_by_name:
+        response += f"📄 CÓDIGO POR NOMBRE ({len(found_by_name)} archivos):\n"
+        for f in found_by_name[:15]:
+            try:
+                relative = f.relative_to(path)
+                response += f"   • {relative}\n"
+            except:
+                response += f"   • {f.name}\n"
+        if len(found_by_name) > 15:
+            response += f"   ... y {len(found_by_name) - 15} más\n"
+        response += "\n"
+
+    if found_by_content:
+        response += f"📝 CÓDIGO POR CONTENIDO ({len(found_by_content)} archivos):\n"
+        for f in found_by_content[:10]:
+            try:
+                relative = f.relative_to(path)
+                response += f"   • {relative}\n"
+            except:
+                response += f"   • {f.name}\n"
+        response += "\n"
+
+    if not found_by_name and not found_by_content and not primary_docs:
+        response += """❌ NO SE ENCONTRÓ NADA SIMILAR
+
+   Puedes crear algo nuevo.
+"""
+    else:
+        if duplicacion.get("error"):
+            response += f"""⚠️ No se pudo evaluar la duplicación ({duplicacion['error']}).
+"""
+        if duplicacion.get("parcial"):
+            response += f"""⏱️ Duplicación evaluada en {duplicacion['evaluados']} de {duplicacion['sospechosos']} archivos sospechosos (límite de {DUPLICACION_PRESUPUESTO:.0f} s).
+   El resto se sigue calculando: repite la búsqueda para verlo completo.
+"""
+
+        # Mostrar advertencia de duplicación si se detectó
+        if duplicacion["es_duplicacion"]:
+            nivel = duplicacion["nivel"]
+            emoji = "⛔" if nivel == "alto" else "⚠️" if nivel == "medio" else "💡"
+
+            response += f"""
+{'═' * 68}
+{emoji} DUPLICACIÓN DETECTADA - NIVEL {nivel.upper()}
+{'═' * 68}
+
+📋 ARCHIVOS CON CÓDIGO SIMILAR:
+"""
+            for arch1, arch2, similitud in duplicacion["archivos_duplicados"][:5]:
+                response += f"   • {arch1} ↔ {arch2} ({similitud} similitud)\n"
+
+            if duplicacion["patrones_comunes"]:
+                response += f"\n🔍 PATRONES: {', '.join(duplicacion['patrones_comunes'])}\n"
+
+            if duplicacion.get("fragmentos_clonados"):
+                response += "\n🧬 TRAMOS CLONADOS (aunque cambien nombres y valores):\n"
+                for tramo1, tramo2 in duplicacion["fragmentos_clonados"]:
+                    response += f"   • {tramo1} ↔ {tramo2}\n"
+
+            response += f"""
+🎯 RECOMENDACIÓN: {duplicacion["recomendacion"]}
+
+"""
+            if nivel == "alto":
+                response += """
+╔══════════════════════════════════════════════════════════════════╗
+║  🛑 PARA - NO CONTINUES SIN RESOLVER ESTO                        ║
+╚══════════════════════════════════════════════════════════════════╝
+
+⛔ INSTRUCCIÓN OBLIGATORIA PARA CLAUDE:
+
+   Similitud >60% = DUPLICACIÓN REAL = DEUDA TÉCNICA
+
+   ANTES de continuar con q4, DEBES:
+
+   1. ANALIZAR qué código está duplicado entre los archivos
+   2. IDENTIFICAR la abstracción común (BaseX, AbstractX)
+   3. Estas son las opciones posibles:
+
+      A) CREAR CLASE BASE nueva
+         → hereda_de: "BaseNombreNuevo (crear)"
+         → Los archivos existentes TAMBIÉN heredarán de ella
+
+      B) HEREDAR del existente
+         → hereda_de: "ArchivoExistente"
+         → Extender funcionalidad, no duplicar
+
+      C) REFACTORIZAR PRIMERO
+         → hereda_de: "REFACTORIZAR_PRIMERO"
+         → Explicar qué refactorizar antes de crear nuevo
+
+   ❌ PROHIBIDO:
+      - Elegir "ninguno" o "copiar y adaptar"
+      - Mover funciones a utils/helpers (es un PARCHE, no arquitectura)
+      - Continuar sin resolver la duplicación
+
+   💡 PREGÚNTATE: "Si mañana cambio el estilo de tabs, ¿tendré que
+      modificar 1 archivo (base) o N archivos (duplicados)?"
+
+   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+   📢 DESPUÉS DE ANALIZAR: EXPLICA Y PREGUNTA AL USUARIO
+   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+   4. EXPLICA al usuario tus conclusiones:
+      - Qué código está duplicado y por qué
+      - Cuál es tu recomendación (A, B o C) y por qué
+
+   5. USA AskUserQuestion para que el usuario DECIDA:
+      - Presenta las opciones A, B, C
+      - Añade opción D: "Ignorar (tengo una razón válida)"
+
+   6. USA la respuesta del usuario en q4:
+      - Si A → hereda_de: "BaseNueva"
+      - Si B → hereda_de: "ClaseExistente"
+      - Si C → hereda_de: "REFACTORIZAR_PRIMERO"
+      - Si D → justificación: "USUARIO: [razón que dio el usuario]"
+
+   NO continues sin la confirmación del usuario.
+
+"""
+            elif nivel == "medio":
+                response += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⚠️ ATENCIÓN CLAUDE - Similitud detectada
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+   ANTES de continuar, evalúa honestamente:
+
+   • ¿El código que voy a escribir será >50% similar al existente?
+   • Si copio y adapto, ¿estoy creando deuda técnica?
+   • ¿Puedo HEREDAR del existente en lugar de duplicar?
+   • ¿Debería EXTRAER base común primero?
+
+   Si la respuesta a cualquiera es SÍ → trata como nivel ALTO
+
+   📢 EXPLICA al usuario tu análisis y USA AskUserQuestion
+      para confirmar cómo proceder antes de continuar.
+
+"""
+        else:
+            response += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⚠️ IA: EVALÚA estos resultados y decide:
+   • ¿Hay DOCUMENTACIÓN con instrucciones a seguir?
+   • ¿Puedo REUTILIZAR algún código directamente?
+   • ¿Puedo EXTENDER/HEREDAR de alguno?
+   • ¿Necesito crear uno NUEVO? ¿Por qué?
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+
+    response += """
+✅ PASO 3 COMPLETADO
+
+➡️ SIGUIENTE: Usa philosophy_q4_herencia
+   Pregunta: ¿Si cambio la base, se actualizarán todas las instancias?
+"""
+    return response
+
+
+async def step4_herencia(hereda_de: str, reutiliza: str, justificacion: str,
+                          decision_usuario: bool = False, justificacion_salto: str = None,
+                          usuario_verifico: bool = False) -> str:
+    """PASO 4: ¿Se actualizan las instancias?"""
+
+    # Verificar paso anterior
+    if not SESSION_STATE["step_3"]:
+        resultado = manejar_decision_usuario(
+            "philosophy_q3_buscar", "philosophy_q4_herencia",
+            decision_usuario, justificacion_salto, usuario_verifico
+        )
+        if resultado is not None:
+            return resultado
+        SESSION_STATE["step_3"] = True
+
+    # VALIDAR COHERENCIA CON DETECCIÓN DE DUPLICACIÓN
+    duplicacion = SESSION_STATE.get("duplication_detected") or {}
+    es_duplicacion = duplicacion.get("es_duplicacion", False)
+    nivel_dup = duplicacion.get("nivel", None)
+
+    # Normalizar respuestas
+    hereda_lower = hereda_de.lower().strip()
+    reutiliza_lower = reutiliza.lower().strip()
+    justificacion_strip = justificacion.strip() if justificacion else ""
+
+    # Detectar si está evitando la decisión
+    evita_decision = hereda_lower in ["ninguno", "ninguna", "none", "no", "n/a", "-", ""]
+    no_reutiliza = reutiliza_lower in ["ninguno", "ninguna", "none", "no", "n/a", "-", ""]
+
+    # Detectar si el USUARIO decidió ignorar (debe tener palabra clave)
+    palabras_clave_usuario = ["USUARIO:", "USER:", "DECISIÓN_USUARIO:", "IGNORAR:"]
+    usuario_decidio_ignorar = any(justificacion_strip.upper().startswith(kw) for kw in palabras_clave_usuario)
+
+    # BLOQUEAR si hay duplicación ALTA, evita decisión Y no es decisión del usuario
+    if es_duplicacion and nivel_dup == "alto" and evita_decision and no_reutiliza:
+        if not usuario_decidio_ignorar:
+            return f"""
+╔══════════════════════════════════════════════════════════════════╗
+║  ⛔ BLOQUEADO: DECISIÓN INCOHERENTE CON DUPLICACIÓN DETECTADA    ║
+╚══════════════════════════════════════════════════════════════════╝
+
+En el PASO 3 se detectó DUPLICACIÓN NIVEL ALTO:
+   • Patrones: {', '.join(duplicacion.get('patrones_comunes', []))}
+   • Recomendación: {duplicacion.get('recomendacion', 'N/A')}
+
+Tu respuesta actual:
+   • hereda_de: "{hereda_de}"
+   • reutiliza_existente: "{reutiliza}"
+
+⛔ ESTO NO ES ACEPTABLE
+
+Cuando hay duplicación alta, DEBES elegir UNA de estas opciones:
+
+   A) hereda_de: "NombreClaseBase" (crear o usar base existente)
+   B) hereda_de: "ClaseExistente" + justificar extensión
+   C) hereda_de: "REFACTORIZAR_PRIMERO" + explicar qué refactorizar
+   D) hereda_de: "ninguno" + justificación que empiece con "USUARIO:"
+      → Solo si el usuario DECIDIÓ ignorar la duplicación
+
+❌ Tu justificación NO empieza con palabra clave de usuario.
+   Palabras clave válidas: {', '.join(palabras_clave_usuario)}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🔄 VUELVE A LLAMAR philosophy_q4_herencia con:
+   - Una decisión válida (A, B o C), O
+   - justificación que empiece con "USUARIO: [razón del usuario]"
+"""
+
+    # ADVERTIR si el usuario decidió ignorar duplicación alta
+    advertencia = ""
+    if es_duplicacion and nivel_dup == "alto" and evita_decision and usuario_decidio_ignorar:
+        advertencia = f"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⚠️ USUARIO DECIDIÓ IGNORAR DUPLICACIÓN ALTA
+
+   Razón: {justificacion_strip}
+
+   ⚠️ Si esto genera deuda técnica, el usuario es responsable.
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+
+    # ADVERTIR si hay duplicación MEDIA y evita decisión
+    if es_duplicacion and nivel_dup == "medio" and evita_decision and not advertencia:
+        advertencia = f"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⚠️ ADVERTENCIA: Se detectó duplicación MEDIA pero elegiste no heredar.
+
+   Tu justificación: {justificacion}
+
+   Asegúrate de que esto NO resulte en código duplicado.
+   Si más tarde necesitas cambiar estilos/comportamiento, tendrás
+   que modificar MÚLTIPLES archivos en lugar de UNA base.
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+
+    SESSION_STATE["step_4"] = True
+
+    response = f"""
+╔══════════════════════════════════════════════════════════════════╗
+║  PASO 4/9: HERENCIA                                              ║
+║  Pregunta: ¿Si cambio la base, se actualizarán las instancias?   ║
+╚══════════════════════════════════════════════════════════════════╝
+
+🔗 HEREDA DE: {hereda_de}
+
+♻️ REUTILIZA EXISTENTE: {reutiliza}
+
+💡 JUSTIFICACIÓN: {justificacion}
+{advertencia}
+✅ PASO 4 COMPLETADO
+
+➡️ SIGUIENTE: Usa philosophy_q5_nivel
+   Pregunta: ¿Está en el nivel correcto de la jerarquía?
+"""
+    return response
+
+
+# ============================================================
+# INFORME DE CLONES DEL PROYECTO (winnowing)
+# ============================================================
+# philosophy_duplication_report: huellas de winnowing (como MOSS) de todos los
+# archivos de código, guardadas en el índice por versión de contenido. Las
+# huellas que comparten dos archivos se unen en fragmentos con rango de líneas
+# y los fragmentos que se solapan forman grupos de clones de todo el proyecto.
+
+CLONES_EXTENSIONS = [".gd", ".py", ".php", ".js", ".ts", ".jsx", ".tsx", ".vue", ".svelte"]
+WINNOWING_K = 12  # Tokens por k-grama: coincidencias más cortas son ruido
+WINNOWING_VENTANA = 16  # Toda coincidencia de K + VENTANA - 1 tokens deja al menos una huella
+CLONES_MIN_LINEAS = 6  # Fragmento mínimo que se informa
+CLONES_MAX_APARICIONES = 10  # Con más apariciones una huella se empareja en estrella (coste lineal)
+CLONES_FRACCION_PLANTILLA = 0.9  # Lo que aparece en más de esta fracción de archivos es plantilla...
+CLONES_MIN_ARCHIVOS_PLANTILLA = 50  # ...si hay al menos estos archivos (en menos, todo puede ser un clon)
+CLONES_HUECO = WINNOWING_K + WINNOWING_VENTANA  # Tokens entre huellas de un mismo fragmento (tolera un cambio)
+CLONES_MAX_GRUPOS = 15  # Grupos mostrados en el informe
+
+
+def huellas_winnowing(content: str, comentario: str) -> list:
+    """Huellas [hash, posición del token, línea inicial, línea final] de un archivo.
+
+    De cada ventana de WINNOWING_VENTANA k-gramas consecutivos se queda el de
+    hash mínimo, sin repetir posición. Si empatan se mantiene el ya elegido
+    (winnowing robusto): el código repetitivo no genera una huella por token.
+    """
+    tokens, lineas = tokens_con_lineas(content, comentario)
+    k = WINNOWING_K
+    hashes = [
+        int.from_bytes(hashlib.blake2b("\x1f".join(tokens[i:i + k]).encode('utf-8'), digest_size=4).digest(), "little")
+        for i in range(len(tokens) - k + 1)
+    ]
+    if not hashes:
+        return []
+
+    w = min(WINNOWING_VENTANA, len(hashes))
+    huellas = []
+    elegido = -1
+    for fin in range(w - 1, len(hashes)):
+        inicio = fin - w + 1
+        if elegido < inicio:
+            elegido = min(range(inicio, fin + 1), key=lambda i: (hashes[i], -i))
+        elif hashes[fin] < hashes[elegido]:
+            elegido = fin
+        else:
+            continue
+        huellas.append([hashes[elegido], elegido, lineas[elegido], lineas[elegido + k - 1]])
+    return huellas
+
+
+def es_plantilla(archivos: int, total: int) -> bool:
+    """True si lo que aparece en `archivos` de `total` archivos es código de plantilla"""
+    return total >= CLONES_MIN_ARCHIVOS_PLANTILLA and archivos > CLONES_FRACCION_PLANTILLA * total
+
+
+def pares_de_apariciones(lista: list, max_apariciones: int):
+    """Pares de apariciones de un mismo hash.
+
+    Hasta max_apariciones, todos los pares. Con más, cada aparición con la primera:
+    el grupo sale igual (se une por componentes) y el coste es lineal.
+    """
+    if len(lista) <= max_apariciones:
+        return itertools.combinations(lista, 2)
+    primera = lista[0]
+    return ((primera, otra) for otra in lista[1:])
+
+
+def _fragmentos_de_par(huellas_a: list, huellas_b: list, coincidencias: list, mismo_archivo: bool) -> list:
+    """Une las huellas comunes de dos archivos en fragmentos ((ini_a, fin_a), (ini_b, fin_b)).
+
+    Dos huellas siguen el mismo fragmento si avanzan a la vez en ambos archivos
+    con menos de CLONES_HUECO tokens de separación.
+    """
+    abiertos = []  # [token_a, token_b, ini_a, fin_a, ini_b, fin_b]
+    for pos_a, pos_b in sorted(coincidencias):
+        _, tok_a, ini_a, fin_a = huellas_a[pos_a]
+        _, tok_b, ini_b, fin_b = huellas_b[pos_b]
+        for frag in reversed(abiertos):
+            if 0 <= tok_a - frag[0] <= CLONES_HUECO and 0 <= tok_b - frag[1] <= CLONES_HUECO:
+                frag[0], frag[1] = tok_a, tok_b
+                frag[3] = max(frag[3], fin_a)
+                frag[5] = max(frag[5], fin_b)
+                break
+        else:
+            abiertos.append([tok_a, tok_b, ini_a, fin_a, ini_b, fin_b])
+
+    fragmentos = []
+    for _, _, ini_a, fin_a, ini_b, fin_b in abiertos:
+        if min(fin_a - ini_a, fin_b - ini_b) + 1 < CLONES_MIN_LINEAS:
+            continue
+        if mismo_archivo and ini_b <= fin_a and ini_a <= fin_b:
+            continue  # Un fragmento solapado consigo mismo no es un clon
+        fragmentos.append(((ini_a, fin_a), (ini_b, fin_b)))
+    return fragmentos
+
+
+def grupos_de_clones(index: dict, rels: list) -> list:
+    """Grupos de clones del proyecto en una pasada.
+
+    Devuelve [{"fragmentos": [(rel, ini, fin)], "lineas": int}] de mayor a menor.
+    """
+    huellas = {}
+    apariciones = {}
+    for rel in rels:
+        lista = dato_indexado(index, rel, "huellas") or []
+        huellas[rel] = lista
+        for pos, (h, _, _, _) in enumerate(lista):
+            apariciones.setdefault(h, []).append((rel, pos))
+
+    # Pares de archivos → posiciones de las huellas que comparten
+    coincidencias = {}
+    for lista in apariciones.values():
+        if len(lista) < 2:
+            continue
+        if len(lista) > CLONES_MAX_APARICIONES and es_plantilla(len({rel for rel, _ in lista}), len(rels)):
+            continue
+        for (rel_a, pos_a), (rel_b, pos_b) in pares_de_apariciones(lista, CLONES_MAX_APARICIONES):
+            coincidencias.setdefault((rel_a, rel_b), []).append((pos_a, pos_b))
+
+    # Cada fragmento es un nodo; se unen los pares y los solapados de un mismo archivo
+    nodos = []
+    padre = []
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    def unir(i, j):
+        padre[raiz(i)] = raiz(j)
+
+    for (rel_a, rel_b), pares in coincidencias.items():
+        for rango_a, rango_b in _fragmentos_de_par(huellas[rel_a], huellas[rel_b], pares, rel_a == rel_b):
+            nodos.extend([(rel_a, *rango_a), (rel_b, *rango_b)])
+            padre.extend([len(padre), len(padre) + 1])
+            unir(len(padre) - 2, len(padre) - 1)
+
+    por_archivo = {}
+    for i, (rel, ini, fin) in enumerate(nodos):
+        por_archivo.setdefault(rel, []).append((ini, fin, i))
+    for rangos in por_archivo.values():
+        rangos.sort()
+        fin_actual, anterior = -1, None
+        for ini, fin, i in rangos:
+            if anterior is not None and ini <= fin_actual:
+                unir(i, anterior)
+            if fin > fin_actual:
+                fin_actual, anterior = fin, i
+
+    # Fragmentos de cada grupo, fusionando los solapados de un mismo archivo
+    componentes = {}
+    for i, nodo in enumerate(nodos):
+        componentes.setdefault(raiz(i), []).append(nodo)
+
+    grupos = []
+    for miembros in componentes.values():
+        fragmentos = []
+        for rel, ini, fin in sorted(miembros):
+            if fragmentos and fragmentos[-1][0] == rel and ini <= fragmentos[-1][2]:
+                fragmentos[-1] = (rel, fragmentos[-1][1], max(fin, fragmentos[-1][2]))
+            else:
+                fragmentos.append((rel, ini, fin))
+        lineas = sum(fin - ini + 1 for _, ini, fin in fragmentos)
+        grupos.append({"fragmentos": fragmentos, "lineas": lineas})
+
+    grupos.sort(key=lambda g: (-g["lineas"], g["fragmentos"]))
+    return grupos
+
+
+def archivos_de_clones(index: dict, language: str = None) -> list:
+    """Archivos de código del proyecto, opcionalmente de un solo lenguaje"""
+    rels = archivos_indexados(index, CLONES_EXTENSIONS)
+    if language:
+        rels = [rel for rel in rels if INDEX_EXTENSIONS.get(os.path.splitext(rel)[1].lower()) == language]
+    return rels
+
+
+def informe_de_clones(index: dict, rels: list) -> dict:
+    """Grupos de clones entre estos archivos (bloqueante)"""
+    grupos = grupos_de_clones(index, rels)
+    guardar_indice_proyecto(index)
+    return {"archivos": len(rels), "grupos": grupos}
+
+
+async def duplication_report(project_path: str, language: str = None) -> str:
+    """Informe de clones de todo el proyecto (no depende del flujo q1-q9)"""
+    path = Path(project_path).expanduser().resolve()
+
+    if not path.exists():
+        return f"Error: El directorio {project_path} no existe"
+
+    async with semaforo_proyecto(path):
+        index = await en_hilo(obtener_indice_proyecto, path)
+        rels = archivos_de_clones(index, language)
+        # Huellas de los archivos nuevos o cambiados, repartidas entre procesos
+        await precalcular_datos(index, rels, "huellas")
+        informe = await en_hilo(informe_de_clones, index, rels)
+
+    grupos = informe["grupos"]
+    response = f"""
+╔══════════════════════════════════════════════════════════════════╗
+║  INFORME DE DUPLICACIÓN DEL PROYECTO                             ║
+╚══════════════════════════════════════════════════════════════════╝
+
+📁 PROYECTO: {project_path}
+📄 ARCHIVOS ANALIZADOS: {informe["archivos"]}{f" ({language})" if language else ""}
+"""
+
+    if not grupos:
+        response += f"""
+✅ No hay fragmentos de {CLONES_MIN_LINEAS}+ líneas repetidos entre archivos.
+"""
+        return response
+
+    total_lineas = sum(g["lineas"] for g in grupos)
+    response += f"""🧬 GRUPOS DE CLONES: {len(grupos)} (~{total_lineas} líneas implicadas)
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
 
-    # Ordenar por score
-    primary.sort(key=lambda x: x["score"], reverse=True)
-    secondary.sort(key=lambda x: x["score"], reverse=True)
+    for i, grupo in enumerate(grupos[:CLONES_MAX_GRUPOS], 1):
+        fragmentos = grupo["fragmentos"]
+        archivos = {rel for rel, _, _ in fragmentos}
+        alcance = "mismo archivo" if len(archivos) == 1 else f"{len(archivos)} archivos"
+        response += f"\n{i}. {len(fragmentos)} fragmentos en {alcance} (~{grupo['lineas']} líneas)\n"
+        for rel, ini, fin in fragmentos[:8]:
+            response += f"   • {rel}:{ini}-{fin}\n"
+        if len(fragmentos) > 8:
+            response += f"   ... y {len(fragmentos) - 8} fragmentos más\n"
 
-    return {
-        "primary": primary,
-        "secondary": secondary,
-        "topics": list(topic_docs.keys()),
-        "total": len(all_docs)
-    }
+    if len(grupos) > CLONES_MAX_GRUPOS:
+        response += f"\n... y {len(grupos) - CLONES_MAX_GRUPOS} grupos más\n"
+
+    response += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+➡️ CÓMO USARLO:
+   • Varios archivos → candidato a CLASE BASE o componente común (q4)
+   • Mismo archivo → extraer una función
+   • En un análisis arquitectónico, inclúyelo en el plan de la FASE 4
+"""
+    return response
 
 
 # ============================================================
-# DETECCIÓN DE DUPLICACIÓN (ENFOQUE HÍBRIDO)
+# ESCENAS GODOT (.tscn/.tres)
 # ============================================================
-
-def calcular_similitud(contenido1: str, contenido2: str) -> float:
-    """
-    Calcula la similitud entre dos strings de código.
-    Retorna un valor entre 0.0 (completamente diferentes) y 1.0 (idénticos).
+# Las escenas se leen en un solo recorrido por sus líneas (sirve un archivo
+# abierto) y se reducen a una representación compacta: SubResources con sus
+# propiedades, nodos con sus theme_overrides y el número de colores literales.
+# Los SubResources idénticos se agrupan por su conjunto canónico de
+# propiedades; los parecidos se buscan con firmas MinHash y bandas LSH, y solo
+# los pares candidatos se comparan con Jaccard exacto.
+
+ESCENA_UMBRAL_SIMILITUD = 0.8  # Jaccard de propiedades: más es un SubResource casi repetido
+ESCENA_MINHASH_CUBETAS = 30
+ESCENA_LSH_FILAS = 3  # 10 bandas: candidato con prob. > 0.999 si Jaccard ≥ 0.8, ~0.25 si 0.3
+ESCENA_MIN_OVERRIDES_REPETIDOS = 3  # Nodos con los mismos theme_overrides → usar un Theme
+ESCENA_MAX_COLORES = 3
+
+_RE_CABECERA_ESCENA = re.compile(r'\[(\w+)((?:\s+\w+=(?:"(?:[^"\\]|\\.)*"|\w+\([^)]*\)|[^\s\]]+))*)\s*\]')
+_RE_ATRIBUTO_ESCENA = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|\w+\([^)]*\)|[^\s\]]+)')
+_RE_DELIMITADORES_ESCENA = re.compile(r'"(?:[^"\\]|\\.)*"|"|[\[\](){}]')
+_RE_FIN_CADENA = re.compile(r'(?:[^"\\]|\\.)*"')
+_RE_COLOR_ESCENA = re.compile(r'Color\s*\(\s*[\d.]+')
+
+
+def _valor_abierto(texto: str, en_cadena: bool):
+    """(corchetes/paréntesis/llaves sin cerrar, cadena sin cerrar) al final de un trozo de valor"""
+    if en_cadena:
+        fin = _RE_FIN_CADENA.match(texto)
+        if fin is None:
+            return 0, True
+        texto = texto[fin.end():]
+    profundidad = 0
+    for match in _RE_DELIMITADORES_ESCENA.finditer(texto):
+        simbolo = match.group()
+        if simbolo == '"':
+            return profundidad, True  # Cadena que sigue en las líneas siguientes
+        if len(simbolo) == 1:
+            profundidad += 1 if simbolo in "[({" else -1
+    return profundidad, False
+
+
+def parsear_escena(lineas) -> dict:
+    """Representación compacta de una escena .tscn/.tres en una pasada.
+
+    lineas es cualquier iterable de líneas (un archivo abierto, io.StringIO...).
+    Devuelve {"lineas", "colores", "sub_resources": [{"type", "id", "props"}],
+    "nodos": [{"name", "parent", "overrides"}], "recurso"}; recurso es el
+    [resource] de un .tres ({"type", "props"}) o None. props y overrides son
+    listas de "clave = valor" (los valores de varias líneas se unen).
     """
-    if not contenido1 or not contenido2:
-        return 0.0
-    return difflib.SequenceMatcher(None, contenido1, contenido2).ratio()
+    escena = {"lineas": 0, "colores": 0, "sub_resources": [], "nodos": [], "recurso": None}
+    props = None  # Lista donde van las propiedades de la sección actual
+    solo_overrides = False
+    pendiente = None  # Propiedad cuyo valor sigue en las líneas siguientes
+    profundidad, en_cadena = 0, False
+    final_con_salto = True
+
+    for line in lineas:
+        escena["lineas"] += 1
+        final_con_salto = line.endswith('\n')
+        line = line.rstrip('\r\n')
+        if 'Color' in line and 'theme_override' not in line and _RE_COLOR_ESCENA.search(line):
+            escena["colores"] += 1
+
+        if pendiente is not None:
+            pendiente.append(line)
+            delta, en_cadena = _valor_abierto(line, en_cadena)
+            profundidad += delta
+            if profundidad <= 0 and not en_cadena:
+                props.append("\n".join(pendiente))
+                pendiente = None
+            continue
+
+        if line.startswith('['):
+            cabecera = _RE_CABECERA_ESCENA.match(line)
+            if cabecera is None:
+                continue
+            atributos = {
+                nombre: valor[1:-1] if valor.startswith('"') else valor
+                for nombre, valor in _RE_ATRIBUTO_ESCENA.findall(cabecera.group(2))
+            }
+            if cabecera.group(1) == "sub_resource":
+                props = []
+                solo_overrides = False
+                escena["sub_resources"].append(
+                    {"type": atributos.get("type", ""), "id": atributos.get("id", ""), "props": props}
+                )
+            elif cabecera.group(1) in ("gd_resource", "resource"):
+                if escena["recurso"] is None:
+                    escena["recurso"] = {"type": atributos.get("type", ""), "props": []}
+                props = escena["recurso"]["props"] if cabecera.group(1) == "resource" else None
+                solo_overrides = False
+            elif cabecera.group(1) == "node":
+                props = []
+                solo_overrides = True
+                escena["nodos"].append(
+                    {"name": atributos.get("name", ""), "parent": atributos.get("parent"), "overrides": props}
+                )
+            else:
+                props = None
+            continue
+
+        if props is None or '=' not in line or (solo_overrides and not line.startswith('theme_override_')):
+            continue
+        clave, _, valor = line.partition('=')
+        propiedad = f"{clave.strip()} = {valor.strip()}"
+        profundidad, en_cadena = _valor_abierto(valor, False)
+        if profundidad > 0 or en_cadena:
+            pendiente = [propiedad]
+        else:
+            props.append(propiedad)
+
+    if pendiente is not None:
+        props.append("\n".join(pendiente))
+    if final_con_salto:
+        escena["lineas"] += 1  # Como len(code.split('\n'))
+    return escena
+
 
+def _agrupar_pares(n: int, pares, unidos) -> list:
+    """Componentes conexas (listas de índices ordenados) de n elementos.
 
-def detectar_duplicacion(archivos: list, project_path: Path, language: str) -> dict:
+    Cada par candidato se une si unidos(i, j); no se consulta si ya están en el mismo grupo.
     """
-    Detecta duplicación REAL usando enfoque híbrido:
-    1. Filtra archivos con patrones sospechosos (NO métodos estándar)
-    2. Compara similitud de contenido entre archivos sospechosos
-    3. Solo reporta duplicación si similitud > 60%
-
-    Retorna:
-        {
-            "es_duplicacion": bool,
-            "nivel": "alto" | "medio" | "bajo" | None,
-            "archivos_duplicados": [(archivo1, archivo2, similitud)],
-            "patrones_comunes": [patron1, patron2, ...],
-            "recomendacion": str
-        }
+    padre = list(range(n))
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    for i, j in pares:
+        raiz_i, raiz_j = raiz(i), raiz(j)
+        if raiz_i != raiz_j and unidos(i, j):
+            padre[raiz_i] = raiz_j
+    componentes = {}
+    for i in range(n):
+        componentes.setdefault(raiz(i), []).append(i)
+    return [grupo for grupo in componentes.values() if len(grupo) > 1]
+
+
+def subresources_repetidos(sub_resources: list) -> tuple:
+    """SubResources repetidos de una escena, por tipo y en orden de aparición.
+
+    Devuelve (idénticos, parecidos): listas de (tipo, [ids]). Idénticos tienen el
+    mismo conjunto de propiedades; parecidos, Jaccard > ESCENA_UMBRAL_SIMILITUD
+    (directo o encadenado) sin ser idénticos.
     """
-    if not archivos:
-        return {
-            "es_duplicacion": False,
-            "nivel": None,
-            "archivos_duplicados": [],
-            "patrones_comunes": [],
-            "recomendacion": None
-        }
+    por_tipo = {}
+    for sub in sub_resources:
+        if sub["props"]:
+            grupos = por_tipo.setdefault(sub["type"], {})
+            grupos.setdefault(frozenset(sub["props"]), []).append(sub["id"])
 
-    # PASO 1: Patrones que SÍ indican código sospechoso de duplicación
-    # (NO incluye _ready/_process que son normales)
-    if language == "godot":
-        patrones_sospechosos = [
-            (r'StyleBoxFlat\.new\(\)', "StyleBox creado manualmente"),
-            (r'Color\(\s*[\d.]+\s*,\s*[\d.]+\s*,\s*[\d.]+', "Colores hardcodeados"),
-            (r'add_theme_\w+_override\s*\([^)]+\)', "Overrides de tema"),
-            (r'(HBoxContainer|VBoxContainer|TabContainer)\.new\(\)', "Containers en código"),
-            (r'var\s+\w+\s*=\s*\d+\s*#', "Constantes mágicas"),
-            (r'func\s+_crear_\w+|func\s+_setup_\w+|func\s+_init_\w+', "Funciones de setup custom"),
-        ]
-    elif language == "python":
-        patrones_sospechosos = [
-            (r'def\s+__init__\s*\(self[^)]*\):\s*\n\s+self\.\w+\s*=', "Init con atributos"),
-            (r'def\s+(handle_|process_|create_)\w+', "Funciones handler/process/create"),
-            (r'@(app|router)\.(get|post|put|delete)\s*\([^)]+\)', "Endpoints con ruta"),
-            (r'class\s+\w+(Service|Manager|Handler|Controller)', "Clases Service/Manager"),
-        ]
-    else:
-        patrones_sospechosos = [
-            (r'function\s+(handle|create|process|init)\w+', "Funciones con prefijo común"),
-            (r'class\s+\w+(Service|Manager|Handler|Controller)', "Clases Service/Manager"),
-        ]
+    identicos, parecidos = [], []
+    for type_name, grupos in por_tipo.items():
+        conjuntos = list(grupos)
+        identicos.extend((type_name, ids) for ids in grupos.values() if len(ids) > 1)
 
-    # PASO 2: Filtrar archivos que tienen patrones sospechosos
-    archivos_sospechosos = []
-    patrones_encontrados = {}
+        def parecidos_entre(i, j):
+            return len(conjuntos[i] & conjuntos[j]) / len(conjuntos[i] | conjuntos[j]) > ESCENA_UMBRAL_SIMILITUD
 
-    for archivo in archivos[:15]:  # Analizar hasta 15 archivos
-        try:
-            content = archivo.read_text(encoding='utf-8', errors='ignore')
-
-            for patron, descripcion in patrones_sospechosos:
-                if re.search(patron, content, re.MULTILINE):
-                    archivos_sospechosos.append({
-                        "archivo": archivo,
-                        "contenido": content,
-                        "patron": descripcion
-                    })
-                    patrones_encontrados[descripcion] = patrones_encontrados.get(descripcion, 0) + 1
-                    break  # Un archivo solo cuenta una vez
-        except:
-            pass
+        firmas = [minhash_de_conjunto(conjunto, ESCENA_MINHASH_CUBETAS) for conjunto in conjuntos]
+        candidatos = pares_candidatos(firmas, ESCENA_LSH_FILAS)
+        for grupo in _agrupar_pares(len(conjuntos), candidatos, parecidos_entre):
+            parecidos.append((type_name, [sub_id for i in grupo for sub_id in grupos[conjuntos[i]]]))
+    return identicos, parecidos
 
-    # Si menos de 2 archivos sospechosos, no hay duplicación posible
-    if len(archivos_sospechosos) < 2:
-        return {
-            "es_duplicacion": False,
-            "nivel": None,
-            "archivos_duplicados": [],
-            "patrones_comunes": [],
-            "recomendacion": None
-        }
 
-    # PASO 3: Comparar similitud entre archivos sospechosos
-    UMBRAL_SIMILITUD = 0.6  # 60% de similitud = duplicación
-    duplicados = []
+def nombre_de_nodo(nodo: dict) -> str:
+    """Ruta del nodo dentro de la escena como la escribe Godot (parent/name)"""
+    if nodo["parent"] in (None, "."):
+        return nodo["name"]
+    return f"{nodo['parent']}/{nodo['name']}"
 
-    for i, arch1 in enumerate(archivos_sospechosos):
-        for arch2 in archivos_sospechosos[i+1:]:
-            similitud = calcular_similitud(arch1["contenido"], arch2["contenido"])
 
-            if similitud >= UMBRAL_SIMILITUD:
-                duplicados.append({
-                    "archivo1": arch1["archivo"].name,
-                    "archivo2": arch2["archivo"].name,
-                    "similitud": round(similitud * 100, 1),
-                    "patron": arch1["patron"]
-                })
+def overrides_repetidos(nodos: list) -> list:
+    """Listas de nodos (rutas) con exactamente los mismos theme_overrides"""
+    grupos = {}
+    for nodo in nodos:
+        if nodo["overrides"]:
+            grupos.setdefault(frozenset(nodo["overrides"]), []).append(nombre_de_nodo(nodo))
+    return [nodos for nodos in grupos.values() if len(nodos) >= ESCENA_MIN_OVERRIDES_REPETIDOS]
 
-    # PASO 4: Evaluar nivel de duplicación
-    if not duplicados:
-        # Hay archivos sospechosos pero no son similares entre sí
-        return {
-            "es_duplicacion": False,
-            "nivel": None,
-            "archivos_duplicados": [],
-            "patrones_comunes": list(patrones_encontrados.keys()),
-            "recomendacion": None
-        }
 
-    # Calcular nivel basado en similitud y cantidad
-    max_similitud = max(d["similitud"] for d in duplicados)
-    patrones_repetidos = [p for p, count in patrones_encontrados.items() if count > 1]
+# ============================================================
+# RECURSOS REPETIDOS ENTRE ESCENAS
+# ============================================================
+# philosophy_resource_duplication_report: cada .tscn/.tres se reduce a sus
+# SubResources, sus grupos de theme_overrides por nodo y, en los .tres, su
+# propio [resource]; cada propiedad queda como un hash corto y el resultado se
+# guarda en el índice por versión de contenido. Con todo el proyecto se agrupan
+# los recursos idénticos (mismo conjunto de propiedades) y los casi idénticos
+# (MinHash + LSH, Jaccard > ESCENA_UMBRAL_SIMILITUD) y se estima cuánto texto
+# se ahorraría extrayendo cada grupo a un .tres compartido.
 
-    if max_similitud >= 80 or len(duplicados) >= 3:
-        nivel = "alto"
-        recomendacion = "CREAR CLASE BASE que ambos hereden"
-    elif max_similitud >= 60 or len(duplicados) >= 2:
-        nivel = "medio"
-        recomendacion = "Evaluar si HEREDAR del existente o EXTRAER base común"
-    else:
-        nivel = "bajo"
-        recomendacion = "Revisar si hay oportunidad de REUTILIZAR"
+RECURSOS_EXTENSIONS = (".tscn", ".tres")
+RECURSOS_MIN_OVERRIDES = 2  # Un nodo con menos theme_overrides no es un bloque que extraer
+RECURSOS_BYTES_REFERENCIA = 70  # Línea ext_resource + referencia que sustituye a cada copia
+RECURSOS_MAX_GRUPOS = 15  # Grupos mostrados en el informe
 
-    return {
-        "es_duplicacion": True,
-        "nivel": nivel,
-        "archivos_duplicados": [(d["archivo1"], d["archivo2"], f"{d['similitud']}%") for d in duplicados],
-        "patrones_comunes": patrones_repetidos if patrones_repetidos else [duplicados[0]["patron"]],
-        "recomendacion": recomendacion
-    }
 
+def _hash_propiedad(propiedad: str) -> str:
+    return hashlib.blake2b(propiedad.encode('utf-8'), digest_size=4).hexdigest()
 
-async def step3_buscar(search_term: str, project_path: str, content_pattern: str = None,
-                        decision_usuario: bool = False, justificacion_salto: str = None,
-                        usuario_verifico: bool = False) -> str:
-    """PASO 3: ¿Existe algo similar?
 
-    Busca en:
-    1. Código fuente (por nombre y contenido)
-    2. Documentación del proyecto (.claude/, docs/)
+def _bytes_propiedades(props: list) -> int:
+    return sum(len(prop.encode('utf-8')) + 1 for prop in props)
+
+
+def recursos_de_escena(content: str, nombre_archivo: str) -> list:
+    """Recursos de una escena: [[clase, tipo, nombre, bytes, [hashes de propiedades]]].
+
+    clase es "sub_resource", "theme_overrides" (nombre = ruta del nodo) o
+    "tres" (el [resource] de un .tres; nombre = nombre del archivo).
     """
+    escena = parsear_escena(io.StringIO(content))
+    recursos = []
+    for sub in escena["sub_resources"]:
+        if sub["props"]:
+            cabecera = len(f'[sub_resource type="{sub["type"]}" id="{sub["id"]}"]\n')
+            recursos.append(["sub_resource", sub["type"], sub["id"],
+                             cabecera + _bytes_propiedades(sub["props"]), sorted(set(map(_hash_propiedad, sub["props"])))])
+    for nodo in escena["nodos"]:
+        if len(nodo["overrides"]) >= RECURSOS_MIN_OVERRIDES:
+            recursos.append(["theme_overrides", "theme_overrides", nombre_de_nodo(nodo),
+                             _bytes_propiedades(nodo["overrides"]), sorted(set(map(_hash_propiedad, nodo["overrides"])))])
+    recurso = escena["recurso"]
+    if recurso is not None and recurso["props"]:
+        recursos.append(["tres", recurso["type"], nombre_archivo,
+                         _bytes_propiedades(recurso["props"]), sorted(set(map(_hash_propiedad, recurso["props"])))])
+    return recursos
+
+
+def grupos_de_recursos(index: dict, rels: list) -> list:
+    """Grupos de recursos repetidos entre escenas, de mayor a menor ahorro.
+
+    Devuelve [{"tipo", "clase", "miembros": [(rel, clase, nombre, bytes)],
+    "variantes", "archivos", "tres", "ahorro"}].
+    """
+    # (clase agrupable, tipo) → conjunto de propiedades → instancias
+    por_tipo = {}
+    for rel in rels:
+        for clase, tipo, nombre, tamano, props in dato_indexado(index, rel, "recursos") or []:
+            grupo = "theme_overrides" if clase == "theme_overrides" else "recurso"
+            conjuntos = por_tipo.setdefault((grupo, tipo), {})
+            conjuntos.setdefault(frozenset(props), []).append((rel, clase, nombre, tamano))
+
+    grupos = []
+    for (grupo, tipo), conjuntos in por_tipo.items():
+        claves = list(conjuntos)
+
+        def parecidos_entre(i, j):
+            return len(claves[i] & claves[j]) / len(claves[i] | claves[j]) > ESCENA_UMBRAL_SIMILITUD
+
+        firmas = [minhash_de_conjunto(clave, ESCENA_MINHASH_CUBETAS) for clave in claves]
+        componentes = _agrupar_pares(len(claves), pares_candidatos(firmas, ESCENA_LSH_FILAS), parecidos_entre)
+        sueltos = [[i] for i, clave in enumerate(claves) if len(conjuntos[clave]) > 1]
+        agrupados = {i for componente in componentes for i in componente}
+        for componente in componentes + [c for c in sueltos if c[0] not in agrupados]:
+            miembros = sorted(m for i in componente for m in conjuntos[claves[i]])
+            tres = [m[0] for m in miembros if m[1] == "tres"]
+            copias = [m for m in miembros if m[1] != "tres"]
+            # Una copia del recurso queda en el .tres compartido (salvo si ya existe)
+            mayor = 0 if tres else max(m[3] for m in copias)
+            ahorro = sum(m[3] for m in copias) - mayor - len(copias) * RECURSOS_BYTES_REFERENCIA
+            if len(copias) < (1 if tres else 2) or ahorro <= 0:
+                continue
+            grupos.append({
+                "tipo": tipo,
+                "clase": grupo,
+                "miembros": miembros,
+                "variantes": len(componente),
+                "archivos": len({m[0] for m in miembros}),
+                "tres": tres,
+                "ahorro": ahorro,
+            })
 
-    # Verificar paso anterior
-    if not SESSION_STATE["step_2"]:
-        resultado = manejar_decision_usuario(
-            "philosophy_q2_reutilizacion", "philosophy_q3_buscar",
-            decision_usuario, justificacion_salto, usuario_verifico
-        )
-        if resultado is not None:
-            return resultado
-        SESSION_STATE["step_2"] = True
+    grupos.sort(key=lambda g: (-g["ahorro"], g["miembros"]))
+    return grupos
 
-    path = Path(project_path).expanduser().resolve()
 
-    if not path.exists():
-        return f"Error: El directorio {project_path} no existe"
+def informe_de_recursos(index: dict, rels: list) -> dict:
+    """Grupos de recursos repetidos entre estas escenas (bloqueante)"""
+    grupos = grupos_de_recursos(index, rels)
+    guardar_indice_proyecto(index)
+    return {"archivos": len(rels), "grupos": grupos}
 
-    # 1. BUSCAR EN CÓDIGO FUENTE (usando ripgrep si disponible, fallback a Python)
-    import subprocess
-    import shutil
 
-    found_by_name = []
-    found_by_content = []
-    search_lower = search_term.lower()
-    extensions = [".gd", ".tscn", ".py", ".php", ".js", ".ts", ".jsx", ".tsx", ".vue"]
-    rg_available = shutil.which("rg") is not None
+def _formato_bytes(n: int) -> str:
+    return f"{n / 1024:.1f} KB" if n >= 1024 else f"{n} B"
 
-    if rg_available:
-        # Búsqueda por nombre con ripgrep --files + grep
-        try:
-            glob_args = []
-            for ext in extensions:
-                glob_args.extend(["--glob", f"*{ext}"])
-            result = subprocess.run(
-                ["rg", "--files", "--glob", "!.git", "--glob", "!__pycache__", "--glob", "!addons"] + glob_args,
-                capture_output=True, text=True, cwd=str(path), timeout=30
-            )
-            for line in result.stdout.splitlines():
-                if search_lower in Path(line).name.lower():
-                    found_by_name.append(path / line)
-        except (subprocess.TimeoutExpired, Exception):
-            pass  # Fallback below if needed
-
-        # Búsqueda por contenido con ripgrep
-        if content_pattern:
-            try:
-                glob_args = []
-                for ext in extensions:
-                    glob_args.extend(["--glob", f"*{ext}"])
-                result = subprocess.run(
-                    ["rg", "-l", "-i", "--glob", "!.git", "--glob", "!__pycache__"] + glob_args + [content_pattern],
-                    capture_output=True, text=True, cwd=str(path), timeout=30
-                )
-                for line in result.stdout.splitlines():
-                    file_path_found = path / line
-                    if file_path_found not in found_by_name:
-                        found_by_content.append(file_path_found)
-            except (subprocess.TimeoutExpired, Exception):
-                pass
-    else:
-        # Fallback: Python rglob (lento en proyectos grandes)
-        for ext in extensions:
-            for file in path.rglob(f"*{ext}"):
-                if ".git" not in str(file) and "__pycache__" not in str(file) and "addons" not in str(file):
-                    if search_lower in file.name.lower():
-                        found_by_name.append(file)
-
-        if content_pattern:
-            for ext in extensions:
-                for file in path.rglob(f"*{ext}"):
-                    if ".git" not in str(file) and "__pycache__" not in str(file):
-                        try:
-                            content = file.read_text(encoding='utf-8', errors='ignore')
-                            if re.search(content_pattern, content, re.IGNORECASE):
-                                if file not in found_by_name:
-                                    found_by_content.append(file)
-                        except:
-                            pass
-
-    # 2. BUSCAR EN DOCUMENTACIÓN DEL PROYECTO
-    doc_results = search_project_documentation(path, search_term)
-    primary_docs = doc_results["primary"]
-    secondary_docs = doc_results["secondary"]
 
-    # Guardar resultados
-    SESSION_STATE["search_results"] = found_by_name + found_by_content
-    SESSION_STATE["step_3"] = True
+async def resource_duplication_report(project_path: str) -> str:
+    """Informe de SubResources y theme_overrides repetidos entre escenas (no depende del flujo q1-q9)"""
+    path = Path(project_path).expanduser().resolve()
 
-    # 3. DETECTAR DUPLICACIÓN
-    language = SESSION_STATE.get("current_language", "godot")
-    duplicacion = detectar_duplicacion(found_by_name + found_by_content, path, language)
-    SESSION_STATE["duplication_detected"] = duplicacion
+    if not path.exists():
+        return f"Error: El directorio {project_path} no existe"
+
+    async with semaforo_proyecto(path):
+        index = await en_hilo(obtener_indice_proyecto, path)
+        rels = archivos_indexados(index, RECURSOS_EXTENSIONS)
+        # Recursos de las escenas nuevas o cambiadas, repartidos entre procesos
+        await precalcular_datos(index, rels, "recursos")
+        informe = await en_hilo(informe_de_recursos, index, rels)
 
+    grupos = informe["grupos"]
     response = f"""
 ╔══════════════════════════════════════════════════════════════════╗
-║  PASO 3/9: BUSCAR SIMILAR                                        ║
-║  Pregunta: ¿Existe algo similar que pueda extender/heredar?      ║
+║  RECURSOS REPETIDOS ENTRE ESCENAS                                ║
 ╚══════════════════════════════════════════════════════════════════╝
 
-🔍 TÉRMINO: "{search_term}"
 📁 PROYECTO: {project_path}
-{"🔎 PATRÓN CONTENIDO: " + content_pattern if content_pattern else ""}
+📄 ESCENAS Y RECURSOS ANALIZADOS: {informe["archivos"]}
+"""
 
+    if not grupos:
+        response += """
+✅ No hay SubResources ni bloques de theme_overrides copiados entre escenas.
 """
+        return response
+
+    total = sum(g["ahorro"] for g in grupos)
+    response += f"""🎨 GRUPOS: {len(grupos)} (ahorro estimado ~{_formato_bytes(total)} de texto de escena)
 
-    # Mostrar documentación encontrada PRIMERO (prioridad alta)
-    if primary_docs:
-        response += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📚 DOCUMENTACIÓN RELEVANTE ({len(primary_docs)} principales, {len(secondary_docs)} secundarios)
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
 
-⚠️ IMPORTANTE: Lee esta documentación ANTES de crear código nuevo.
-   Ordenada por: tipo + fecha + relevancia (duplicados detectados)
+    for i, grupo in enumerate(grupos[:RECURSOS_MAX_GRUPOS], 1):
+        copias = [m for m in grupo["miembros"] if m[1] != "tres"]
+        variantes = f"({grupo['variantes']} variantes, >80% propiedades iguales)"
+        if grupo["clase"] == "theme_overrides":
+            if grupo["variantes"] == 1:
+                titulo = f"{len(copias)} nodos con los mismos theme_overrides"
+            else:
+                titulo = f"{len(copias)} nodos con theme_overrides casi idénticos {variantes}"
+            destino = "un Theme (.tres) compartido"
+        else:
+            parecido = "idénticos" if grupo["variantes"] == 1 else f"casi idénticos {variantes}"
+            titulo = f"{len(copias)} {grupo['tipo']} {parecido}"
+            destino = f"un {grupo['tipo']} en .tres compartido"
+        response += f"\n{i}. {titulo} en {grupo['archivos']} archivos\n"
+        for rel, _, nombre, _ in copias[:6]:
+            response += f"   • {rel} → {nombre}\n"
+        if len(copias) > 6:
+            response += f"   ... y {len(copias) - 6} más\n"
+        if grupo["tres"]:
+            response += f"   ✅ Ya existe como recurso: {', '.join(grupo['tres'][:3])} → usa ExtResource\n"
+        else:
+            response += f"   ➡️ Extraer a {destino}\n"
+        response += f"   💾 Ahorro estimado: ~{_formato_bytes(grupo['ahorro'])}"
+        if grupo["clase"] != "theme_overrides":
+            response += f", {len(copias) - (0 if grupo['tres'] else 1)} recursos menos al cargar"
+        response += "\n"
+
+    if len(grupos) > RECURSOS_MAX_GRUPOS:
+        response += f"\n... y {len(grupos) - RECURSOS_MAX_GRUPOS} grupos más\n"
 
+    response += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+➡️ CÓMO USARLO:
+   • Idénticos → guarda uno como .tres y sustituye las copias por ExtResource
+   • Casi idénticos → .tres base común; las diferencias, en la escena o en variantes del Theme
+   • theme_overrides repetidos → mueve esos valores a un Theme asignado al nodo padre
+   • En un análisis arquitectónico, inclúyelo en el plan de la FASE 4
 """
-        for i, doc in enumerate(primary_docs[:5], 1):
-            doc_type = doc.get('doc_type', 'otro').upper()
-            priority = doc.get('priority', '📎 BAJA')
-            age_label = doc.get('age_label', '⚪')
+    return response
 
-            response += f"{i}. {priority} {doc['title']}\n"
-            response += f"   📁 {doc['relative_path']}\n"
-            response += f"   {doc_type} | {age_label}\n"
 
-            if doc.get('warnings'):
-                for warning in doc['warnings'][:2]:
-                    response += f"   ⚠️ {warning}\n"
+# ============================================================
+# MOTOR DE REGLAS DE VALIDACIÓN (q8)
+# ============================================================
+# Las reglas de philosophy_validate se compilan una vez al arrancar y se
+# aplican en un único recorrido por las líneas del código. Cada expresión mira
+# una sola línea y no tiene repeticiones anidadas, así que el coste es lineal en
+# el tamaño del archivo. Lo que abarca varias líneas (funciones largas, líneas
+# repetidas, número de clases) se lleva con contadores durante el recorrido.
+
+VALIDACION_MAX_CLASES = 2
+VALIDACION_MAX_LINEAS_FUNCION = 50
+VALIDACION_MIN_LINEA_REPETIDA = 30  # Caracteres: las líneas más cortas se repiten por naturaleza
+VALIDACION_REPETICIONES = 3
+
+OLOR_DEF_LARGA = "Función muy larga (>50 líneas). Divide en funciones más pequeñas."
+
+_RE_CLASE = re.compile(r'class\s+\w')
+_RE_FUNCION = re.compile(r'(?:func|def)\s+\w')
+_RE_ARCHIVO_COMPLETO = re.compile(r'extends|class_name|@tool|##|#\s*-|import |from |<!')
+_RE_EXTENDS = re.compile(r'extends\s')
+_RE_DEF_PYTHON = re.compile(r'\s*(?:async\s+)?def\s+\w+\(')
+_RE_FIN_FIRMA = re.compile(r'\s*(?:->[^:#]*)?:\s*(?:#.*)?$')  # Tras el `)`: [-> retorno]: [# comentario]
+_RE_GET_NODE_ABSOLUTO = re.compile(r'get_node\(["\']/')
+_RE_SIGNAL = re.compile(r'\.emit\(|\.connect\(')
+_RE_COLOR_LITERAL = re.compile(r'Color\s*\(\s*[\d.]')
+_RE_DECLARACION = re.compile(r'(?:const|var|@export)\s')
+_RE_VAR_LLAMADA = re.compile(r'var\s+\w+\s*=\s*\w+\(')
+_RE_ASIGNACION = re.compile(r'(?<![^\s=])([^\s=]+)\s*=')  # Empieza en límite de palabra: sin reintentos
+
+
+def _compilar_olores() -> dict:
+    """lenguaje → (prefiltro con todas las reglas, [(regex, mensaje)]) de PHILOSOPHY["code_smells"]"""
+    olores = {}
+    for language, reglas in PHILOSOPHY["code_smells"].items():
+        if reglas:
+            prefiltro = re.compile("|".join(f"(?:{patron})" for patron, _ in reglas))
+            olores[language] = (prefiltro, [(re.compile(patron), mensaje) for patron, mensaje in reglas])
+    return olores
+
+
+OLORES_COMPILADOS = _compilar_olores()
+
+
+def _recorrer_firma(texto: str, abiertos: int) -> tuple:
+    """Avanza por un trozo de firma de def con `abiertos` paréntesis sin cerrar.
+
+    Devuelve (abiertos, resto): resto es lo que sigue al `)` que cierra la
+    firma, o None si sigue abierta al final del trozo. Los paréntesis dentro
+    de cadenas y comentarios no cuentan.
+    """
+    comilla = None
+    escapado = False
+    for i, c in enumerate(texto):
+        if comilla is not None:
+            if escapado:
+                escapado = False
+            elif c == "\\":
+                escapado = True
+            elif c == comilla:
+                comilla = None
+        elif c in "\"'":
+            comilla = c
+        elif c == "#":
+            break
+        elif c == "(":
+            abiertos += 1
+        elif c == ")":
+            abiertos -= 1
+            if abiertos == 0:
+                return 0, texto[i + 1:]
+    return abiertos, None
 
-            if doc['relevant_sections']:
-                response += f"   Secciones:\n"
-                for section in doc['relevant_sections'][:3]:
-                    response += f"      → {section}\n"
-            response += "\n"
 
-        if secondary_docs:
-            response += f"   📎 {len(secondary_docs)} docs secundarios (versiones anteriores o baja relevancia)\n\n"
+def aplicar_reglas_validacion(lines: list, language: str) -> dict:
+    """Problemas y advertencias del código fuente en un solo recorrido de sus líneas.
 
-    if found_by_name:
-        response += f"📄 CÓDIGO POR NOMBRE ({len(found_by_name)} archivos):\n"
-        for f in found_by_name[:15]:
-            try:
-                relative = f.relative_to(path)
-                response += f"   • {relative}\n"
-            except:
-                response += f"   • {f.name}\n"
-        if len(found_by_name) > 15:
-            response += f"   ... y {len(found_by_name) - 15} más\n"
-        response += "\n"
+    Devuelve {"issues", "warnings", "completo"}; completo es False si el código
+    parece un fragmento (sin extends, imports, cabecera...).
+    """
+    prefiltro, olores = OLORES_COMPILADOS.get(language, (None, []))
+    olores_vistos = set()
+    es_godot = language == "godot"
+    es_python = language == "python"
+
+    clases = 0
+    funciones = []  # Líneas donde empieza cada func/def de primer nivel
+    completo = False
+    extends = False
+    llamadas_directas = 0
+    signals = 0
+    color_inline = None
+    repetidas = {}
+    def_larga = False
+    en_firma = 0  # Paréntesis sin cerrar de una firma de def que sigue en las líneas siguientes
+    cuerpo_def = None  # Líneas indentadas tras una cabecera de def (None = fuera de def)
+
+    for n, line in enumerate(lines):
+        # Reglas de PHILOSOPHY["code_smells"]: una búsqueda por línea y solo si alguna encaja
+        if prefiltro is not None and len(olores_vistos) < len(olores) and prefiltro.search(line):
+            for i, (regex, _) in enumerate(olores):
+                if i not in olores_vistos and regex.search(line):
+                    olores_vistos.add(i)
 
-    if found_by_content:
-        response += f"📝 CÓDIGO POR CONTENIDO ({len(found_by_content)} archivos):\n"
-        for f in found_by_content[:10]:
-            try:
-                relative = f.relative_to(path)
-                response += f"   • {relative}\n"
-            except:
-                response += f"   • {f.name}\n"
-        response += "\n"
+        stripped = line.strip()
+        if line[:1] not in (" ", "\t", ""):
+            # Construcciones de primer nivel (inicio de línea)
+            if _RE_CLASE.match(line):
+                clases += 1
+            if _RE_FUNCION.match(line):
+                funciones.append(n)
+            if not completo and _RE_ARCHIVO_COMPLETO.match(line):
+                completo = True
+            if es_godot and not extends and _RE_EXTENDS.match(line):
+                extends = True
+
+        if es_python and not def_larga:
+            if cuerpo_def is not None:
+                if not stripped:
+                    pass  # Las líneas en blanco no cortan ni cuentan
+                elif line[:1] in (" ", "\t"):
+                    cuerpo_def += 1
+                    if cuerpo_def >= VALIDACION_MAX_LINEAS_FUNCION:
+                        def_larga = True
+                else:
+                    cuerpo_def = None
+            # Una def dentro de un bloque que ya se cuenta no reinicia la cuenta
+            resto = None
+            if en_firma:
+                en_firma, resto = _recorrer_firma(line, en_firma)
+            elif "def" in line and _RE_DEF_PYTHON.match(line):
+                en_firma, resto = _recorrer_firma(line[line.find("(") + 1:], 1)
+            if resto is not None and cuerpo_def is None and _RE_FIN_FIRMA.match(resto):
+                cuerpo_def = 0
+
+        if es_godot:
+            if "get_node" in line:
+                llamadas_directas += len(_RE_GET_NODE_ABSOLUTO.findall(line))
+            if ".emit(" in line or ".connect(" in line:
+                signals += len(_RE_SIGNAL.findall(line))
+            if color_inline is None and "Color" in line and _RE_COLOR_LITERAL.search(stripped):
+                if not _RE_DECLARACION.match(stripped):
+                    color_inline = stripped
+
+        # Líneas repetidas (excepto llamadas a helpers: "var x = func()")
+        if len(stripped) > VALIDACION_MIN_LINEA_REPETIDA and not stripped.startswith(("#", "//")):
+            if not (stripped.startswith("var") and _RE_VAR_LLAMADA.match(stripped)):
+                repetidas[stripped] = repetidas.get(stripped, 0) + 1
+
+    issues = [f"❌ {olores[i][1]}" for i in sorted(olores_vistos)]
+    if def_larga:
+        issues.append(f"❌ {OLOR_DEF_LARGA}")
+    warnings = []
 
-    if not found_by_name and not found_by_content and not primary_docs:
-        response += """❌ NO SE ENCONTRÓ NADA SIMILAR
+    if clases > VALIDACION_MAX_CLASES:
+        issues.append(f"❌ Responsabilidad: {clases} clases en un archivo. Viola Q1: debe hacer UNA sola cosa.")
 
-   Puedes crear algo nuevo.
-"""
-    else:
-        # Mostrar advertencia de duplicación si se detectó
-        if duplicacion["es_duplicacion"]:
-            nivel = duplicacion["nivel"]
-            emoji = "⛔" if nivel == "alto" else "⚠️" if nivel == "medio" else "💡"
+    for i, inicio in enumerate(funciones):
+        fin = funciones[i + 1] + 1 if i + 1 < len(funciones) else len(lines)
+        if fin - inicio > VALIDACION_MAX_LINEAS_FUNCION:
+            warnings.append(f"⚠️ Función muy larga ({fin - inicio} líneas). Considera dividir.")
 
-            response += f"""
-{'═' * 68}
-{emoji} DUPLICACIÓN DETECTADA - NIVEL {nivel.upper()}
-{'═' * 68}
+    if es_godot:
+        if llamadas_directas > 3 and signals == 0:
+            warnings.append("⚠️ Herencia: Muchas llamadas directas. Usa signals para desacoplar.")
+        if completo and not extends:
+            warnings.append("⚠️ Herencia: No hay 'extends'. ¿Debería heredar de algo?")
+        if color_inline is not None:
+            issues.append(f"❌ Color hardcodeado inline: `{color_inline}`. Usa AppTheme o una constante nombrada.")
 
-📋 ARCHIVOS CON CÓDIGO SIMILAR:
-"""
-            for arch1, arch2, similitud in duplicacion["archivos_duplicados"][:5]:
-                response += f"   • {arch1} ↔ {arch2} ({similitud} similitud)\n"
+    duplicates = sum(1 for veces in repetidas.values() if veces >= VALIDACION_REPETICIONES)
+    if duplicates > 0:
+        issues.append(f"❌ DRY: {duplicates} líneas repetidas 3+ veces. Extrae a función/componente.")
 
-            if duplicacion["patrones_comunes"]:
-                response += f"\n🔍 PATRONES: {', '.join(duplicacion['patrones_comunes'])}\n"
+    return {"issues": issues, "warnings": warnings, "completo": completo}
 
-            response += f"""
-🎯 RECOMENDACIÓN: {duplicacion["recomendacion"]}
 
-"""
-            if nivel == "alto":
-                response += """
-╔══════════════════════════════════════════════════════════════════╗
-║  🛑 PARA - NO CONTINUES SIN RESOLVER ESTO                        ║
-╚══════════════════════════════════════════════════════════════════╝
+def propiedades_no_replicadas(code: str, reference_properties: list) -> list:
+    """Propiedades de referencia (q6) que el código no asigna nunca.
 
-⛔ INSTRUCCIÓN OBLIGATORIA PARA CLAUDE:
+    Una propiedad está replicada si aparece justo antes de un '=' (p.ej. `prop =`,
+    `.prop =`, `self.prop =`), sin distinguir mayúsculas. Se recorre el código una
+    vez, sin construir una regex por propiedad.
+    """
+    if not reference_properties:
+        return []
+    asignados = {match.group(1).lower() for match in _RE_ASIGNACION.finditer(code)}
 
-   Similitud >60% = DUPLICACIÓN REAL = DEUDA TÉCNICA
+    missing = []
+    for ref in reference_properties:
+        ref_file = ref.get("file", "")
+        for prop, expected_value in ref.get("found", {}).items():
+            clave = prop.lower()
+            if clave not in asignados and not any(nombre.endswith(clave) for nombre in asignados):
+                missing.append({
+                    "property": prop,
+                    "expected_value": expected_value,
+                    "source_file": ref_file
+                })
+    return missing
 
-   ANTES de continuar con q4, DEBES:
 
-   1. ANALIZAR qué código está duplicado entre los archivos
-   2. IDENTIFICAR la abstracción común (BaseX, AbstractX)
-   3. Estas son las opciones posibles:
+def hallazgos_escena(code: str, reference_properties: list) -> dict:
+    """Problemas y advertencias de una escena .tscn/.tres.
 
-      A) CREAR CLASE BASE nueva
-         → hereda_de: "BaseNombreNuevo (crear)"
-         → Los archivos existentes TAMBIÉN heredarán de ella
+    Devuelve {"issues", "warnings", "lineas", "sub_resources"}.
+    """
+    issues = []
+    warnings = []
+    escena = parsear_escena(io.StringIO(code))
+
+    # 1. DRY: SubResources del mismo tipo idénticos o con >80% de propiedades iguales
+    identicos, parecidos = subresources_repetidos(escena["sub_resources"])
+    for type_name, ids in identicos:
+        if len(ids) == 2:
+            issues.append(
+                f"❌ DRY: SubResources '{ids[0]}' y '{ids[1]}' "
+                f"(tipo {type_name}) son idénticos. Reutiliza uno solo."
+            )
+        else:
+            issues.append(
+                f"❌ DRY: {len(ids)} SubResources ({', '.join(ids[:3])}...) "
+                f"(tipo {type_name}) son idénticos. Reutiliza uno solo."
+            )
+    for type_name, ids in parecidos:
+        if len(ids) == 2:
+            warnings.append(
+                f"⚠️ DRY: SubResources '{ids[0]}' y '{ids[1]}' "
+                f"(tipo {type_name}) tienen >80% propiedades iguales."
+            )
+        else:
+            warnings.append(
+                f"⚠️ DRY: {len(ids)} SubResources ({', '.join(ids[:3])}...) "
+                f"(tipo {type_name}) tienen >80% propiedades iguales."
+            )
 
-      B) HEREDAR del existente
-         → hereda_de: "ArchivoExistente"
-         → Extender funcionalidad, no duplicar
+    # 2. DRY: Nodos con los mismos theme_overrides
+    for nodes in overrides_repetidos(escena["nodos"]):
+        warnings.append(
+            f"⚠️ DRY: {len(nodes)} nodos ({', '.join(nodes[:3])}...) "
+            f"tienen los mismos theme_overrides. Considera usar un Theme."
+        )
 
-      C) REFACTORIZAR PRIMERO
-         → hereda_de: "REFACTORIZAR_PRIMERO"
-         → Explicar qué refactorizar antes de crear nuevo
+    # 3. Colores hardcodeados fuera de theme_overrides
+    if escena["colores"] > ESCENA_MAX_COLORES:
+        warnings.append(f"⚠️ {escena['colores']} colores hardcodeados. Usa AppTheme o un recurso de tema.")
 
-   ❌ PROHIBIDO:
-      - Elegir "ninguno" o "copiar y adaptar"
-      - Mover funciones a utils/helpers (es un PARCHE, no arquitectura)
-      - Continuar sin resolver la duplicación
+    # 4. Verificar propiedades de referencia (del paso 6)
+    missing_reference_props = propiedades_no_replicadas(code, reference_properties)
 
-   💡 PREGÚNTATE: "Si mañana cambio el estilo de tabs, ¿tendré que
-      modificar 1 archivo (base) o N archivos (duplicados)?"
+    if missing_reference_props:
+        warnings.append(f"⚠️ Propiedades de referencia no replicadas ({len(missing_reference_props)}):")
+        for mp in missing_reference_props[:5]:
+            warnings.append(f"   • {mp['property']} = {mp['expected_value']} (de {mp['source_file']})")
 
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-   📢 DESPUÉS DE ANALIZAR: EXPLICA Y PREGUNTA AL USUARIO
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    return {
+        "issues": issues, "warnings": warnings,
+        "lineas": escena["lineas"], "sub_resources": len(escena["sub_resources"]),
+    }
 
-   4. EXPLICA al usuario tus conclusiones:
-      - Qué código está duplicado y por qué
-      - Cuál es tu recomendación (A, B o C) y por qué
 
-   5. USA AskUserQuestion para que el usuario DECIDA:
-      - Presenta las opciones A, B, C
-      - Añade opción D: "Ignorar (tengo una razón válida)"
+def hallazgos_codigo(code: str, language: str, reference_properties: list) -> dict:
+    """Problemas y advertencias de un archivo de código fuente.
 
-   6. USA la respuesta del usuario en q4:
-      - Si A → hereda_de: "BaseNueva"
-      - Si B → hereda_de: "ClaseExistente"
-      - Si C → hereda_de: "REFACTORIZAR_PRIMERO"
-      - Si D → justificación: "USUARIO: [razón que dio el usuario]"
+    Devuelve {"issues", "warnings", "lineas", "completo"}.
+    """
+    lines = code.split('\n')
 
-   NO continues sin la confirmación del usuario.
+    # Code smells, Q1 (clases, funciones largas), Q4 (signals, extends), colores
+    # inline y líneas repetidas: todo en un recorrido
+    hallazgos = aplicar_reglas_validacion(lines, language)
+    issues = hallazgos["issues"]
+    warnings = hallazgos["warnings"]
 
-"""
-            elif nivel == "medio":
-                response += """
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ ATENCIÓN CLAUDE - Similitud detectada
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    # Verificar propiedades de referencia (del paso 6)
+    missing_reference_props = propiedades_no_replicadas(code, reference_properties)
 
-   ANTES de continuar, evalúa honestamente:
+    if missing_reference_props:
+        warnings.append(f"⚠️ Propiedades de referencia no replicadas ({len(missing_reference_props)}):")
+        for mp in missing_reference_props[:5]:  # Mostrar máx 5
+            warnings.append(f"   • {mp['property']} = {mp['expected_value']} (de {mp['source_file']})")
+        if len(missing_reference_props) > 5:
+            warnings.append(f"   ... y {len(missing_reference_props) - 5} más")
 
-   • ¿El código que voy a escribir será >50% similar al existente?
-   • Si copio y adapto, ¿estoy creando deuda técnica?
-   • ¿Puedo HEREDAR del existente en lugar de duplicar?
-   • ¿Debería EXTRAER base común primero?
+    return {"issues": issues, "warnings": warnings, "lineas": len(lines), "completo": hallazgos["completo"]}
 
-   Si la respuesta a cualquiera es SÍ → trata como nivel ALTO
 
-   📢 EXPLICA al usuario tu análisis y USA AskUserQuestion
-      para confirmar cómo proceder antes de continuar.
+def es_escena(filename: str) -> bool:
+    return filename.endswith('.tscn') or filename.endswith('.tres')
 
-"""
-        else:
-            response += """
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ IA: EVALÚA estos resultados y decide:
-   • ¿Hay DOCUMENTACIÓN con instrucciones a seguir?
-   • ¿Puedo REUTILIZAR algún código directamente?
-   • ¿Puedo EXTENDER/HEREDAR de alguno?
-   • ¿Necesito crear uno NUEVO? ¿Por qué?
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
 
-    response += """
-✅ PASO 3 COMPLETADO
+# ============================================================
+# CACHÉ DE VALIDACIÓN (q8)
+# ============================================================
+# philosophy_validate se llama varias veces sobre el mismo contenido (la
+# vuelta con usuario_confirmo_warnings, una edición que no cambia nada...).
+# Los hallazgos se guardan por (hash del contenido, lenguaje o escena, hash de
+# las propiedades de referencia) y persisten entre sesiones en
+# ~/.claude/philosophy_validacion.json. Si cambian las reglas, la caché se descarta.
+#
+# El contenido de cada versión validada se guarda además en memoria por su
+# hash: la siguiente validación puede enviar solo un diff contra esa versión.
 
-➡️ SIGUIENTE: Usa philosophy_q4_herencia
-   Pregunta: ¿Si cambio la base, se actualizarán todas las instancias?
-"""
-    return response
+VALIDACION_CACHE_FILE = Path.home() / ".claude" / "philosophy_validacion.json"
+VALIDACION_CACHE_MAX = 500  # Entradas; se descartan las usadas hace más tiempo
+VALIDACION_REGLAS_VERSION = 2  # Subir al cambiar la lógica de hallazgos_escena/hallazgos_codigo
 
 
-async def step4_herencia(hereda_de: str, reutiliza: str, justificacion: str,
-                          decision_usuario: bool = False, justificacion_salto: str = None,
-                          usuario_verifico: bool = False) -> str:
-    """PASO 4: ¿Se actualizan las instancias?"""
+def _huella_reglas() -> str:
+    """Versión de las reglas: cambia si cambian los olores o los umbrales"""
+    reglas = json.dumps([
+        VALIDACION_REGLAS_VERSION, PHILOSOPHY["code_smells"], VALIDACION_MAX_CLASES,
+        VALIDACION_MAX_LINEAS_FUNCION, VALIDACION_MIN_LINEA_REPETIDA, VALIDACION_REPETICIONES,
+        ESCENA_UMBRAL_SIMILITUD, ESCENA_MIN_OVERRIDES_REPETIDOS, ESCENA_MAX_COLORES,
+    ], sort_keys=True)
+    return _hash_contenido(reglas.encode('utf-8'))
 
-    # Verificar paso anterior
-    if not SESSION_STATE["step_3"]:
-        resultado = manejar_decision_usuario(
-            "philosophy_q3_buscar", "philosophy_q4_herencia",
-            decision_usuario, justificacion_salto, usuario_verifico
-        )
-        if resultado is not None:
-            return resultado
-        SESSION_STATE["step_3"] = True
 
-    # VALIDAR COHERENCIA CON DETECCIÓN DE DUPLICACIÓN
-    duplicacion = SESSION_STATE.get("duplication_detected") or {}
-    es_duplicacion = duplicacion.get("es_duplicacion", False)
-    nivel_dup = duplicacion.get("nivel", None)
+HUELLA_REGLAS_VALIDACION = _huella_reglas()
 
-    # Normalizar respuestas
-    hereda_lower = hereda_de.lower().strip()
-    reutiliza_lower = reutiliza.lower().strip()
-    justificacion_strip = justificacion.strip() if justificacion else ""
+# Hallazgos en memoria (clave → hallazgos), en orden de uso; None hasta el primer uso
+_CACHE_VALIDACION = None
+_CACHE_VALIDACION_LOCK = threading.Lock()
+_cache_validacion_modificada = False
 
-    # Detectar si está evitando la decisión
-    evita_decision = hereda_lower in ["ninguno", "ninguna", "none", "no", "n/a", "-", ""]
-    no_reutiliza = reutiliza_lower in ["ninguno", "ninguna", "none", "no", "n/a", "-", ""]
 
-    # Detectar si el USUARIO decidió ignorar (debe tener palabra clave)
-    palabras_clave_usuario = ["USUARIO:", "USER:", "DECISIÓN_USUARIO:", "IGNORAR:"]
-    usuario_decidio_ignorar = any(justificacion_strip.upper().startswith(kw) for kw in palabras_clave_usuario)
+def _cargar_cache_validacion() -> dict:
+    """Caché persistida, o {} si no existe o es de otras reglas"""
+    try:
+        data = json.loads(VALIDACION_CACHE_FILE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if data.get("reglas") != HUELLA_REGLAS_VALIDACION:
+        return {}
+    return data.get("entradas", {})
+
+
+def clave_validacion(code: str, filename: str, language: str, reference_properties: list) -> str:
+    """Clave de caché de una validación (la escena no depende del lenguaje)"""
+    tipo = "escena" if es_escena(filename) else language
+    referencias = json.dumps(reference_properties or [], sort_keys=True, ensure_ascii=False, default=str)
+    return "|".join((
+        _hash_contenido(code.encode('utf-8')), tipo,
+        _hash_contenido(referencias.encode('utf-8')),
+    ))
+
+
+def hallazgos_cacheados(clave: str):
+    """Hallazgos guardados para una clave de validación, o None"""
+    global _CACHE_VALIDACION
+    with _CACHE_VALIDACION_LOCK:
+        if _CACHE_VALIDACION is None:
+            _CACHE_VALIDACION = _cargar_cache_validacion()
+        hallazgos = _CACHE_VALIDACION.pop(clave, None)
+        if hallazgos is not None:
+            _CACHE_VALIDACION[clave] = hallazgos  # Pasa al final: usado ahora
+        return hallazgos
+
+
+def cachear_hallazgos(clave: str, hallazgos: dict) -> None:
+    global _cache_validacion_modificada
+    with _CACHE_VALIDACION_LOCK:
+        _CACHE_VALIDACION[clave] = hallazgos
+        while len(_CACHE_VALIDACION) > VALIDACION_CACHE_MAX:
+            del _CACHE_VALIDACION[next(iter(_CACHE_VALIDACION))]
+        _cache_validacion_modificada = True
+
+
+def calcular_hallazgos(code: str, filename: str, language: str, reference_properties: list) -> dict:
+    if es_escena(filename):
+        return hallazgos_escena(code, reference_properties)
+    return hallazgos_codigo(code, language, reference_properties)
+
+
+def hallazgos_validacion(code: str, filename: str, language: str, reference_properties: list) -> dict:
+    """Hallazgos de philosophy_validate, calculados solo si el contenido no se validó antes"""
+    clave = clave_validacion(code, filename, language, reference_properties)
+    hallazgos = hallazgos_cacheados(clave)
+    if hallazgos is None:
+        hallazgos = calcular_hallazgos(code, filename, language, reference_properties)
+        cachear_hallazgos(clave, hallazgos)
+    return hallazgos
+
+
+def guardar_cache_validacion() -> None:
+    """Persiste la caché de validación si hubo cambios (escritura atómica)"""
+    global _cache_validacion_modificada
+    with _CACHE_VALIDACION_LOCK:
+        if not _cache_validacion_modificada:
+            return
+        payload = json.dumps(
+            {"reglas": HUELLA_REGLAS_VALIDACION, "entradas": _CACHE_VALIDACION},
+            ensure_ascii=False, separators=(',', ':')
+        )
+        _cache_validacion_modificada = False
 
-    # BLOQUEAR si hay duplicación ALTA, evita decisión Y no es decisión del usuario
-    if es_duplicacion and nivel_dup == "alto" and evita_decision and no_reutiliza:
-        if not usuario_decidio_ignorar:
-            return f"""
-╔══════════════════════════════════════════════════════════════════╗
-║  ⛔ BLOQUEADO: DECISIÓN INCOHERENTE CON DUPLICACIÓN DETECTADA    ║
-╚══════════════════════════════════════════════════════════════════╝
+    try:
+        VALIDACION_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = VALIDACION_CACHE_FILE.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(payload, encoding='utf-8')
+        os.replace(tmp_file, VALIDACION_CACHE_FILE)
+    except OSError:
+        # Sin permisos en ~/.claude: la caché sigue valiendo en memoria
+        pass
 
-En el PASO 3 se detectó DUPLICACIÓN NIVEL ALTO:
-   • Patrones: {', '.join(duplicacion.get('patrones_comunes', []))}
-   • Recomendación: {duplicacion.get('recomendacion', 'N/A')}
 
-Tu respuesta actual:
-   • hereda_de: "{hereda_de}"
-   • reutiliza_existente: "{reutiliza}"
+# Versiones validadas (hash → contenido), para validar después solo un diff
+VALIDACION_VERSIONES_MAX_BYTES = 64 * 1024 * 1024
+_VERSIONES_VALIDADAS = {}
+_bytes_versiones = 0
 
-⛔ ESTO NO ES ACEPTABLE
+_RE_CABECERA_HUNK = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
 
-Cuando hay duplicación alta, DEBES elegir UNA de estas opciones:
 
-   A) hereda_de: "NombreClaseBase" (crear o usar base existente)
-   B) hereda_de: "ClaseExistente" + justificar extensión
-   C) hereda_de: "REFACTORIZAR_PRIMERO" + explicar qué refactorizar
-   D) hereda_de: "ninguno" + justificación que empiece con "USUARIO:"
-      → Solo si el usuario DECIDIÓ ignorar la duplicación
+def recordar_version_validada(code: str) -> str:
+    """Guarda el contenido validado por su hash y devuelve el hash (la versión)"""
+    global _bytes_versiones
+    version = _hash_contenido(code.encode('utf-8'))
+    with _CACHE_VALIDACION_LOCK:
+        if _VERSIONES_VALIDADAS.pop(version, None) is None:
+            _bytes_versiones += len(code)
+        _VERSIONES_VALIDADAS[version] = code  # Pasa al final: usada ahora
+        while _bytes_versiones > VALIDACION_VERSIONES_MAX_BYTES and len(_VERSIONES_VALIDADAS) > 1:
+            _bytes_versiones -= len(_VERSIONES_VALIDADAS.pop(next(iter(_VERSIONES_VALIDADAS))))
+    return version
 
-❌ Tu justificación NO empieza con palabra clave de usuario.
-   Palabras clave válidas: {', '.join(palabras_clave_usuario)}
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def version_validada(version: str):
+    """Contenido de una versión validada en esta sesión, o None"""
+    with _CACHE_VALIDACION_LOCK:
+        return _VERSIONES_VALIDADAS.get(version)
 
-🔄 VUELVE A LLAMAR philosophy_q4_herencia con:
-   - Una decisión válida (A, B o C), O
-   - justificación que empiece con "USUARIO: [razón del usuario]"
-"""
 
-    # ADVERTIR si el usuario decidió ignorar duplicación alta
-    advertencia = ""
-    if es_duplicacion and nivel_dup == "alto" and evita_decision and usuario_decidio_ignorar:
-        advertencia = f"""
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ USUARIO DECIDIÓ IGNORAR DUPLICACIÓN ALTA
+def aplicar_diff_unificado(base: str, diff: str) -> str:
+    """Aplica un diff unificado (como `git diff` o `diff -u`) sobre base.
 
-   Razón: {justificacion_strip}
+    Las líneas de contexto y las borradas deben coincidir exactamente con la
+    base (sin desplazar hunks). Lanza ValueError si el diff no corresponde.
+    """
+    partes = base.split('\n')
+    base_lines = [parte + '\n' for parte in partes[:-1]] + ([partes[-1]] if partes[-1] else [])
+    diff_lines = diff.split('\n')
+    if diff_lines and diff_lines[-1] == '':
+        diff_lines.pop()
+
+    result = []
+    pos = 0
+    i = 0
+    hunks = 0
+    while i < len(diff_lines):
+        cabecera = _RE_CABECERA_HUNK.match(diff_lines[i])
+        i += 1
+        if cabecera is None:
+            if hunks == 0 or diff_lines[i - 1].startswith(("diff ", "index ", "--- ", "+++ ")):
+                continue  # Cabeceras de archivo (git, diff -u)
+            raise ValueError(f"línea fuera de un hunk: {diff_lines[i - 1][:60]!r}")
+        hunks += 1
+
+        inicio, antiguas, _, nuevas = cabecera.groups()
+        antiguas = 1 if antiguas is None else int(antiguas)
+        nuevas = 1 if nuevas is None else int(nuevas)
+        inicio = int(inicio) - (1 if antiguas else 0)  # '-n,0' inserta después de la línea n
+        if inicio < pos or inicio > len(base_lines):
+            raise ValueError(f"hunk fuera de la versión base (línea {inicio + 1})")
+        result.extend(base_lines[pos:inicio])
+        pos = inicio
+
+        while antiguas > 0 or nuevas > 0:
+            if i >= len(diff_lines):
+                raise ValueError("hunk incompleto")
+            line = diff_lines[i]
+            i += 1
+            marca, texto = line[:1], line[1:]
+            if marca in (" ", "", "-"):
+                if pos >= len(base_lines) or base_lines[pos].rstrip('\n') != texto:
+                    raise ValueError(f"la línea {pos + 1} no coincide con la versión base")
+                if marca != "-":
+                    result.append(base_lines[pos])
+                    nuevas -= 1
+                pos += 1
+                antiguas -= 1
+            elif marca == "+":
+                result.append(texto + '\n')
+                nuevas -= 1
+            elif marca != "\\":
+                raise ValueError(f"línea de hunk no válida: {line[:60]!r}")
+            if i < len(diff_lines) and diff_lines[i].startswith("\\"):
+                i += 1  # '\ No newline at end of file' de la línea anterior
+                if marca == "+":
+                    result[-1] = texto
+
+    if hunks == 0:
+        raise ValueError("el diff no tiene ningún hunk")
+    result.extend(base_lines[pos:])
+    return "".join(result)
 
-   ⚠️ Si esto genera deuda técnica, el usuario es responsable.
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
 
-    # ADVERTIR si hay duplicación MEDIA y evita decisión
-    if es_duplicacion and nivel_dup == "medio" and evita_decision and not advertencia:
-        advertencia = f"""
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ ADVERTENCIA: Se detectó duplicación MEDIA pero elegiste no heredar.
+# ============================================================
+# VALIDACIÓN POR LOTES (q8)
+# ============================================================
+# philosophy_validate_batch valida los archivos de un refactor de una vez: se
+# leen en el pool de E/S, los que ya están en la caché de validación no se
+# recalculan y el resto se reparte entre procesos con las mismas reglas.
 
-   Tu justificación: {justificacion}
+VALIDACION_LOTE_MIN_PROCESOS = 8  # Archivos sin caché a partir de los que se usan procesos
+VALIDACION_LOTE_MAX_DETALLE = 5  # Problemas y advertencias mostrados por archivo
 
-   Asegúrate de que esto NO resulte en código duplicado.
-   Si más tarde necesitas cambiar estilos/comportamiento, tendrás
-   que modificar MÚLTIPLES archivos en lugar de UNA base.
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
 
-    SESSION_STATE["step_4"] = True
+def _leer_archivos_lote(file_paths: list) -> list:
+    """[(ruta, contenido o None, error o None)] en el orden recibido"""
+    leidos = []
+    for file_path in file_paths:
+        try:
+            with open(Path(file_path).expanduser(), 'r', encoding='utf-8') as f:
+                leidos.append((file_path, f.read(), None))
+        except Exception as e:
+            leidos.append((file_path, None, str(e)))
+    return leidos
 
-    response = f"""
-╔══════════════════════════════════════════════════════════════════╗
-║  PASO 4/9: HERENCIA                                              ║
-║  Pregunta: ¿Si cambio la base, se actualizarán las instancias?   ║
-╚══════════════════════════════════════════════════════════════════╝
 
-🔗 HEREDA DE: {hereda_de}
+def validar_trozo(trozo: tuple) -> list:
+    """Hallazgos de un trozo de archivos (se ejecuta en un proceso del pool)"""
+    language, reference_properties, archivos = trozo
+    return [
+        (clave, calcular_hallazgos(code, filename, language, reference_properties))
+        for clave, filename, code in archivos
+    ]
 
-♻️ REUTILIZA EXISTENTE: {reutiliza}
 
-💡 JUSTIFICACIÓN: {justificacion}
-{advertencia}
-✅ PASO 4 COMPLETADO
+async def validar_lote(file_paths: list, language: str, reference_properties: list) -> list:
+    """Valida varios archivos en paralelo.
 
-➡️ SIGUIENTE: Usa philosophy_q5_nivel
-   Pregunta: ¿Está en el nivel correcto de la jerarquía?
-"""
-    return response
+    Devuelve [{"path", "filename", "hallazgos", "version", "error"}] en el orden recibido;
+    hallazgos es None si el archivo no se pudo leer.
+    """
+    leidos = await en_hilo(_leer_archivos_lote, file_paths)
+
+    resultados = []
+    por_clave = {}
+    pendientes = {}
+    for file_path, code, error in leidos:
+        filename = os.path.basename(file_path)
+        resultado = {"path": file_path, "filename": filename, "hallazgos": None, "version": None, "error": error}
+        resultados.append(resultado)
+        if code is None:
+            continue
+        if not code:
+            resultado["error"] = "archivo vacío"
+            continue
+        resultado["clave"] = clave = clave_validacion(code, filename, language, reference_properties)
+        resultado["version"] = recordar_version_validada(code)
+        if clave not in por_clave:
+            por_clave[clave] = hallazgos_cacheados(clave)
+            if por_clave[clave] is None:
+                pendientes[clave] = (filename, code)
+
+    def al_terminar(calculados):
+        for clave, hallazgos in calculados:
+            cachear_hallazgos(clave, hallazgos)
+            por_clave[clave] = hallazgos
+
+    archivos = [(clave, filename, code) for clave, (filename, code) in pendientes.items()]
+    if len(archivos) >= VALIDACION_LOTE_MIN_PROCESOS:
+        trozos = [(language, reference_properties, parte) for parte in trocear(archivos, CPU_MAX_WORKERS * 2)]
+        await en_procesos(validar_trozo, trozos, al_terminar)
+    elif archivos:
+        al_terminar(await en_hilo(validar_trozo, (language, reference_properties, archivos)))
+    await en_hilo(guardar_cache_validacion)
+
+    for resultado in resultados:
+        clave = resultado.pop("clave", None)
+        if clave is not None:
+            resultado["hallazgos"] = por_clave.get(clave)
+            if resultado["hallazgos"] is None:
+                resultado["error"] = "no se pudo validar"
+    return resultados
 
 
 # ============================================================
@@ -2608,62 +6485,44 @@ def extraer_propiedades_referencia(content: str, lines: list, must_document: lis
     }
 
 
-async def step6_verificar_dependencias(project_path: str, dependencies: list = None, references: list = None,
-                                        removed_functions: list = None, source_file: str = None,
-                                        decision_usuario: bool = False, justificacion_salto: str = None,
-                                        usuario_verifico: bool = False) -> str:
-    """PASO 6: Verificar dependencias externas y referencias antes de escribir código"""
-
-    # Verificar paso anterior
-    if not SESSION_STATE["step_5"]:
-        resultado = manejar_decision_usuario(
-            "philosophy_q5_nivel", "philosophy_q6_verificar_dependencias",
-            decision_usuario, justificacion_salto, usuario_verifico
-        )
-        if resultado is not None:
-            return resultado
-        SESSION_STATE["step_5"] = True
-
-    path = Path(project_path).expanduser().resolve()
-
-    if not path.exists():
-        return f"Error: El directorio {project_path} no existe"
-
-    language = SESSION_STATE.get("current_language", "godot")
-
-    # Inicializar listas si son None
-    if dependencies is None:
-        dependencies = []
-    if references is None:
-        references = []
-    if removed_functions is None:
-        removed_functions = []
+def verificar_funciones_dependencias(path: Path, dependencies: list) -> tuple:
+    """Verifica las funciones de dependencies contra la tabla de símbolos (bloqueante).
 
+    Devuelve (verified, issues).
+    """
     verified = []
     issues = []
 
-    # Procesar dependencias (funciones)
+    # Procesar dependencias (funciones) contra la tabla de símbolos del proyecto:
+    # cada archivo se analiza una sola vez aunque se verifiquen varias funciones suyas
+    index = obtener_indice_proyecto(path)
+    tabla = tabla_simbolos(index)
+
     for dep in dependencies:
         file_rel = dep.get("file", "")
         func_name = dep.get("function", "")
         expected_params = dep.get("expected_params", "")
         expected_return = dep.get("expected_return", "")
 
-        file_path = path / file_rel
+        rel = Path(file_rel).as_posix()
+        # Si la función existe en otro archivo, probablemente se movió
+        moved_to = [
+            f"{s['file']}:{s['line']}" for s in tabla.get(func_name, []) if s["file"] != rel
+        ]
 
         # Verificar que el archivo existe
-        if not file_path.exists():
+        if not (path / file_rel).is_file():
             issues.append({
                 "type": "FILE_NOT_FOUND",
                 "file": file_rel,
                 "function": func_name,
+                "moved_to": moved_to,
                 "message": f"❌ Archivo no existe: {file_rel}"
             })
             continue
 
-        # Leer contenido
         try:
-            content = file_path.read_text(encoding='utf-8', errors='ignore')
+            simbolos = simbolos_de_archivo(index, rel)
         except Exception as e:
             issues.append({
                 "type": "READ_ERROR",
@@ -2673,125 +6532,88 @@ async def step6_verificar_dependencias(project_path: str, dependencies: list = N
             })
             continue
 
-        # Buscar la función según lenguaje
-        if language == "godot":
-            # Buscar: [static] func nombre_funcion(params) -> return:
-            pattern = rf'^(?:static\s+)?func\s+{re.escape(func_name)}\s*\(([^)]*)\)(?:\s*->\s*(\w+))?'
-        elif language == "python":
-            # Buscar: [async] def nombre_funcion(params) -> return:
-            pattern = rf'^(?:async\s+)?def\s+{re.escape(func_name)}\s*\(([^)]*)\)(?:\s*->\s*(\w+))?'
-        else:
-            pattern = rf'function\s+{re.escape(func_name)}\s*\(([^)]*)\)'
-
-        match = re.search(pattern, content, re.MULTILINE)
+        candidates = [s for s in simbolos if s["name"] == func_name]
 
-        if not match:
+        if not candidates:
             issues.append({
                 "type": "FUNC_NOT_FOUND",
                 "file": file_rel,
                 "function": func_name,
+                "moved_to": moved_to,
+                "suggestions": difflib.get_close_matches(
+                    func_name, [s["name"] for s in simbolos], n=3, cutoff=0.6
+                ) or sugerir_simbolos(tabla, func_name),
                 "message": f"❌ Función no encontrada: {func_name} en {file_rel}"
             })
             continue
 
-        # Extraer firma real
-        real_params = match.group(1).strip() if match.group(1) else ""
-        real_return = match.group(2) if len(match.groups()) > 1 and match.group(2) else "void"
+        # Normalizar para comparar (quitar espacios extra)
+        norm_expected = re.sub(r'\s+', ' ', expected_params.strip()).lower()
 
-        # Comparar si se especificaron expectativas
-        param_match = True
-        return_match = True
+        def coincide(simbolo):
+            # Comparar si se especificaron expectativas
+            if expected_params and norm_expected != simbolo["params"].lower():
+                return False
+            if expected_return and expected_return.lower() != simbolo["return"].lower():
+                return False
+            return True
 
-        if expected_params:
-            # Normalizar para comparar (quitar espacios extra)
-            norm_expected = re.sub(r'\s+', ' ', expected_params.strip())
-            norm_real = re.sub(r'\s+', ' ', real_params.strip())
-            param_match = norm_expected.lower() == norm_real.lower()
+        # Puede haber varias definiciones (métodos de clases distintas): vale cualquiera
+        match = next((s for s in candidates if coincide(s)), None)
 
-        if expected_return:
-            return_match = expected_return.lower() == real_return.lower()
-
-        if not param_match or not return_match:
+        if match is None:
+            real = candidates[0]
             issues.append({
                 "type": "SIGNATURE_MISMATCH",
                 "file": file_rel,
                 "function": func_name,
+                "line": real["line"],
                 "expected_params": expected_params,
-                "real_params": real_params,
+                "real_params": real["params"],
                 "expected_return": expected_return,
-                "real_return": real_return,
+                "real_return": real["return"],
                 "message": f"❌ Firma no coincide: {func_name}"
             })
         else:
             verified.append({
                 "file": file_rel,
                 "function": func_name,
-                "params": real_params,
-                "return": real_return
+                "line": match["line"],
+                "params": match["params"],
+                "return": match["return"]
             })
 
-    # Verificar funciones eliminadas (dirección inversa: ¿quién me llama?)
-    import subprocess
-    import shutil
+    guardar_indice_proyecto(index)
+    return verified, issues
 
-    removed_refs = []  # Archivos que llaman a funciones eliminadas
+
+def buscar_llamadas_eliminadas(path: Path, removed_functions: list, source_file: str = None) -> list:
+    """Archivos que llaman a las funciones que se van a eliminar/mover (bloqueante)"""
+    # Una sola consulta al índice de identificadores para todas las funciones
+    removed_refs = []
     extensions = [".gd", ".tscn", ".py", ".php", ".js", ".ts", ".jsx", ".tsx", ".vue"]
-    rg_available = shutil.which("rg") is not None
 
     # Normalizar source_file para exclusión
     source_file_resolved = None
     if source_file:
         source_file_resolved = (path / source_file).resolve()
 
+    index = obtener_indice_proyecto(path)
+    ocurrencias = ocurrencias_identificadores(
+        index, removed_functions, archivos_indexados(index, extensions)
+    )
+
     for func_name in removed_functions:
         callers = []  # Archivos que llaman a esta función
-
-        if rg_available:
-            try:
-                glob_args = []
-                for ext in extensions:
-                    glob_args.extend(["--glob", f"*{ext}"])
-                result = subprocess.run(
-                    ["rg", "-n", "--glob", "!.git", "--glob", "!__pycache__", "--glob", "!addons"] + glob_args + [func_name],
-                    capture_output=True, text=True, cwd=str(path), timeout=30
-                )
-                for line in result.stdout.splitlines():
-                    # Formato rg -n: archivo:linea:contenido
-                    parts = line.split(":", 2)
-                    if len(parts) >= 3:
-                        file_found = parts[0]
-                        line_num = parts[1]
-                        line_content = parts[2].strip()
-                        file_resolved = (path / file_found).resolve()
-                        # Excluir source_file
-                        if source_file_resolved and file_resolved == source_file_resolved:
-                            continue
-                        callers.append({
-                            "file": file_found,
-                            "line": line_num,
-                            "content": line_content
-                        })
-            except (subprocess.TimeoutExpired, Exception):
-                pass
-        else:
-            # Fallback: Python
-            for ext in extensions:
-                for file in path.rglob(f"*{ext}"):
-                    if ".git" in str(file) or "__pycache__" in str(file) or "addons" in str(file):
-                        continue
-                    if source_file_resolved and file.resolve() == source_file_resolved:
-                        continue
-                    try:
-                        content = file.read_text(encoding='utf-8', errors='ignore')
-                        for i, line in enumerate(content.split('\n'), 1):
-                            if func_name in line:
-                                callers.append({
-                                    "file": str(file.relative_to(path)),
-                                    "line": str(i),
-                                    "content": line.strip()
-                                })
-                    except:
-                        pass
+        for rel, line_num, line_content in ocurrencias.get(func_name, []):
+            # Excluir source_file
+            if source_file_resolved and path / rel == source_file_resolved:
+                continue
+            callers.append({
+                "file": str(Path(rel)),
+                "line": str(line_num),
+                "content": line_content
+            })
 
         if callers:
             removed_refs.append({
@@ -2799,47 +6621,15 @@ async def step6_verificar_dependencias(project_path: str, dependencies: list = N
                 "callers": callers
             })
 
-    # Guardar en SESSION_STATE para validate
-    SESSION_STATE["removed_functions_refs"] = removed_refs
-
-    # Si hay llamadas externas a funciones eliminadas → BLOQUEAR
-    if removed_refs:
-        response = f"""
-╔══════════════════════════════════════════════════════════════════╗
-║  ⛔ BLOQUEO: FUNCIONES ELIMINADAS CON LLAMADAS EXTERNAS          ║
-║  "Verificar ANTES de escribir, no DESPUÉS de fallar"             ║
-╚══════════════════════════════════════════════════════════════════╝
-
-Las siguientes funciones se van a eliminar/mover, pero otros archivos las llaman:
-
-"""
-        for ref in removed_refs:
-            response += f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            response += f"❌ {ref['function']}() — {len(ref['callers'])} referencia(s) externa(s):\n\n"
-            for caller in ref['callers']:
-                response += f"   📄 {caller['file']}:{caller['line']}\n"
-                response += f"      {caller['content']}\n\n"
-
-        response += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🚫 NO PUEDES CONTINUAR hasta contemplar estos archivos en tu diseño.
-
-Opciones:
-1. Añadir wrappers/delegadores en el archivo original para mantener la interfaz pública
-2. Actualizar los archivos que llaman a estas funciones
-3. Ambas según el caso
+    guardar_indice_proyecto(index)
+    return removed_refs
 
-DEBES explicar al usuario qué archivos se romperían y proponer solución ANTES de escribir código.
-"""
-        return response
 
-    # Warning si es refactor y no se pasaron removed_functions
-    refactor_warning = None
-    tipo_cambio = SESSION_STATE.get("current_change_type", "")
-    if tipo_cambio == "refactor" and not removed_functions:
-        refactor_warning = "⚠️ Estás haciendo un refactor pero no indicaste removed_functions. ¿Estás eliminando/moviendo funciones del archivo original? Si es así, vuelve a llamar q6 con removed_functions para verificar quién las llama."
+def extraer_referencias(path: Path, references: list, language: str) -> tuple:
+    """Extrae las propiedades del código de referencia a replicar (bloqueante).
 
-    # Procesar referencias (código a replicar)
+    Devuelve (extracted_references, reference_warnings).
+    """
     extracted_references = []
     reference_warnings = []
 
@@ -2916,6 +6706,97 @@ DEBES explicar al usuario qué archivos se romperían y proponer solución ANTES
                 "message": f"⚠️ Propiedades no encontradas en {file_rel}: {', '.join(extraction['missing'])}"
             })
 
+    return extracted_references, reference_warnings
+
+
+async def step6_verificar_dependencias(project_path: str, dependencies: list = None, references: list = None,
+                                        removed_functions: list = None, source_file: str = None,
+                                        decision_usuario: bool = False, justificacion_salto: str = None,
+                                        usuario_verifico: bool = False) -> str:
+    """PASO 6: Verificar dependencias externas y referencias antes de escribir código"""
+
+    # Verificar paso anterior
+    if not SESSION_STATE["step_5"]:
+        resultado = manejar_decision_usuario(
+            "philosophy_q5_nivel", "philosophy_q6_verificar_dependencias",
+            decision_usuario, justificacion_salto, usuario_verifico
+        )
+        if resultado is not None:
+            return resultado
+        SESSION_STATE["step_5"] = True
+
+    path = Path(project_path).expanduser().resolve()
+
+    if not path.exists():
+        return f"Error: El directorio {project_path} no existe"
+
+    language = SESSION_STATE.get("current_language", "godot")
+
+    # Inicializar listas si son None
+    if dependencies is None:
+        dependencies = []
+    if references is None:
+        references = []
+    if removed_functions is None:
+        removed_functions = []
+
+    verified = []
+    issues = []
+    removed_refs = []  # Archivos que llaman a funciones eliminadas
+
+    async with semaforo_proyecto(path):
+        # Procesar dependencias (funciones)
+        if dependencies:
+            verified, issues = await en_hilo(verificar_funciones_dependencias, path, dependencies)
+
+        # Verificar funciones eliminadas (dirección inversa: ¿quién me llama?)
+        if removed_functions:
+            removed_refs = await en_hilo(buscar_llamadas_eliminadas, path, removed_functions, source_file)
+
+    # Guardar en SESSION_STATE para validate
+    SESSION_STATE["removed_functions_refs"] = removed_refs
+
+    # Si hay llamadas externas a funciones eliminadas → BLOQUEAR
+    if removed_refs:
+        response = f"""
+╔══════════════════════════════════════════════════════════════════╗
+║  ⛔ BLOQUEO: FUNCIONES ELIMINADAS CON LLAMADAS EXTERNAS          ║
+║  "Verificar ANTES de escribir, no DESPUÉS de fallar"             ║
+╚══════════════════════════════════════════════════════════════════╝
+
+Las siguientes funciones se van a eliminar/mover, pero otros archivos las llaman:
+
+"""
+        for ref in removed_refs:
+            response += f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+            response += f"❌ {ref['function']}() — {len(ref['callers'])} referencia(s) externa(s):\n\n"
+            for caller in ref['callers']:
+                response += f"   📄 {caller['file']}:{caller['line']}\n"
+                response += f"      {caller['content']}\n\n"
+
+        response += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🚫 NO PUEDES CONTINUAR hasta contemplar estos archivos en tu diseño.
+
+Opciones:
+1. Añadir wrappers/delegadores en el archivo original para mantener la interfaz pública
+2. Actualizar los archivos que llaman a estas funciones
+3. Ambas según el caso
+
+DEBES explicar al usuario qué archivos se romperían y proponer solución ANTES de escribir código.
+"""
+        return response
+
+    # Warning si es refactor y no se pasaron removed_functions
+    refactor_warning = None
+    tipo_cambio = SESSION_STATE.get("current_change_type", "")
+    if tipo_cambio == "refactor" and not removed_functions:
+        refactor_warning = "⚠️ Estás haciendo un refactor pero no indicaste removed_functions. ¿Estás eliminando/moviendo funciones del archivo original? Si es así, vuelve a llamar q6 con removed_functions para verificar quién las llama."
+
+    # Procesar referencias (código a replicar)
+    async with semaforo_proyecto(path):
+        extracted_references, reference_warnings = await en_hilo(extraer_referencias, path, references, language)
+
     # Guardar en SESSION_STATE para que validate las use
     SESSION_STATE["reference_properties"] = extracted_references
 
@@ -2938,7 +6819,12 @@ DEBES explicar al usuario qué archivos se romperían y proponer solución ANTES
 
             if issue['type'] == 'SIGNATURE_MISMATCH':
                 response += f"\n   ESPERADO: {issue['function']}({issue.get('expected_params', '')}) -> {issue.get('expected_return', 'void')}\n"
-                response += f"   REAL:     {issue['function']}({issue.get('real_params', '')}) -> {issue.get('real_return', 'void')}\n"
+                response += f"   REAL:     {issue['function']}({issue.get('real_params', '')}) -> {issue.get('real_return', 'void')}  (línea {issue['line']})\n"
+
+            if issue.get('moved_to'):
+                response += f"\n   📦 Definida en: {', '.join(issue['moved_to'][:5])}\n"
+            if issue.get('suggestions'):
+                response += f"\n   💡 ¿Quisiste decir?: {', '.join(issue['suggestions'])}\n"
 
             response += "\n"
 
@@ -3030,6 +6916,7 @@ Opciones:
 
 
 async def step8_validate(code: str = None, filename: str = None, file_path: str = None,
+                          diff: str = None, version_base: str = None,
                           usuario_confirmo_warnings: bool = False, decision_usuario: bool = False,
                           justificacion_salto: str = None, usuario_verifico: bool = False) -> str:
     """PASO 8: Validar código escrito"""
@@ -3045,8 +6932,20 @@ async def step8_validate(code: str = None, filename: str = None, file_path: str
         if not filename:
             filename = os.path.basename(file_path)
 
+    # Resolver código aplicando un diff sobre una versión ya validada
+    if diff:
+        base = version_validada(version_base) if version_base else None
+        if base is None:
+            return (f"❌ Versión base desconocida: {version_base}\n"
+                    "Envía el archivo completo con `code` o `file_path` (el servidor guarda las versiones en memoria).")
+        try:
+            code = aplicar_diff_unificado(base, diff)
+        except ValueError as e:
+            return (f"❌ El diff no se aplica sobre la versión {version_base}: {e}\n"
+                    "Envía el archivo completo con `code` o `file_path`.")
+
     if not code:
-        return "❌ Debes proporcionar `code` o `file_path`."
+        return "❌ Debes proporcionar `code`, `file_path` o `diff`."
 
     if not filename:
         return "❌ Debes proporcionar `filename` o `file_path`."
@@ -3062,120 +6961,19 @@ async def step8_validate(code: str = None, filename: str = None, file_path: str
         SESSION_STATE["step_6"] = True
 
     language = SESSION_STATE.get("current_language", "godot")
-    issues = []
-    warnings = []
+    reference_properties = SESSION_STATE.get("reference_properties", [])
 
-    lines = code.split('\n')
+    # Hallazgos puros (cacheados por contenido); aquí solo se decide y se presenta
+    hallazgos = hallazgos_validacion(code, filename, language, reference_properties)
+    guardar_cache_validacion()
+    version = recordar_version_validada(code)
+    issues = hallazgos["issues"]
+    warnings = hallazgos["warnings"]
 
     # ===============================================================
     # RAMA ESPECIAL: Archivos .tscn/.tres (escenas Godot)
     # ===============================================================
-    is_tscn = filename.endswith('.tscn') or filename.endswith('.tres')
-
-    if is_tscn:
-        # 1. DRY: Detectar SubResources duplicados (mismo tipo + propiedades similares)
-        sub_resources = {}
-        current_sub = None
-        current_props = []
-
-        for line in lines:
-            sub_match = re.match(r'\[sub_resource\s+type="(\w+)"\s+id="([^"]+)"\]', line)
-            if sub_match:
-                if current_sub:
-                    sub_resources[current_sub[1]] = {"type": current_sub[0], "props": current_props}
-                current_sub = (sub_match.group(1), sub_match.group(2))
-                current_props = []
-            elif current_sub and '=' in line and not line.startswith('['):
-                current_props.append(line.strip())
-
-        if current_sub:
-            sub_resources[current_sub[1]] = {"type": current_sub[0], "props": current_props}
-
-        # Comparar SubResources del mismo tipo
-        by_type = {}
-        for sub_id, data in sub_resources.items():
-            by_type.setdefault(data["type"], []).append((sub_id, data["props"]))
-
-        for type_name, subs in by_type.items():
-            if len(subs) < 2:
-                continue
-            for i in range(len(subs)):
-                for j in range(i + 1, len(subs)):
-                    props_i = set(subs[i][1])
-                    props_j = set(subs[j][1])
-                    if props_i and props_j and props_i == props_j:
-                        issues.append(
-                            f"❌ DRY: SubResources '{subs[i][0]}' y '{subs[j][0]}' "
-                            f"(tipo {type_name}) son idénticos. Reutiliza uno solo."
-                        )
-                    elif props_i and props_j:
-                        common = props_i & props_j
-                        total = props_i | props_j
-                        if total and len(common) / len(total) > 0.8:
-                            warnings.append(
-                                f"⚠️ DRY: SubResources '{subs[i][0]}' y '{subs[j][0]}' "
-                                f"(tipo {type_name}) tienen >80% propiedades iguales."
-                            )
-
-        # 2. DRY: Detectar estilos/overrides repetidos en nodos
-        node_overrides = {}
-        current_node = None
-
-        for line in lines:
-            node_match = re.match(r'\[node\s+name="([^"]+)"', line)
-            if node_match:
-                current_node = node_match.group(1)
-                node_overrides[current_node] = []
-            elif current_node and line.startswith('theme_override_'):
-                node_overrides[current_node].append(line.strip())
-
-        # Buscar nodos con overrides idénticos
-        override_groups = {}
-        for node_name, overrides in node_overrides.items():
-            if overrides:
-                key = tuple(sorted(overrides))
-                override_groups.setdefault(key, []).append(node_name)
-
-        for key, nodes in override_groups.items():
-            if len(nodes) >= 3:
-                warnings.append(
-                    f"⚠️ DRY: {len(nodes)} nodos ({', '.join(nodes[:3])}...) "
-                    f"tienen los mismos theme_overrides. Considera usar un Theme."
-                )
-
-        # 3. Detectar colores hardcodeados en nodos
-        color_count = 0
-        for line in lines:
-            if re.search(r'Color\s*\(\s*[\d.]+', line) and 'theme_override' not in line:
-                color_count += 1
-        if color_count > 3:
-            warnings.append(f"⚠️ {color_count} colores hardcodeados. Usa AppTheme o un recurso de tema.")
-
-        # 4. Verificar propiedades de referencia (del paso 6)
-        reference_properties = SESSION_STATE.get("reference_properties", [])
-        missing_reference_props = []
-
-        for ref in reference_properties:
-            ref_file = ref.get("file", "")
-            found_props = ref.get("found", {})
-
-            for prop, expected_value in found_props.items():
-                patterns = [
-                    rf'{re.escape(prop)}\s*=\s*',
-                ]
-                prop_found = any(re.search(p, code, re.IGNORECASE) for p in patterns)
-                if not prop_found:
-                    missing_reference_props.append({
-                        "property": prop,
-                        "expected_value": expected_value,
-                        "source_file": ref_file
-                    })
-
-        if missing_reference_props:
-            warnings.append(f"⚠️ Propiedades de referencia no replicadas ({len(missing_reference_props)}):")
-            for mp in missing_reference_props[:5]:
-                warnings.append(f"   • {mp['property']} = {mp['expected_value']} (de {mp['source_file']})")
-
+    if es_escena(filename):
         # Construir respuesta .tscn
         response = f"""
 ╔══════════════════════════════════════════════════════════════════╗
@@ -3184,8 +6982,9 @@ async def step8_validate(code: str = None, filename: str = None, file_path: str
 
 📄 ARCHIVO: {filename}
 🔧 TIPO: Escena Godot
-📏 LÍNEAS: {len(lines)}
-📦 SubResources: {len(sub_resources)}
+📏 LÍNEAS: {hallazgos['lineas']}
+📦 SubResources: {hallazgos['sub_resources']}
+🔑 VERSIÓN: {version} (para validar después con diff + version_base)
 
 """
 
@@ -3248,31 +7047,8 @@ Corrige los problemas y vuelve a validar.
     # VALIDACIÓN ESTÁNDAR (código fuente)
     # ===============================================================
 
-    # Detectar code smells por lenguaje
-    if language in PHILOSOPHY["code_smells"]:
-        for pattern, message in PHILOSOPHY["code_smells"][language]:
-            if re.search(pattern, code):
-                issues.append(f"❌ {message}")
-
-    # Validar Q1: múltiples clases, funciones largas
-    classes = re.findall(r'^class\s+\w+', code, re.MULTILINE)
-    if len(classes) > 2:
-        issues.append(f"❌ Responsabilidad: {len(classes)} clases en un archivo. Viola Q1: debe hacer UNA sola cosa.")
-
-    # Detectar funciones muy largas
-    func_matches = list(re.finditer(r'^(func|def)\s+\w+', code, re.MULTILINE))
-    for i, match in enumerate(func_matches):
-        start = match.start()
-        end = func_matches[i + 1].start() if i + 1 < len(func_matches) else len(code)
-        func_code = code[start:end]
-        func_lines = len(func_code.split('\n'))
-        if func_lines > 50:
-            warnings.append(f"⚠️ Función muy larga ({func_lines} líneas). Considera dividir.")
-
-    # Detectar si es archivo completo o fragmento — bloquear si es fragmento
-    is_complete_file = bool(re.search(r'^(extends|class_name|@tool|##|#\s*-|import |from |<!)', code, re.MULTILINE))
-
-    if not is_complete_file:
+    # Bloquear si es un fragmento y no un archivo completo
+    if not hallazgos["completo"]:
         SESSION_STATE["step_8"] = False
         return f"""
 ╔══════════════════════════════════════════════════════════════════╗
@@ -3289,74 +7065,6 @@ herencia, estructura, dependencias ni detectar problemas reales.
 📄 Archivo: {filename}
 """
 
-    # Validar Q4: signals vs llamadas directas (Godot)
-    if language == "godot":
-        direct_calls = len(re.findall(r'get_node\(["\']/', code))
-        signals = len(re.findall(r'\.emit\(|\.connect\(', code))
-        if direct_calls > 3 and signals == 0:
-            warnings.append("⚠️ Herencia: Muchas llamadas directas. Usa signals para desacoplar.")
-
-        # Verificar extends (solo si es archivo completo — en fragmentos da falso positivo)
-        if is_complete_file and not re.search(r'^extends\s+', code, re.MULTILINE):
-            warnings.append("⚠️ Herencia: No hay 'extends'. ¿Debería heredar de algo?")
-
-        # Detectar Color hardcodeado inline (no en constantes ni variables)
-        for line in lines:
-            stripped = line.strip()
-            if re.search(r'Color\s*\(\s*[\d.]+', stripped):
-                if not re.match(r'^(const|var|@export)\s+', stripped):
-                    issues.append(f"❌ Color hardcodeado inline: `{stripped}`. Usa AppTheme o una constante nombrada.")
-                    break
-
-    # Detectar código duplicado (excluir llamadas a helpers: "var x = func()")
-    line_counts = {}
-    for line in lines:
-        stripped = line.strip()
-        if len(stripped) > 30 and not stripped.startswith('#') and not stripped.startswith('//'):
-            if re.match(r'^var\s+\w+\s*=\s*\w+\(', stripped):
-                continue
-            line_counts[stripped] = line_counts.get(stripped, 0) + 1
-
-    duplicates = sum(1 for v in line_counts.values() if v >= 3)
-    if duplicates > 0:
-        issues.append(f"❌ DRY: {duplicates} líneas repetidas 3+ veces. Extrae a función/componente.")
-
-    # Verificar propiedades de referencia (del paso 6)
-    reference_properties = SESSION_STATE.get("reference_properties", [])
-    missing_reference_props = []
-
-    for ref in reference_properties:
-        ref_file = ref.get("file", "")
-        found_props = ref.get("found", {})
-
-        for prop, expected_value in found_props.items():
-            # Buscar la propiedad en el código escrito
-            # Patrones flexibles: prop = valor, .prop = valor, self.prop = valor
-            patterns = [
-                rf'{re.escape(prop)}\s*=\s*',
-                rf'\.{re.escape(prop)}\s*=\s*',
-            ]
-
-            prop_found = False
-            for pattern in patterns:
-                if re.search(pattern, code, re.IGNORECASE):
-                    prop_found = True
-                    break
-
-            if not prop_found:
-                missing_reference_props.append({
-                    "property": prop,
-                    "expected_value": expected_value,
-                    "source_file": ref_file
-                })
-
-    if missing_reference_props:
-        warnings.append(f"⚠️ Propiedades de referencia no replicadas ({len(missing_reference_props)}):")
-        for mp in missing_reference_props[:5]:  # Mostrar máx 5
-            warnings.append(f"   • {mp['property']} = {mp['expected_value']} (de {mp['source_file']})")
-        if len(missing_reference_props) > 5:
-            warnings.append(f"   ... y {len(missing_reference_props) - 5} más")
-
     # Construir respuesta
     response = f"""
 ╔══════════════════════════════════════════════════════════════════╗
@@ -3365,7 +7073,8 @@ herencia, estructura, dependencias ni detectar problemas reales.
 
 📄 ARCHIVO: {filename}
 🔧 LENGUAJE: {language}
-📏 LÍNEAS: {len(lines)}
+📏 LÍNEAS: {hallazgos['lineas']}
+🔑 VERSIÓN: {version} (para validar después con diff + version_base)
 
 """
 
@@ -3469,6 +7178,114 @@ El código NO cumple con: "Máximo impacto, menor esfuerzo — a largo plazo"
     return response
 
 
+async def step8_validate_batch(file_paths: list, usuario_confirmo_warnings: bool = False,
+                               decision_usuario: bool = False, justificacion_salto: str = None,
+                               usuario_verifico: bool = False) -> str:
+    """PASO 8 para varios archivos: mismas reglas que philosophy_validate, en paralelo"""
+
+    if not file_paths:
+        return "❌ Debes proporcionar `file_paths` (lista de rutas absolutas)."
+
+    # Verificar paso anterior (igual que philosophy_validate)
+    if not SESSION_STATE["step_6"]:
+        resultado = manejar_decision_usuario(
+            "pasos 1-6", "philosophy_validate_batch",
+            decision_usuario, justificacion_salto, usuario_verifico
+        )
+        if resultado is not None:
+            return resultado
+        SESSION_STATE["step_6"] = True
+
+    language = SESSION_STATE.get("current_language", "godot")
+    resultados = await validar_lote(file_paths, language, SESSION_STATE.get("reference_properties", []))
+
+    aprobados, con_warnings, con_issues, fallidos = [], [], [], []
+    for resultado in resultados:
+        hallazgos = resultado["hallazgos"]
+        if hallazgos is None or not hallazgos.get("completo", True):
+            fallidos.append(resultado)
+        elif hallazgos["issues"]:
+            con_issues.append(resultado)
+        elif hallazgos["warnings"]:
+            con_warnings.append(resultado)
+        else:
+            aprobados.append(resultado)
+
+    response = f"""
+╔══════════════════════════════════════════════════════════════════╗
+║  PASO 8/9: VALIDACIÓN POR LOTES                                  ║
+╚══════════════════════════════════════════════════════════════════╝
+
+📁 ARCHIVOS: {len(resultados)}
+🔧 LENGUAJE: {language}
+
+✅ Aprobados: {len(aprobados)}
+⚠️ Con advertencias: {len(con_warnings)}
+❌ Con problemas: {len(con_issues)}
+🚫 Sin validar: {len(fallidos)}
+
+"""
+
+    for resultado in fallidos:
+        motivo = resultado["error"] or "no es un archivo completo (sin extends, imports ni cabecera)"
+        response += f"🚫 {resultado['path']}\n   {motivo}\n\n"
+
+    for resultado in con_issues + con_warnings:
+        hallazgos = resultado["hallazgos"]
+        marca = "❌" if hallazgos["issues"] else "⚠️"
+        response += f"{marca} {resultado['path']} (🔑 {resultado['version']})\n"
+        for mensaje in (hallazgos["issues"] + hallazgos["warnings"])[:VALIDACION_LOTE_MAX_DETALLE]:
+            response += f"   {mensaje}\n"
+        restantes = len(hallazgos["issues"]) + len(hallazgos["warnings"]) - VALIDACION_LOTE_MAX_DETALLE
+        if restantes > 0:
+            response += f"   ... y {restantes} más (detalle con philosophy_validate)\n"
+        response += "\n"
+
+    for resultado in aprobados:
+        response += f"✅ {resultado['path']}\n"
+    if aprobados:
+        response += "\n"
+
+    paso9 = """➡️ PASO 9 (OBLIGATORIO): Usa philosophy_q9_documentar
+
+   "Documentar DESPUÉS de validar"
+
+🚫 El flujo NO está completo hasta documentar.
+"""
+
+    if fallidos or con_issues:
+        if any(resultado["hallazgos"] is not None for resultado in fallidos):
+            SESSION_STATE["step_8"] = False
+        response += """🚫 LOTE NO APROBADO
+
+Corrige los archivos marcados y vuelve a validar el lote
+(los archivos que no cambien no se recalculan).
+"""
+    elif not con_warnings:
+        SESSION_STATE["step_8"] = True
+        response += "✅ LOTE APROBADO\n\n" + paso9
+    elif usuario_confirmo_warnings:
+        SESSION_STATE["step_8"] = True
+        response += "✅ LOTE APROBADO (usuario confirmó ignorar advertencias)\n\n" + paso9
+    else:
+        response += """⚠️ LOTE CON ADVERTENCIAS - REQUIERE DECISIÓN DEL USUARIO
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🚨 INSTRUCCIÓN OBLIGATORIA PARA CLAUDE:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+PASO 1: EXPLICA tu opinión sobre las advertencias de cada archivo
+PASO 2: USA AskUserQuestion
+   - "Ignorar y continuar" → philosophy_validate_batch con usuario_confirmo_warnings=true
+   - "Corregir primero" → Modifica y vuelve a validar
+
+⛔ La pregunta es el FINAL del turno.
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+
+    return response
+
+
 async def step9_documentar(
     project_path: str,
     archivos_modificados: list,
@@ -3511,13 +7328,13 @@ async def step9_documentar(
     if readme_loc.exists():
         readme_path = readme_loc
 
-    # Buscar docs que mencionen los archivos modificados
-    for archivo in archivos_modificados:
-        archivo_name = Path(archivo).stem
-        doc_results = search_project_documentation(path, archivo_name)
-        for doc in doc_results.get("primary", [])[:3]:  # Top 3 por archivo
-            if doc["path"] not in [d["path"] for d in docs_afectados]:
-                docs_afectados.append(doc)
+    # Buscar docs que mencionen los archivos modificados: una sola consulta para
+    # todos, top 3 por archivo sin repetir
+    stems = [Path(archivo).stem for archivo in archivos_modificados]
+    if stems:
+        async with semaforo_proyecto(path):
+            doc_results = await en_hilo(search_project_documentation_multi, path, stems)
+        docs_afectados = doc_results["afectados"]
 
     # 2. GENERAR TEMPLATE PARA CHANGELOG
     tipo_label = {
@@ -3731,169 +7548,238 @@ Si saltas un paso, el MCP bloquea y muestra error.
 # ANÁLISIS ARQUITECTÓNICO - IMPLEMENTACIÓN
 # ============================================================
 
-def extract_function_signatures(content: str, language: str) -> list:
-    """Extrae las firmas de funciones públicas de un archivo"""
-    signatures = []
+# Métricas de un archivo de código en una sola pasada: un patrón por lenguaje
+# reconoce a la vez clases, class_name, extends y funciones, y la firma de cada
+# función se lee desde su '(' hasta el ')' que la cierra, aunque ocupe varias
+# líneas o tenga paréntesis en los valores por defecto.
+# GDScript y Python solo miran el principio de línea: los patrones empiezan por
+# '\n' (se antepone uno al contenido) para que el motor salte de línea en línea
+# en vez de probar cada carácter. En web cada alternativa arranca en 'c' o 'f'.
+_METRICAS_PATRONES = {
+    "godot": re.compile(
+        r'\n(?:(?P<clase>class\s+\w)|(?P<class_name>class_name\s)|extends\s+(?P<extends>\w+)'
+        r'|(?P<static>static\s+)?func\s+(?P<funcion>\w+))'
+    ),
+    "python": re.compile(r'\n(?:(?P<clase>class\s+\w)|def\s+(?P<funcion>\w+))'),
+    "web": re.compile(
+        r'[cf](?:(?<=c)(?:(?P<clase>lass\s+\w)|(?P<flecha>onst\s+\w+\s*=\s*(?:async\s*)?\())'
+        r'|(?<=f)unction\s+(?P<funcion>\w+))'
+    ),
+}
+_RE_APERTURA_FIRMA = re.compile(r'\s*\(')
+_RE_DELIMITADORES_FIRMA = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|[()]')
+_RE_RETORNO_FIRMA = re.compile(r'\s*->\s*([\w.]+(?:\[[^\]\n]*\])?)')
+FIRMA_MAX_CARACTERES = 4000  # Más allá se da la firma por mal formada
+RETORNO_POR_DEFECTO = {"godot": "void", "python": "None", "web": "unknown"}
+
+
+def _parametros_de_firma(content: str, inicio: int):
+    """(parámetros normalizados, posición tras el ')') desde el '(' en inicio, o None si no cierra"""
+    profundidad = 0
+    for match in _RE_DELIMITADORES_FIRMA.finditer(content, inicio, inicio + FIRMA_MAX_CARACTERES):
+        texto = match.group()
+        if texto == "(":
+            profundidad += 1
+        elif texto == ")":
+            profundidad -= 1
+            if profundidad == 0:
+                return " ".join(content[inicio + 1:match.start()].split()), match.end()
+    return None
+
+
+def metricas_de_codigo(content: str, language: str) -> dict:
+    """Clases, funciones, extends y firmas públicas de un archivo en una pasada.
+
+    Cada firma es (nombre, parámetros, retorno), con retorno None si no se declara.
+    """
+    metricas = {"classes": 0, "functions": 0, "extends": None, "public_signatures": []}
+    patron = _METRICAS_PATRONES.get(language)
+    if patron is None:
+        return metricas
+
+    content = "\n" + content
+    class_name = False
+    for match in patron.finditer(content):
+        grupo = match.lastgroup
+        if grupo == "clase":
+            metricas["classes"] += 1
+        elif grupo == "class_name":
+            class_name = True
+        elif grupo == "extends":
+            if metricas["extends"] is None:
+                metricas["extends"] = sys.intern(match.group("extends"))
+        elif grupo == "flecha":
+            metricas["functions"] += 1
+        else:
+            # En GDScript las static func no cuentan como funciones, pero sí su firma
+            if language != "godot" or not match.group("static"):
+                metricas["functions"] += 1
+            nombre = match.group("funcion")
+            if not (nombre[0].isascii() and nombre[0].isalpha()):
+                continue  # Privada (empieza por _) o nombre no válido
+            apertura = _RE_APERTURA_FIRMA.match(content, match.end())
+            firma = apertura and _parametros_de_firma(content, apertura.end() - 1)
+            if not firma:
+                continue
+            params, fin = firma
+            retorno = _RE_RETORNO_FIRMA.match(content, fin) if language != "web" else None
+            metricas["public_signatures"].append((nombre, params, retorno.group(1) if retorno else None))
+
+    metricas["classes"] += class_name
+    return metricas
+
+
+def texto_de_firma(firma, language: str) -> str:
+    """Firma completa para mostrar: nombre(params) -> retorno (en web sin retorno)"""
+    nombre, params, retorno = firma
+    if language == "web":
+        return f"{nombre}({params})"
+    return f"{nombre}({params}) -> {retorno or RETORNO_POR_DEFECTO[language]}"
+
+
+# Registro de un archivo del inventario, el que se guarda en el índice como
+# "file_info:<lenguaje>": (líneas, clases, funciones, extends, nivel, firmas, error).
+# Es una tupla y no un dict por archivo: con decenas de miles de archivos las
+# claves repetidas, la ruta absoluta y el nombre (derivables de la ruta relativa,
+# que ya es la clave del índice) y la firma completa de cada función (se compone
+# al mostrarla) eran la mayor parte de la memoria. El nivel es la posición en
+# NIVELES_INVENTARIO, las firmas son (nombre, parámetros, retorno) y error es
+# None o el texto del error si el archivo no se pudo analizar (nivel "error").
+NIVELES_INVENTARIO = ("sin_clasificar", "pieza", "componente", "contenedor", "pantalla", "estructura", "error")
+NIVEL_ERROR = NIVELES_INVENTARIO.index("error")
 
-    if language == "godot":
-        # Buscar: [static] func nombre(params) -> tipo:
-        # Excluir funciones privadas (empiezan con _)
-        pattern = r'^(?:static\s+)?func\s+([a-zA-Z][a-zA-Z0-9_]*)\s*\(([^)]*)\)(?:\s*->\s*(\w+))?'
-        for match in re.finditer(pattern, content, re.MULTILINE):
-            func_name = match.group(1)
-            if not func_name.startswith('_'):  # Solo públicas
-                params = match.group(2).strip() if match.group(2) else ""
-                return_type = match.group(3) if match.group(3) else "void"
-                signatures.append({
-                    "name": func_name,
-                    "params": params,
-                    "return": return_type,
-                    "signature": f"{func_name}({params}) -> {return_type}"
-                })
 
+def nivel_de_archivo(file_path: Path, language: str) -> int:
+    """Nivel actual según la nomenclatura del archivo (posición en NIVELES_INVENTARIO)"""
+    nivel_actual = "sin_clasificar"
+
+    if language == "godot":
+        filename = file_path.name.lower()
+        if "_piece." in filename:
+            nivel_actual = "pieza"
+        elif "_component." in filename:
+            nivel_actual = "componente"
+        elif "_system." in filename:
+            nivel_actual = "contenedor"
+        elif "_screen." in filename:
+            nivel_actual = "pantalla"
+        elif filename == "main.tscn":
+            nivel_actual = "estructura"
     elif language == "python":
-        # Buscar: def nombre(params) -> tipo:
-        # Excluir funciones privadas (empiezan con _)
-        pattern = r'^def\s+([a-zA-Z][a-zA-Z0-9_]*)\s*\(([^)]*)\)(?:\s*->\s*(\w+))?'
-        for match in re.finditer(pattern, content, re.MULTILINE):
-            func_name = match.group(1)
-            if not func_name.startswith('_'):  # Solo públicas
-                params = match.group(2).strip() if match.group(2) else ""
-                return_type = match.group(3) if match.group(3) else "None"
-                signatures.append({
-                    "name": func_name,
-                    "params": params,
-                    "return": return_type,
-                    "signature": f"{func_name}({params}) -> {return_type}"
-                })
+        path_str = str(file_path).lower()
+        if "/pieces/" in path_str or "/piece/" in path_str:
+            nivel_actual = "pieza"
+        elif "/components/" in path_str or "/component/" in path_str:
+            nivel_actual = "componente"
+        elif "/systems/" in path_str or "/system/" in path_str:
+            nivel_actual = "contenedor"
+        elif "/screens/" in path_str or "/screen/" in path_str:
+            nivel_actual = "pantalla"
 
-    elif language == "web":
-        # Buscar: function nombre(params) o export function nombre(params)
-        pattern = r'(?:export\s+)?function\s+([a-zA-Z][a-zA-Z0-9_]*)\s*\(([^)]*)\)'
-        for match in re.finditer(pattern, content):
-            func_name = match.group(1)
-            params = match.group(2).strip() if match.group(2) else ""
-            signatures.append({
-                "name": func_name,
-                "params": params,
-                "return": "unknown",
-                "signature": f"{func_name}({params})"
-            })
+    return NIVELES_INVENTARIO.index(nivel_actual)
 
-    return signatures
 
+def get_file_info(file_path: Path, language: str, content: str = None) -> tuple:
+    """Registro de inventario de un archivo de código, incluidas sus firmas públicas.
 
-def get_file_info(file_path: Path, language: str) -> dict:
-    """Extrae información de un archivo de código incluyendo firmas públicas"""
+    Si se pasa content (p.ej. leído vía índice del proyecto) no se vuelve a leer el archivo.
+    """
     try:
-        content = file_path.read_text(encoding='utf-8', errors='ignore')
-        lines = content.split('\n')
+        if content is None:
+            content = file_path.read_text(encoding='utf-8', errors='ignore')
+        metricas = metricas_de_codigo(content, language)
+        return (
+            content.count('\n') + 1,
+            metricas["classes"],
+            metricas["functions"],
+            metricas["extends"],
+            nivel_de_archivo(file_path, language),
+            metricas["public_signatures"],
+            None,
+        )
+    except Exception as e:
+        return (0, 0, 0, None, NIVEL_ERROR, [], str(e))
 
-        # Contar clases y funciones según lenguaje
-        if language == "godot":
-            classes = len(re.findall(r'^class\s+\w+', content, re.MULTILINE))
-            classes += 1 if re.search(r'^class_name\s+', content, re.MULTILINE) else 0
-            functions = len(re.findall(r'^func\s+\w+', content, re.MULTILINE))
-            extends = re.search(r'^extends\s+(\w+)', content, re.MULTILINE)
-            extends = extends.group(1) if extends else None
-        elif language == "python":
-            classes = len(re.findall(r'^class\s+\w+', content, re.MULTILINE))
-            functions = len(re.findall(r'^def\s+\w+', content, re.MULTILINE))
-            extends = None
-        elif language == "web":
-            classes = len(re.findall(r'class\s+\w+', content))
-            functions = len(re.findall(r'function\s+\w+|const\s+\w+\s*=\s*(?:async\s*)?\(', content))
-            extends = None
-        else:
-            classes = 0
-            functions = 0
-            extends = None
 
-        # Extraer firmas de funciones públicas
-        public_signatures = extract_function_signatures(content, language)
+# Extensiones del inventario por lenguaje
+INVENTARIO_EXTENSIONS = {
+    "godot": [".gd", ".tscn"],
+    "python": [".py"],
+    "web": [".js", ".ts", ".jsx", ".tsx", ".vue", ".svelte"],
+    "other": [".gd", ".py", ".js", ".ts"]
+}
 
-        # Determinar nivel actual basado en nomenclatura
-        filename = file_path.name.lower()
-        nivel_actual = "sin_clasificar"
 
-        if language == "godot":
-            if "_piece." in filename:
-                nivel_actual = "pieza"
-            elif "_component." in filename:
-                nivel_actual = "componente"
-            elif "_system." in filename:
-                nivel_actual = "contenedor"
-            elif "_screen." in filename:
-                nivel_actual = "pantalla"
-            elif filename == "main.tscn":
-                nivel_actual = "estructura"
-        elif language == "python":
-            path_str = str(file_path).lower()
-            if "/pieces/" in path_str or "/piece/" in path_str:
-                nivel_actual = "pieza"
-            elif "/components/" in path_str or "/component/" in path_str:
-                nivel_actual = "componente"
-            elif "/systems/" in path_str or "/system/" in path_str:
-                nivel_actual = "contenedor"
-            elif "/screens/" in path_str or "/screen/" in path_str:
-                nivel_actual = "pantalla"
-
-        return {
-            "path": str(file_path),
-            "name": file_path.name,
-            "lines": len(lines),
-            "classes": classes,
-            "functions": functions,
-            "extends": extends,
-            "nivel_actual": nivel_actual,
-            "public_signatures": public_signatures  # NUEVO: firmas públicas
-        }
-    except Exception as e:
-        return {
-            "path": str(file_path),
-            "name": file_path.name,
-            "lines": 0,
-            "classes": 0,
-            "functions": 0,
-            "extends": None,
-            "nivel_actual": "error",
-            "public_signatures": [],
-            "error": str(e)
-        }
+def archivos_de_inventario(index: dict, language: str) -> list:
+    """Archivos del inventario de un lenguaje, en orden estable (rutas relativas ordenadas)"""
+    return archivos_indexados(index, INVENTARIO_EXTENSIONS.get(language, INVENTARIO_EXTENSIONS["other"]))
 
 
-def scan_project_files(project_path: Path, language: str) -> list:
-    """Escanea TODOS los archivos del proyecto"""
-    files_info = []
+def inventario_de_archivos(index: dict, language: str, rels: list):
+    """Genera (ruta relativa, registro) de cada archivo desde el índice, sin
+    acumularlos (solo se analizan los que cambiaron)
+    """
+    for rel in rels:
+        registro = dato_indexado(index, rel, f"file_info:{language}")
+        if registro is None:
+            registro = get_file_info(index["root"] / rel, language)
+        yield rel, registro
 
-    # Extensiones por lenguaje
-    extensions = {
-        "godot": [".gd", ".tscn"],
-        "python": [".py"],
-        "web": [".js", ".ts", ".jsx", ".tsx", ".vue", ".svelte"],
-        "other": [".gd", ".py", ".js", ".ts"]
-    }
+    guardar_indice_proyecto(index)
 
-    exts = extensions.get(language, extensions["other"])
 
-    # Carpetas a ignorar
-    ignore_dirs = {".git", "__pycache__", "node_modules", ".godot", "addons", "venv", ".venv"}
+def resumen_de_inventario(index: dict, language: str, rels: list) -> dict:
+    """Totales, archivos por nivel, errores de análisis y tablas markdown del inventario en una pasada.
 
-    for ext in exts:
-        for file_path in project_path.rglob(f"*{ext}"):
-            # Verificar si está en carpeta ignorada
-            if any(ignored in file_path.parts for ignored in ignore_dirs):
-                continue
+    Los registros se consumen según llegan: en memoria solo quedan las filas ya
+    formateadas, no la información de cada archivo.
+    """
+    resumen = {"archivos": 0, "lineas": 0, "clases": 0, "funciones": 0, "firmas": 0, "por_nivel": {}, "errores": []}
+    filas_inventario = []
+    filas_firmas = []
+
+    for i, (rel, registro) in enumerate(inventario_de_archivos(index, language, rels), 1):
+        lineas, clases, funciones, extends, nivel, firmas, error = registro
+        nivel = NIVELES_INVENTARIO[nivel]
+        if error is not None:
+            resumen["errores"].append((rel, error))
+        resumen["archivos"] += 1
+        resumen["lineas"] += lineas
+        resumen["clases"] += clases
+        resumen["funciones"] += funciones
+        resumen["firmas"] += len(firmas)
+        resumen["por_nivel"][nivel] = resumen["por_nivel"].get(nivel, 0) + 1
+
+        filas_inventario.append(
+            f"| {i} | {rel} | {lineas} | {clases} | {funciones} | {len(firmas)} | {nivel} | {extends or '-'} |\n"
+        )
+        for firma in firmas:
+            filas_firmas.append(f"| {rel} | {firma[0]} | `{texto_de_firma(firma, language)}` |\n")
 
-            file_info = get_file_info(file_path, language)
-            try:
-                file_info["relative_path"] = str(file_path.relative_to(project_path))
-            except:
-                file_info["relative_path"] = file_path.name
+    resumen["tabla_inventario"] = (
+        "| # | Archivo | Líneas | Clases | Funciones | Públicas | Nivel actual | Extends |\n"
+        "|---|---------|--------|--------|-----------|----------|--------------|----------|\n"
+        + "".join(filas_inventario)
+    )
+    resumen["tabla_firmas"] = (
+        "| Archivo | Función | Firma completa |\n"
+        "|---------|---------|----------------|\n"
+        + "".join(filas_firmas)
+    )
+    return resumen
 
-            files_info.append(file_info)
 
-    return files_info
+async def escanear_proyecto(project_path: Path, language: str) -> dict:
+    """Resumen del inventario de TODOS los archivos del proyecto (ver resumen_de_inventario).
+
+    Usa el índice persistente: los archivos nuevos o cambiados se analizan antes
+    repartidos en el pool de procesos; el orden de las tablas no depende de qué
+    proceso termina antes: es el de las rutas relativas.
+    """
+    index = await en_hilo(obtener_indice_proyecto, project_path)
+    rels = archivos_de_inventario(index, language)
+    await precalcular_datos(index, rels, f"file_info:{language}")
+    return await en_hilo(resumen_de_inventario, index, language, rels)
 
 
 def generate_analysis_template(project_name: str, project_path: str, language: str) -> str:
@@ -4055,7 +7941,8 @@ Para continuar, tienes dos opciones:
     analysis_file.write_text(template, encoding='utf-8')
 
     # Escanear archivos
-    files_info = scan_project_files(path, language)
+    async with semaforo_proyecto(path):
+        inventario = await escanear_proyecto(path, language)
 
     # Actualizar estado
     ARCHITECTURE_STATE["active"] = True
@@ -4065,36 +7952,6 @@ Para continuar, tienes dos opciones:
     ARCHITECTURE_STATE["project_path"] = str(path)
     ARCHITECTURE_STATE["language"] = language
 
-    # Generar resumen del inventario
-    total_lines = sum(f["lines"] for f in files_info)
-    total_classes = sum(f["classes"] for f in files_info)
-    total_functions = sum(f["functions"] for f in files_info)
-    total_public_signatures = sum(len(f.get("public_signatures", [])) for f in files_info)
-
-    # Agrupar por nivel actual
-    by_level = {}
-    for f in files_info:
-        nivel = f["nivel_actual"]
-        if nivel not in by_level:
-            by_level[nivel] = []
-        by_level[nivel].append(f)
-
-    # Construir tabla de inventario
-    inventory_table = "| # | Archivo | Líneas | Clases | Funciones | Públicas | Nivel actual | Extends |\n"
-    inventory_table += "|---|---------|--------|--------|-----------|----------|--------------|----------|\n"
-
-    for i, f in enumerate(files_info, 1):
-        num_public = len(f.get("public_signatures", []))
-        inventory_table += f"| {i} | {f['relative_path']} | {f['lines']} | {f['classes']} | {f['functions']} | {num_public} | {f['nivel_actual']} | {f['extends'] or '-'} |\n"
-
-    # Construir tabla de firmas públicas (FASE 1 mejorada)
-    signatures_table = "| Archivo | Función | Firma completa |\n"
-    signatures_table += "|---------|---------|----------------|\n"
-
-    for f in files_info:
-        for sig in f.get("public_signatures", []):
-            signatures_table += f"| {f['relative_path']} | {sig['name']} | `{sig['signature']}` |\n"
-
     response = f'''
 ╔══════════════════════════════════════════════════════════════════╗
 ║  ANÁLISIS ARQUITECTÓNICO INICIADO                                ║
@@ -4117,30 +7974,35 @@ Para continuar, tienes dos opciones:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 📈 RESUMEN:
-   • Archivos encontrados: {len(files_info)}
-   • Total líneas de código: {total_lines}
-   • Total clases: {total_classes}
-   • Total funciones: {total_functions}
-   • Funciones públicas (verificables): {total_public_signatures}
+   • Archivos encontrados: {inventario['archivos']}
+   • Total líneas de código: {inventario['lineas']}
+   • Total clases: {inventario['clases']}
+   • Total funciones: {inventario['funciones']}
+   • Funciones públicas (verificables): {inventario['firmas']}
 
 📊 POR NIVEL ACTUAL:
 '''
 
-    for nivel, archivos in sorted(by_level.items()):
-        response += f"   • {nivel}: {len(archivos)} archivos\n"
+    for nivel, archivos in sorted(inventario["por_nivel"].items()):
+        response += f"   • {nivel}: {archivos} archivos\n"
+
+    if inventario["errores"]:
+        response += "\n❌ ARCHIVOS QUE NO SE PUDIERON ANALIZAR:\n"
+        for rel, error in inventario["errores"]:
+            response += f"   • {rel}: {error}\n"
 
     response += f'''
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 📋 INVENTARIO DETALLADO
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-{inventory_table}
+{inventario['tabla_inventario']}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 📝 FIRMAS PÚBLICAS (para verificación de dependencias)
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-{signatures_table}
+{inventario['tabla_firmas']}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
@@ -4580,38 +8442,32 @@ def find_analysis_files(project_path: str = None) -> list:
     if not p.exists():
         return found_files
 
-    # Carpetas a ignorar
-    ignore_dirs = {".git", "__pycache__", "node_modules", ".godot", "addons", "venv", ".venv"}
-
-    # Buscar todos los directorios .claude recursivamente
-    for claude_dir in p.rglob(".claude"):
-        if not claude_dir.is_dir():
-            continue
-
-        # Verificar que no esté en una carpeta ignorada
-        if any(ignored in claude_dir.parts for ignored in ignore_dirs):
+    # Un solo recorrido compartido: poda IGNORE_DIRS y lo ignorado por .gitignore
+    for rel, st in recorrer_proyecto(p, {".md"}):
+        parent, _, name = rel.rpartition("/")
+        if parent.rpartition("/")[2] != ".claude" or not name.startswith("architecture_analysis_"):
             continue
+        f = p / rel
+        claude_dir = f.parent
 
-        # Buscar archivos de análisis en este .claude
-        for f in claude_dir.glob("architecture_analysis_*.md"):
-            try:
-                content = f.read_text(encoding='utf-8')
-                # Extraer metadata
-                estado_match = re.search(r'\*\*Estado:\*\*\s*(\w+)', content)
-                checkpoint_match = re.search(r'\*\*Checkpoint actual:\*\*\s*(\d+)', content)
-                title_match = re.search(r'^# Análisis Arquitectónico:\s*(.+)$', content, re.MULTILINE)
-                scope_match = re.search(r'\*\*Scope:\*\*\s*(.+)', content)
-
-                found_files.append({
-                    "path": str(f),
-                    "name": title_match.group(1) if title_match else f.stem,
-                    "estado": estado_match.group(1) if estado_match else "DESCONOCIDO",
-                    "checkpoint": int(checkpoint_match.group(1)) if checkpoint_match else 0,
-                    "scope": scope_match.group(1).strip() if scope_match else str(claude_dir.parent),
-                    "modified": f.stat().st_mtime
-                })
-            except:
-                pass
+        try:
+            content = f.read_text(encoding='utf-8')
+            # Extraer metadata
+            estado_match = re.search(r'\*\*Estado:\*\*\s*(\w+)', content)
+            checkpoint_match = re.search(r'\*\*Checkpoint actual:\*\*\s*(\d+)', content)
+            title_match = re.search(r'^# Análisis Arquitectónico:\s*(.+)$', content, re.MULTILINE)
+            scope_match = re.search(r'\*\*Scope:\*\*\s*(.+)', content)
+
+            found_files.append({
+                "path": str(f),
+                "name": title_match.group(1) if title_match else f.stem,
+                "estado": estado_match.group(1) if estado_match else "DESCONOCIDO",
+                "checkpoint": int(checkpoint_match.group(1)) if checkpoint_match else 0,
+                "scope": scope_match.group(1).strip() if scope_match else str(claude_dir.parent),
+                "modified": st.st_mtime
+            })
+        except:
+            pass
 
     # Ordenar por fecha de modificación (más reciente primero)
     found_files.sort(key=lambda x: x["modified"], reverse=True)
@@ -4654,7 +8510,7 @@ FASES DEL ANÁLISIS:
 '''
 
     # 2. Buscar archivos de análisis en disco
-    found_files = find_analysis_files(project_path) if project_path else []
+    found_files = await en_hilo(find_analysis_files, project_path) if project_path else []
 
     if found_files:
         response = '''
@@ -4730,5 +8586,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
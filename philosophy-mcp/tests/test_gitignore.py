@@ -0,0 +1,137 @@
+"""ruta_ignorada frente a `git check-ignore` con un .gitignore representativo"""
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import server  # noqa: E402
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git no está instalado")
+
+GITIGNORE = """\
+# Comentario
+*.log
+!importante.log
+build/
+/solo_raiz.txt
+docs/**/borrador.md
+**/tmp
+cache/**
+!cache/conservar.txt
+sub/*.bak
+\\#almohadilla
+datos/
+!datos/
+*.py[co]
+escenas/**/*.import
+"""
+
+GITIGNORE_ANIDADO = """\
+*.txt
+!leeme.txt
+/local/
+"""
+
+ARCHIVOS = [
+    "app.log",
+    "importante.log",
+    "src/error.log",
+    "src/importante.log",
+    "build/salida.bin",
+    "src/build/salida.bin",
+    "build_archivo",
+    "solo_raiz.txt",
+    "src/solo_raiz.txt",
+    "docs/borrador.md",
+    "docs/guia/borrador.md",
+    "docs/guia/a/b/borrador.md",
+    "docs/guia/final.md",
+    "tmp/x.gd",
+    "src/tmp/x.gd",
+    "src/tmpx/x.gd",
+    "cache/a.bin",
+    "cache/conservar.txt",
+    "cache/sub/b.bin",
+    "sub/a.bak",
+    "sub/otro/a.bak",
+    "#almohadilla",
+    "datos/tabla.csv",
+    "modulo.pyc",
+    "modulo.pyo",
+    "modulo.py",
+    "escenas/nivel/mapa.png.import",
+    "escenas/mapa.png.import",
+    "anidado/notas.txt",
+    "anidado/leeme.txt",
+    "anidado/sub/notas.txt",
+    "anidado/local/codigo.gd",
+    "anidado/sub/local/codigo.gd",
+    "otro/notas.txt",
+]
+
+
+def _crear_proyecto(root: Path) -> None:
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    (root / ".gitignore").write_text(GITIGNORE, encoding="utf-8")
+    (root / "anidado").mkdir()
+    (root / "anidado" / ".gitignore").write_text(GITIGNORE_ANIDADO, encoding="utf-8")
+    (root / ".git" / "info").mkdir(exist_ok=True)
+    (root / ".git" / "info" / "exclude").write_text("excluido.gd\n", encoding="utf-8")
+    for rel in ARCHIVOS + ["excluido.gd", "src/excluido.gd"]:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x\n", encoding="utf-8")
+
+
+def _ignoradas_segun_git(root: Path, rels: list) -> set:
+    resultado = subprocess.run(
+        ["git", "check-ignore", "--no-index", "--stdin"],
+        cwd=root, input="\n".join(rels) + "\n", capture_output=True, text=True
+    )
+    assert resultado.returncode in (0, 1), resultado.stderr
+    return set(resultado.stdout.splitlines())
+
+
+def _todas_las_rutas(root: Path) -> list:
+    rels = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        rel_dir = Path(dirpath).relative_to(root).as_posix()
+        for nombre in filenames:
+            rels.append(nombre if rel_dir == "." else f"{rel_dir}/{nombre}")
+    return sorted(rels)
+
+
+def test_ruta_ignorada_coincide_con_git(tmp_path):
+    _crear_proyecto(tmp_path)
+    rels = _todas_las_rutas(tmp_path)
+    segun_git = _ignoradas_segun_git(tmp_path, rels)
+
+    distintas = [
+        (rel, rel in segun_git) for rel in rels
+        if server.ruta_ignorada(tmp_path, rel) != (rel in segun_git)
+    ]
+    assert distintas == []
+
+
+def test_recorrido_coincide_con_git(tmp_path):
+    _crear_proyecto(tmp_path)
+    rels = _todas_las_rutas(tmp_path)
+    segun_git = _ignoradas_segun_git(tmp_path, rels)
+
+    recorridas = {rel for rel, _entry, es_carpeta in server._recorrer(tmp_path) if not es_carpeta}
+    assert recorridas == set(rels) - segun_git
+
+
+def test_cambio_en_gitignore_invalida_las_reglas_cacheadas(tmp_path):
+    _crear_proyecto(tmp_path)
+    assert not server.ruta_ignorada(tmp_path, "src/modulo.gd")
+
+    gitignore = tmp_path / ".gitignore"
+    gitignore.write_text(GITIGNORE + "src/modulo.gd\n", encoding="utf-8")
+    os.utime(gitignore, ns=(0, 1))  # mtime distinto aunque el reloj no avance
+    assert server.ruta_ignorada(tmp_path, "src/modulo.gd")
@@ -13,6 +13,8 @@ Implementa 10 pasos obligatorios (q0-q9) con 8 herramientas.
 import re
 import json
 import difflib
+import operator
+import itertools
 from pathlib import Path
 from datetime import datetime
 
@@ -1747,11 +1749,189 @@ def calcular_similitud(contenido1: str, contenido2: str) -> float:
     return difflib.SequenceMatcher(None, contenido1, contenido2).ratio()
 
 
+# Clones de tipo 2 (identificadores renombrados) en JS: el código se reduce a
+# tokens en los que identificadores y literales son marcadores, así
+# `let total = 10` y `let suma = 25` quedan iguales. Un arreglo de sufijos con
+# su LCP sobre los tokens de todos los sospechosos encuentra de una vez los
+# tramos comunes de al menos CLONES_TIPO2_MIN_TOKENS tokens.
+CLONES_TIPO2_MIN_TOKENS = 40  # Más corto coincide por pura sintaxis (~5 líneas)
+
+# Tokens de JS: cadenas, plantillas, comentarios (se descartan), palabras y símbolos
+_TOKENS_JS = re.compile(
+    r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|//[^\n]*|/\*.*?\*/|\w+|[^\w\s]',
+    re.DOTALL
+)
+
+# Palabras que se conservan al normalizar (el resto de palabras son identificadores)
+_PALABRAS_CLAVE_JS = frozenset((
+    "if", "else", "for", "while", "do", "switch", "case", "default", "break", "continue",
+    "return", "function", "class", "extends", "new", "delete", "typeof", "instanceof", "in",
+    "of", "var", "let", "const", "this", "super", "null", "undefined", "true", "false",
+    "try", "catch", "finally", "throw", "async", "await", "yield", "import", "export",
+    "from", "static", "get", "set", "void",
+))
+
+
+def tokens_tipo2(content: str) -> list:
+    """Tokens de JS sin comentarios: identificadores → "$id", cadenas y números → "$lit" """
+    tokens = []
+    for match in _TOKENS_JS.finditer(content):
+        token = match.group()
+        if token.startswith(("//", "/*")):
+            continue
+        if token[0] in "\"'`" or token[0].isdigit():
+            token = "$lit"
+        elif token not in _PALABRAS_CLAVE_JS and (token[0].isalpha() or token[0] == "_"):
+            token = "$id"
+        tokens.append(token)
+    return tokens
+
+
+def arreglo_de_sufijos(secuencia: list) -> list:
+    """Arreglo de sufijos de una secuencia de enteros, por duplicación de prefijos.
+
+    Cada ronda ordena por (rango de los k primeros, rango de los k siguientes) y
+    dobla k; termina en cuanto todos los rangos son distintos (como mucho log n rondas).
+    """
+    n = len(secuencia)
+    valores = {valor: r for r, valor in enumerate(sorted(set(secuencia)), 1)}
+    rango = [valores[valor] for valor in secuencia]  # 0 = más allá del final
+    sufijos = list(range(n))
+    k = 1
+    while n:
+        clave = [a * (n + 1) + b for a, b in zip(rango, itertools.chain(rango[k:], itertools.repeat(0, k)))]
+        sufijos.sort(key=clave.__getitem__)
+        ordenadas = [clave[i] for i in sufijos]
+        rangos = itertools.accumulate(map(operator.ne, ordenadas, itertools.chain([None], ordenadas)))
+        nuevo = [0] * n
+        for i, r in zip(sufijos, rangos):
+            nuevo[i] = r
+        rango = nuevo
+        if r == n:
+            break
+        k *= 2
+    return sufijos
+
+
+def lcp_de_sufijos(secuencia: list, sufijos: list) -> list:
+    """lcp[r] = prefijo común de los sufijos sufijos[r - 1] y sufijos[r] (Kasai, O(n))"""
+    n = len(sufijos)
+    posicion = [0] * n
+    for r, i in enumerate(sufijos):
+        posicion[i] = r
+    lcp = [0] * n
+    h = 0
+    for i in range(n):
+        r = posicion[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sufijos[r - 1]
+        while i + h < n and j + h < n and secuencia[i + h] == secuencia[j + h]:
+            h += 1
+        lcp[r] = h
+        if h:
+            h -= 1
+    return lcp
+
+
+def clones_tipo2(archivos_tokens: list) -> list:
+    """Tramos comunes de al menos CLONES_TIPO2_MIN_TOKENS tokens entre archivos distintos.
+
+    archivos_tokens = tokens normalizados de cada archivo (tokens_tipo2). Devuelve
+    [(i, inicio en i, j, inicio en j, longitud)] con i < j, en tokens.
+    """
+    vocabulario = {}
+    secuencia = []
+    archivo_de = []
+    inicios = []
+    for i, tokens in enumerate(archivos_tokens):
+        inicios.append(len(secuencia))
+        secuencia.extend(vocabulario.setdefault(token, len(vocabulario)) for token in tokens)
+        secuencia.append(-1 - i)  # Separador único: ningún tramo cruza de un archivo a otro
+        archivo_de.extend([i] * (len(tokens) + 1))
+
+    sufijos = arreglo_de_sufijos(secuencia)
+    lcp = lcp_de_sufijos(secuencia, sufijos)
+
+    clones = []
+    grupo = []  # Sufijos consecutivos con prefijo común >= mínimo
+    lcps = []  # lcps[k] = prefijo común de grupo[k - 1] y grupo[k]
+    for r in range(1, len(sufijos) + 1):
+        if r == len(sufijos) or lcp[r] < CLONES_TIPO2_MIN_TOKENS:
+            if grupo:
+                _emparejar_grupo(grupo, lcps, secuencia, archivo_de, inicios, clones)
+            grupo = []
+            lcps = []
+            continue
+        if not grupo:
+            grupo.append(sufijos[r - 1])
+            lcps.append(0)
+        grupo.append(sufijos[r])
+        lcps.append(lcp[r])
+    return clones
+
+
+def _emparejar_grupo(grupo: list, lcps: list, secuencia: list, archivo_de: list, inicios: list, clones: list) -> None:
+    """Empareja cada sufijo de un grupo del LCP con el más cercano de cada otro
+    archivo, hacia delante y hacia atrás.
+
+    Así cada tramo queda emparejado con todos los archivos que lo comparten
+    (un clon en muchos archivos sale en todos sus pares) y el coste es el
+    tamaño del grupo por el número de archivos, aunque un archivo repita el
+    mismo código muchas veces.
+    """
+    for sentido in (range(len(grupo)), range(len(grupo) - 1, -1, -1)):
+        ultimos = {}  # archivo → [sufijo más cercano, prefijo común con el actual]
+        anterior = None
+        for k in sentido:
+            if anterior is not None:
+                comun = lcps[max(k, anterior)]
+                for ultimo in ultimos.values():
+                    if comun < ultimo[1]:
+                        ultimo[1] = comun
+            q = grupo[k]
+            archivo_q = archivo_de[q]
+            previo = secuencia[q - 1]  # En la posición 0 es el separador del último archivo
+            for archivo_p, (p, longitud) in ultimos.items():
+                # Solo tramos maximales por la izquierda: si el token anterior también
+                # coincide, el tramo ya sale más largo desde una posición antes
+                if archivo_p != archivo_q and secuencia[p - 1] != previo:
+                    (a, pa), (b, pb) = sorted(((archivo_p, p), (archivo_q, q)))
+                    clones.append((a, pa - inicios[a], b, pb - inicios[b], longitud))
+            ultimos[archivo_q] = [q, len(secuencia)]
+            anterior = k
+
+
+def _cubiertos(tramos: list) -> int:
+    """Tokens cubiertos por la unión de tramos (inicio, longitud)"""
+    total = fin = 0
+    for inicio, longitud in sorted(tramos):
+        total += max(0, inicio + longitud - max(inicio, fin))
+        fin = max(fin, inicio + longitud)
+    return total
+
+
+def similitudes_tipo2(archivos_tokens: list) -> dict:
+    """{(i, j): similitud} con la fracción de tokens de ambos archivos cubierta por tramos comunes"""
+    tramos = {}
+    for a, inicio_a, b, inicio_b, longitud in clones_tipo2(archivos_tokens):
+        par = tramos.setdefault((a, b), ([], []))
+        par[0].append((inicio_a, longitud))
+        par[1].append((inicio_b, longitud))
+
+    return {
+        (a, b): (_cubiertos(tramos_a) + _cubiertos(tramos_b)) / (len(archivos_tokens[a]) + len(archivos_tokens[b]))
+        for (a, b), (tramos_a, tramos_b) in tramos.items()
+    }
+
+
 def detectar_duplicacion(archivos: list, project_path: Path, language: str) -> dict:
     """
     Detecta duplicación REAL usando enfoque híbrido:
     1. Filtra archivos con patrones sospechosos (NO métodos estándar)
-    2. Compara similitud de contenido entre archivos sospechosos
+    2. Compara similitud de contenido entre archivos sospechosos: en JS por
+       clones de tipo 2 (identificadores renombrados), en el resto con difflib
     3. Solo reporta duplicación si similitud > 60%
 
     Retorna:
@@ -1802,6 +1982,7 @@ def detectar_duplicacion(archivos: list, project_path: Path, language: str) -> d
                     archivos_sospechosos.append({
                         "archivo": archivo,
                         "contenido": content,
+                        "tokens": tokens_tipo2(content) if archivo.suffix.lower() == ".js" else None,
                         "patron": descripcion
                     })
                     patrones_encontrados[descripcion] = patrones_encontrados.get(descripcion, 0) + 1
@@ -1823,9 +2004,22 @@ def detectar_duplicacion(archivos: list, project_path: Path, language: str) -> d
     UMBRAL_SIMILITUD = 0.6  # 60% de similitud = duplicación
     duplicados = []
 
+    # JS con tokens suficientes: un solo arreglo de sufijos para todos los pares
+    js = [i for i, arch in enumerate(archivos_sospechosos)
+          if arch["tokens"] is not None and len(arch["tokens"]) >= CLONES_TIPO2_MIN_TOKENS]
+    similitudes_js = {
+        (js[a], js[b]): similitud
+        for (a, b), similitud in similitudes_tipo2([archivos_sospechosos[i]["tokens"] for i in js]).items()
+    }
+    js = set(js)
+
     for i, arch1 in enumerate(archivos_sospechosos):
-        for arch2 in archivos_sospechosos[i+1:]:
-            similitud = calcular_similitud(arch1["contenido"], arch2["contenido"])
+        for j in range(i + 1, len(archivos_sospechosos)):
+            arch2 = archivos_sospechosos[j]
+            if i in js and j in js:
+                similitud = similitudes_js.get((i, j), 0.0)
+            else:
+                similitud = calcular_similitud(arch1["contenido"], arch2["contenido"])
 
             if similitud >= UMBRAL_SIMILITUD:
                 duplicados.append({
@@ -0,0 +1,48 @@
+"""Duplicación de JS por clones de tipo 2 (identificadores renombrados)"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import server  # noqa: E402
+
+FUNCION = """\
+function handleClick{n}(evento{n}) {{
+    const destino{n} = document.querySelector("#panel-{n}");
+    if (!destino{n}) {{
+        return null;
+    }}
+    const total{n} = evento{n}.detail.items.length + {n};
+    for (let i{n} = 0; i{n} < total{n}; i{n}++) {{
+        destino{n}.appendChild(crearFila{n}(evento{n}.detail.items[i{n}], i{n}));
+    }}
+    destino{n}.classList.add("activo-{n}");
+    return total{n};
+}}
+"""
+
+
+def _copias(tmp_path: Path, cantidad: int) -> list:
+    archivos = []
+    for n in range(cantidad):
+        archivo = tmp_path / f"componente_{n}.js"
+        archivo.write_text(FUNCION.format(n=n), encoding="utf-8")
+        archivos.append(archivo)
+    return archivos
+
+
+def test_clon_en_muchos_archivos_sale_en_todos_los_pares(tmp_path):
+    for cantidad in (12, 15):
+        archivos = _copias(tmp_path, cantidad)
+        tokens = [server.tokens_tipo2(archivo.read_text(encoding="utf-8")) for archivo in archivos]
+
+        similitudes = server.similitudes_tipo2(tokens)
+        assert len(similitudes) == cantidad * (cantidad - 1) // 2
+        assert min(similitudes.values()) == 1.0
+
+
+def test_detectar_duplicacion_reporta_todos_los_pares_js(tmp_path):
+    archivos = _copias(tmp_path, 15)
+
+    resultado = server.detectar_duplicacion(archivos, tmp_path, "web")
+    assert resultado["es_duplicacion"]
+    assert len(resultado["archivos_duplicados"]) == 15 * 14 // 2